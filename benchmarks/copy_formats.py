@@ -0,0 +1,79 @@
+"""
+    Compares csv and binary COPY for Db.big_insert on a synthetic song streams frame,
+    shaped like the tmp_streams table in NielsenDailyUSPipeline.songsDbUpdates.
+
+    Run from the folder above the package (loads into a temp table and rolls back):
+
+        python -m rca.benchmarks.copy_formats --rows 5000000 --db rca_db_dev
+"""
+
+import argparse
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from ..lib.Db import Db
+
+DAYS = 14
+
+
+def build_streams(rows):
+
+    """
+        One row per song per day, like the melted nielsen song file.
+    """
+
+    songs = int(np.ceil(rows / DAYS))
+    dates = [datetime.strftime(datetime(2024, 1, 14) - timedelta(i), '%Y-%m-%d') for i in range(DAYS)]
+    rng = np.random.default_rng(0)
+
+    df = pd.DataFrame({
+        'unified_song_id': np.repeat(np.arange(songs).astype(str).astype(object), DAYS),
+        'date': np.tile(np.array(dates, dtype=object), songs),
+        'streams': rng.integers(0, 1000000, songs * DAYS),
+        'ad_supported': rng.integers(0, 500000, songs * DAYS),
+        'premium': rng.integers(0, 500000, songs * DAYS)
+    })
+
+    return df.iloc[:rows].reset_index(drop=True)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000000)
+    parser.add_argument('--db', default='rca_db_dev')
+    args = parser.parse_args()
+
+    df = build_streams(args.rows)
+    print(f'Built {len(df)} rows')
+
+    db = Db(args.db)
+    db.connect()
+
+    for copy_format in ['csv', 'binary']:
+
+        string = """
+            create temp table tmp_streams (
+                unified_song_id text,
+                date date,
+                streams int,
+                ad_supported int,
+                premium int
+            );
+        """
+        db.execute(string)
+
+        start = perf_counter()
+        db.big_insert(df, 'tmp_streams', copy_format=copy_format)
+        print(f'{copy_format}: {perf_counter() - start:.2f}s')
+
+        db.rollback()
+
+    db.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+    Compares the old per row label scan (df.apply with `label in string` for every label) with
+    compile_label_matcher + match_labels on synthetic copyrights.
+
+    Run from the folder above the package, optionally with the real label list from the database:
+
+        python -m rca.benchmarks.label_matching --songs 50000 --labels 2000
+        python -m rca.benchmarks.label_matching --songs 50000 --db rca_db_dev
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from ..lib.Db import Db
+from ..lib.functions import compile_label_matcher, match_labels
+
+WORDS = ['records', 'music', 'entertainment', 'sound', 'media', 'group', 'label', 'recordings', 'audio', 'productions']
+
+
+def build_labels(n, rng):
+
+    names = [''.join(rng.choice(list('abcdefghijklmnopqrstuvwxyz'), rng.integers(4, 10))) for _ in range(n)]
+    return [f'{name} {rng.choice(WORDS)}' for name in names]
+
+
+def build_copyrights(songs, labels, rng):
+
+    """
+        Spotify style copyright lines, about a fifth of them mention one of the labels.
+    """
+
+    unsigned = build_labels(songs, rng)
+    signed = rng.random(songs) < 0.2
+    picks = rng.integers(0, len(labels), songs)
+
+    copyrights = []
+    for i in range(songs):
+        label = labels[picks[i]].title() if signed[i] else unsigned[i]
+        copyrights.append(f'(P) 2023 {label}, under exclusive license')
+
+    return pd.DataFrame({ 'copyrights': copyrights, 'signed': False })
+
+
+def apply_scan(df, labels):
+
+    def fn(row, labels):
+
+        if row['signed'] == True:
+            return True
+
+        df_label = row['copyrights'].lower()
+        return bool([ele for ele in labels if(ele.lower() in df_label)])
+
+    return df.apply(fn, labels=labels, axis=1).to_numpy(dtype=bool)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--songs', type=int, default=50000)
+    parser.add_argument('--labels', type=int, default=2000)
+    parser.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+
+    if args.db is not None:
+        db = Db(args.db)
+        db.connect()
+        labels = db.execute('select label from misc.list_of_labels')['label'].tolist()
+        db.disconnect()
+    else:
+        labels = build_labels(args.labels, rng)
+
+    df = build_copyrights(args.songs, labels, rng)
+    print(f'Built {len(df)} copyrights, {len(labels)} labels')
+
+    start = perf_counter()
+    expected = apply_scan(df, labels)
+    apply_seconds = perf_counter() - start
+
+    start = perf_counter()
+    matcher = compile_label_matcher(labels)
+    compile_seconds = perf_counter() - start
+
+    start = perf_counter()
+    result = (df['signed'] == True).to_numpy() | match_labels(df['copyrights'], matcher)
+    match_seconds = perf_counter() - start
+
+    if (expected != result).any():
+        raise Exception(f'Matchers disagree on {(expected != result).sum()} rows')
+
+    print(f'{expected.sum()} signed')
+    print(f'apply: {apply_seconds:.3f}s')
+    print(f'matcher: {match_seconds:.3f}s + {compile_seconds:.3f}s to compile ({apply_seconds / (match_seconds + compile_seconds):.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+    Compares the old melt + merge reshape of the daily song streams with reshape_song_streams
+    (NielsenDailyUSPipeline.prepareSongData) on a synthetic song file.
+
+    Run from the folder above the package (no database needed):
+
+        python -m rca.benchmarks.song_streams_reshape --songs 50000
+"""
+
+import argparse
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from ..lib.NielsenDailyUSPipeline import reshape_song_streams
+
+DAYS = 14
+REPEATS = 5
+
+
+def build_measures(songs):
+
+    """
+        The total, premium and ad supported frames like cleanSongs returns them,
+        one column per date plus the unified_song_id (with some missing values).
+    """
+
+    dates = [datetime.strftime(datetime(2024, 1, 14) - timedelta(i), '%Y-%m-%d') for i in range(DAYS)]
+    ids = np.arange(songs).astype(str).astype(object)
+    rng = np.random.default_rng(0)
+
+    measures = []
+    for _ in range(3):
+        values = rng.integers(0, 1000000, (songs, DAYS)).astype('float64')
+        values[rng.random((songs, DAYS)) < 0.01] = np.nan
+        df = pd.DataFrame(values, columns=dates)
+        df['unified_song_id'] = ids
+        measures.append(df)
+
+    return measures
+
+
+def melt_merge(total, premium, ad_supported):
+
+    total = total.melt(id_vars='unified_song_id', var_name='date', value_name='streams')
+    ad_supported = ad_supported.melt(id_vars='unified_song_id', var_name='date', value_name='ad_supported')
+    premium = premium.melt(id_vars='unified_song_id', var_name='date', value_name='premium')
+
+    streams = pd.merge(total, ad_supported, on=['unified_song_id', 'date'])
+    streams = pd.merge(streams, premium, on=['unified_song_id', 'date'])
+
+    streams['streams'] = streams['streams'].fillna(0).astype('int')
+    streams['premium'] = streams['premium'].fillna(0).astype('int')
+    streams['ad_supported'] = streams['ad_supported'].fillna(0).astype('int')
+
+    return streams
+
+
+def best_of(func, measures):
+
+    best = None
+    for _ in range(REPEATS):
+        start = perf_counter()
+        result = func(*measures)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--songs', type=int, default=50000)
+    args = parser.parse_args()
+
+    measures = build_measures(args.songs)
+    print(f'Built {args.songs} songs x {DAYS} days')
+
+    melt_seconds, expected = best_of(melt_merge, measures)
+    reshape_seconds, result = best_of(reshape_song_streams, measures)
+
+    # Same rows regardless of order
+    columns = ['unified_song_id', 'date', 'streams', 'ad_supported', 'premium']
+    expected = expected[columns].sort_values(['unified_song_id', 'date']).reset_index(drop=True)
+    result = result[columns].sort_values(['unified_song_id', 'date']).reset_index(drop=True)
+    pd.testing.assert_frame_equal(expected, result, check_dtype=False)
+
+    print(f'melt + merge: {melt_seconds:.3f}s')
+    print(f'reshape: {reshape_seconds:.3f}s ({melt_seconds / reshape_seconds:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
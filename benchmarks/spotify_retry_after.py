@@ -0,0 +1,96 @@
+"""
+    Checks that Spotify.request_wrapper honours Retry-After on a (mocked) 429, and that other error
+    statuses back off without being counted as rate limiting.
+
+    Run from the folder above the package (no network or spotify token needed):
+
+        python -m rca.benchmarks.spotify_retry_after
+"""
+
+import json
+from time import perf_counter
+
+import requests
+from requests.adapters import BaseAdapter
+
+from ..lib.RateLimiter import RateLimiter
+from ..lib.Spotify import Spotify, create_spotipy_client
+
+RETRY_AFTER = 3 # seconds
+
+
+class MockAdapter(BaseAdapter):
+
+    """
+        Answers every request with the next status in statuses, then 200 with an empty album list.
+    """
+
+    def __init__(self, statuses, headers):
+        super().__init__()
+        self.statuses = list(statuses)
+        self.headers = headers
+        self.sent = 0
+
+    def send(self, request, **kwargs):
+
+        self.sent += 1
+        status = self.statuses.pop(0) if len(self.statuses) > 0 else 200
+
+        res = requests.Response()
+        res.status_code = status
+        res.url = request.url
+        res.request = request
+        res.headers.update(self.headers if status != 200 else {})
+        res._content = json.dumps({ 'albums': [] } if status == 200 else { 'error': { 'status': status, 'message': 'mocked' } }).encode()
+
+        return res
+
+    def close(self):
+        pass
+
+
+def build_client(statuses, headers):
+
+    """
+        A Spotify client without going through the token prompt, its spotipy client is built
+        exactly like Spotify.create builds it with the mock adapter mounted on the session.
+    """
+
+    spotify = Spotify.__new__(Spotify)
+    spotify.retries = 5
+    spotify.limiter = RateLimiter(100, 100)
+    spotify.token_expires_at = float('inf')
+    spotify.sp = create_spotipy_client('token')
+
+    adapter = MockAdapter(statuses, headers)
+    spotify.sp._session.mount('https://', adapter)
+
+    return spotify, adapter
+
+
+def main():
+
+    # 429 with Retry-After, we should wait it out and then get through
+    spotify, adapter = build_client([429], { 'Retry-After': str(RETRY_AFTER) })
+
+    start = perf_counter()
+    spotify.fetchAlbums(['album'])
+    elapsed = perf_counter() - start
+
+    if spotify.limiter.stats['rate_limited'] != 1 or elapsed < RETRY_AFTER or adapter.sent != 2:
+        raise Exception(f'429 not handled: {spotify.limiter.summary()} after {elapsed:.2f}s, {adapter.sent} requests')
+
+    print(f'429 with Retry-After {RETRY_AFTER}: blocked for {elapsed:.2f}s ({spotify.limiter.summary()})')
+
+    # 5xx shouldn't hold anybody back like a 429 does
+    spotify, adapter = build_client([500, 503], {})
+    spotify.fetchAlbums(['album'])
+
+    if spotify.limiter.stats['rate_limited'] != 0 or adapter.sent != 3:
+        raise Exception(f'5xx counted as rate limiting: {spotify.limiter.summary()}, {adapter.sent} requests')
+
+    print(f'500 / 503: backed off without rate limiting ({spotify.limiter.summary()})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+from .Metrics import count_http_call
+from .RateLimiter import parse_retry_after
+from .Spotify import (Spotify, cleanArtistName, cleanTitleAndArtist,
+                      matchArtistByName, matchTrackByArtist, matchTrackByTitle,
+                      titleAndArtistKey, transformAlbumData,
+                      transformArtistData, transformArtistTopTrack,
+                      transformTrackData)
+
+SPOTIFY_API_URL = 'https://api.spotify.com/v1'
+SPOTIFY_CONCURRENCY = 10 # requests we have in flight at once
+SPOTIFY_REQUEST_TIMEOUT = 10 # seconds
+SPOTIFY_RETRIES = 5
+
+# Max ids per request for the batch endpoints
+SPOTIFY_BATCH_SIZES = {
+    'tracks': 50,
+    'albums': 20,
+    'artists': 50,
+    'audio-features': 100
+}
+
+# What we cache the responses of each batch endpoint as (see SpotifyCache)
+SPOTIFY_CACHE_KINDS = {
+    'tracks': 'track',
+    'albums': 'album',
+    'artists': 'artist',
+    'audio-features': 'audio_features'
+}
+
+
+# Spotify client that makes its requests concurrently
+class AsyncSpotify:
+
+    """
+        Has the same api methods as Spotify (as coroutines), and map to run one of them over a list of
+        ids / queries with up to `concurrency` requests in flight at once. The token comes from a
+        Spotify client so both share the same auth, rate limiter and response cache.
+
+        >>> spotify = AsyncSpotify()
+        >>> tracks = spotify.map(spotify.tracks, track_ids, chunksize=50, parse=True)
+        >>> results = spotify.map(spotify.searchByTitleAndArtist, list(zip(titles, artists)))
+    """
+
+    def __init__(self, spotify=None, concurrency=SPOTIFY_CONCURRENCY):
+
+        self.spotify = spotify or Spotify()
+        self.concurrency = concurrency
+        self.retries = SPOTIFY_RETRIES
+
+        # Only exist while map is running
+        self.session = None
+        self.semaphore = None
+        self.token_lock = None
+
+    def test(self):
+
+        # Straight to the api, not through the search cache
+        self.map(self.request, [('/search', { 'q': 'John Mayer', 'type': 'artist', 'limit': 1 })])
+        print('Successful connection to Spotify Api')
+
+    def map(self, func, items, chunksize=None, **kwargs):
+
+        """
+            Run func (one of the coroutines below) for every item concurrently and return the results in order.
+            Tuples are unpacked into arguments, any kwargs are passed along to each call.
+
+            With a chunksize the items are sent in batches (e.g. 50 track ids per request)
+            and the results are flattened back into one list.
+        """
+
+        items = list(items)
+
+        if chunksize is not None:
+            items = [items[pos:pos + chunksize] for pos in range(0, len(items), chunksize)]
+
+        if len(items) == 0:
+            return []
+
+        try:
+            asyncio.get_running_loop()
+            loop_running = True
+        except RuntimeError:
+            loop_running = False
+
+        # asyncio.run can't be called from inside a running event loop (e.g. a jupyter notebook),
+        # so there we run ours on a thread of its own and wait for it
+        if loop_running:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                results = executor.submit(asyncio.run, self.gather(func, items, **kwargs)).result()
+        else:
+            results = asyncio.run(self.gather(func, items, **kwargs))
+
+        if chunksize is not None:
+            results = [result for chunk in results for result in chunk]
+
+        return results
+
+    async def gather(self, func, items, **kwargs):
+
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.token_lock = asyncio.Lock()
+        timeout = aiohttp.ClientTimeout(total=SPOTIFY_REQUEST_TIMEOUT)
+
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+
+            self.session = session
+
+            try:
+                return await asyncio.gather(*[
+                    func(*item, **kwargs) if isinstance(item, tuple) else func(item, **kwargs)
+                    for item in items
+                ])
+            finally:
+                self.session = None
+                self.semaphore = None
+                self.token_lock = None
+
+    async def refresh(self, force=False):
+
+        """
+            Refresh the token on the Spotify client when it's about to expire (or right away with force),
+            only one coroutine refreshes while the rest wait for it.
+        """
+
+        token = self.spotify.auth_token
+
+        async with self.token_lock:
+
+            # Someone else already refreshed it while we were waiting
+            if self.spotify.auth_token != token:
+                return
+
+            if force == True or self.spotify.tokenExpired():
+                await asyncio.to_thread(self.spotify.refresh)
+
+    async def request(self, path, params=None):
+
+        """
+            GET an endpoint of the api, retrying like Spotify.request_wrapper does.
+        """
+
+        limiter = self.spotify.limiter
+
+        for attempt in range(self.retries):
+
+            if self.spotify.tokenExpired():
+                await self.refresh()
+
+            try:
+
+                async with self.semaphore:
+
+                    await limiter.acquire_async()
+
+                    count_http_call()
+                    headers = { 'Authorization': self.spotify.auth_token }
+
+                    async with self.session.get(SPOTIFY_API_URL + path, params=params, headers=headers) as res:
+
+                        if res.status == 200:
+                            return await res.json()
+
+                        print(f'Spotify error {res.status}: {await res.text()}')
+
+                        # Too many requests, everybody waits as long as spotify asks us to
+                        if res.status == 429:
+                            limiter.rate_limited(parse_retry_after(res.headers))
+                            continue
+
+                # Our token expired early
+                if res.status == 401:
+                    await self.refresh(force=True)
+                    continue
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(str(e))
+
+            await limiter.wait_async(limiter.backoff(attempt))
+
+        raise Exception(f'Error getting spotify data from: {path} {params}')
+
+    async def search(self, q, type, limit):
+
+        cache = self.spotify.cache
+        key = f'{type}:{limit}:{q}'
+
+        found, missing = cache.lookup('search', [key])
+        if len(missing) == 0:
+            return found[key]
+
+        res = await self.request('/search', { 'q': q, 'type': type, 'limit': limit })
+        items = [i for i in res[f'{type}s']['items'] if i is not None]
+
+        cache.store('search', { key: items })
+
+        return items
+
+    async def batch(self, path, ids, key):
+
+        """
+            Entities by id from one of the batch endpoints in the same order, only requesting the ones we haven't cached.
+        """
+
+        if len(ids) > SPOTIFY_BATCH_SIZES[path]:
+            raise Exception(f'Maximum of {SPOTIFY_BATCH_SIZES[path]} ids for {path}')
+
+        cache = self.spotify.cache
+        kind = SPOTIFY_CACHE_KINDS[path]
+
+        found, missing = cache.lookup(kind, ids)
+
+        if len(missing) > 0:
+            res = await self.request(f'/{path}', { 'ids': ','.join(missing) })
+            fetched = { i['id']: i for i in res[key] if i is not None }
+            cache.store(kind, fetched)
+            found.update(fetched)
+
+        return [found[i] for i in ids if i in found]
+
+    async def searchArtists(self, q, limit=25):
+        return await self.search(q, 'artist', limit)
+
+    async def searchTracks(self, q, limit=25):
+        return await self.search(q, 'track', limit)
+
+    async def albums(self, album_ids, parse=False):
+        """Maximum of 20 ids"""
+
+        res = await self.batch('albums', album_ids, 'albums')
+
+        if parse is True:
+            return [transformAlbumData(i) for i in res]
+
+        return res
+
+    async def tracks(self, track_ids, parse=False):
+        """Maximum of 50 ids"""
+
+        res = await self.batch('tracks', track_ids, 'tracks')
+
+        if parse is True:
+            return [transformTrackData(i) for i in res]
+
+        return res
+
+    async def artists(self, artist_ids, parse=False):
+        """Maximum of 50 ids"""
+
+        res = await self.batch('artists', artist_ids, 'artists')
+
+        if parse is True:
+            return [transformArtistData(i) for i in res]
+
+        return res
+
+    async def audio_features(self, track_ids):
+        """Maximum of 100 ids"""
+
+        return await self.batch('audio-features', track_ids, 'audio_features')
+
+    async def artist_top_tracks(self, artist_id):
+
+        cache = self.spotify.cache
+
+        found, missing = cache.lookup('artist_top_tracks', [artist_id])
+        if len(missing) == 0:
+            return found[artist_id]
+
+        res = await self.request(f'/artists/{artist_id}/top-tracks', { 'country': 'US' })
+        tracks = [i for i in res['tracks'] if i is not None]
+
+        cache.store('artist_top_tracks', { artist_id: tracks })
+
+        return tracks
+
+    async def artist_top_track(self, artist_id, parse=False):
+        """Get the top track for an artist"""
+
+        res = await self.artist_top_tracks(artist_id)
+
+        if len(res) == 0:
+            return None
+
+        if parse is True:
+            return transformArtistTopTrack(artist_id, res[0])
+
+        return res[0]
+
+    async def searchArtistByName(self, name):
+
+        name = cleanArtistName(name)
+
+        if len(name) == 0:
+            return None
+
+        items = await self.searchArtists(name, limit=20)
+
+        return matchArtistByName(name, items)
+
+    async def searchByTitleAndArtist(self, track, artist):
+
+        """
+            Same strategies as Spotify.searchByTitleAndArtist.
+        """
+
+        title, artist = cleanTitleAndArtist(track, artist)
+
+        if len(artist) == 0 or len(title) == 0:
+            return None
+
+        cache = self.spotify.cache
+
+        # Don't search again for songs we couldn't find recently
+        key = titleAndArtistKey(title, artist)
+        if cache.known_miss(key):
+            return None
+
+        track_items = await self.searchTracks('track:{} artist:{}'.format(title, artist), limit=10)
+
+        info = matchTrackByTitle(track, track_items)
+
+        if info is None:
+            track_items = await self.searchTracks('track:{}'.format(title), limit=20)
+            info = matchTrackByArtist(artist, track_items)
+
+        if info is None:
+            cache.record_miss(key)
+        else:
+            cache.clear_miss(key)
+
+        return info
@@ -1,9 +1,21 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
 import boto3
+from boto3.s3.transfer import TransferConfig
 
 from .env import AWS_ACCESS_KEY, AWS_SECRET_KEY
 
 S3_BUCKET_NAME = 'busd-rca-projects'
 
+# Default transfer settings, files bigger than TRANSFER_CHUNKSIZE are sent in parts of that size
+# with up to TRANSFER_CONCURRENCY parts in flight per file. upload_many/download_many move
+# TRANSFER_WORKERS files at a time on top of that.
+TRANSFER_CHUNKSIZE = 16 * 1024 * 1024
+TRANSFER_CONCURRENCY = 10
+TRANSFER_WORKERS = 4
+
 class Aws:
 
     def __init__(self):
@@ -40,7 +52,7 @@ class Aws:
 
         try:
 
-            self.s3.upload_file(local_fullfile, S3_BUCKET_NAME, s3_fullfile)
+            self.s3.upload_file(local_fullfile, S3_BUCKET_NAME, s3_fullfile, Config=transfer_config())
             print('INFO: Uploaded To S3 Successfully')
             return True
 
@@ -54,6 +66,42 @@ class Aws:
             print(str(e))
             return False
 
+    def upload_fileobj_s3(self, fileobj, s3_fullfile):
+
+        """
+            Upload an in memory buffer / open file to the s3 bucket, raises if it fails
+            @param fileobj | binary file like object
+            @param s3_fullfile
+        """
+
+        if self.s3 is None:
+            raise Exception('Aws s3 client not connected, you must first call self.connect_s3()')
+
+        self.s3.upload_fileobj(fileobj, S3_BUCKET_NAME, s3_fullfile, Config=transfer_config())
+
+    def delete_files_s3(self, s3_fullfiles):
+
+        """
+            Delete many files from the s3 bucket in as few requests as possible
+            @param s3_fullfiles | list of keys
+        """
+
+        if self.s3 is None:
+            raise Exception('Aws s3 client not connected, you must first call self.connect_s3()')
+
+        # delete_objects takes at most 1000 keys per request
+        for i in range(0, len(s3_fullfiles), 1000):
+
+            try:
+
+                objects = [{ 'Key': key } for key in s3_fullfiles[i:i + 1000]]
+                self.s3.delete_objects(Bucket=S3_BUCKET_NAME, Delete={ 'Objects': objects, 'Quiet': True })
+
+            except BaseException as e:
+                print(str(e))
+
+        print(f'INFO: Deleted {len(s3_fullfiles)} files successfully')
+
     def delete_file_s3(self, s3_fullfile):
 
         if self.s3 is None:
@@ -78,7 +126,7 @@ class Aws:
             raise Exception('Aws s3 client not connected, you must first call self.connect_s3()')
         
         try:
-            self.s3.download_file(S3_BUCKET_NAME, s3_fullfile, local_fullfile)
+            self.s3.download_file(S3_BUCKET_NAME, s3_fullfile, local_fullfile, Config=transfer_config())
             print(f'INFO: Downloaded {s3_fullfile} to {local_fullfile} successfully')
             return True
             
@@ -90,10 +138,107 @@ class Aws:
             print(f'ERROR downloading file: {str(e)}')
             return False
 
-    def list_s3_files(self, prefix=''):
+    def upload_many(self, files, workers=TRANSFER_WORKERS, chunksize=TRANSFER_CHUNKSIZE, concurrency=TRANSFER_CONCURRENCY):
+
+        """
+            Upload many files to the s3 bucket at once.
+
+            @param files | list of (source, s3_fullfile), source is either a local file path or a
+                           binary file like object (ex. io.BytesIO) so nothing has to be written to disk first
+            @param workers | how many files to upload at the same time
+            @param chunksize | multipart chunk size in bytes
+            @param concurrency | parts uploaded at the same time for each file
+
+            @returns list of { 's3_fullfile', 'success', 'bytes', 'seconds', 'mb_per_second' }, in the same order as files
+        """
+
+        if self.s3 is None:
+            raise Exception('Aws s3 client not connected, you must first call self.connect_s3()')
+
+        config = transfer_config(chunksize, concurrency)
+
+        def upload(file):
+
+            source, s3_fullfile = file
+
+            if isinstance(source, str):
+                return self.transfer(s3_fullfile, lambda callback: self.s3.upload_file(source, S3_BUCKET_NAME, s3_fullfile, Config=config, Callback=callback))
+
+            return self.transfer(s3_fullfile, lambda callback: self.s3.upload_fileobj(source, S3_BUCKET_NAME, s3_fullfile, Config=config, Callback=callback))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(upload, files))
+
+    def download_many(self, files, workers=TRANSFER_WORKERS, chunksize=TRANSFER_CHUNKSIZE, concurrency=TRANSFER_CONCURRENCY):
+
+        """
+            Download many files from the s3 bucket at once.
+
+            @param files | list of (s3_fullfile, destination), destination is either a local file path
+                           or a writable binary file like object
+            @param workers | how many files to download at the same time
+            @param chunksize | multipart chunk size in bytes
+            @param concurrency | parts downloaded at the same time for each file
+
+            @returns list of { 's3_fullfile', 'success', 'bytes', 'seconds', 'mb_per_second' }, in the same order as files
+        """
+
+        if self.s3 is None:
+            raise Exception('Aws s3 client not connected, you must first call self.connect_s3()')
+
+        config = transfer_config(chunksize, concurrency)
+
+        def download(file):
+
+            s3_fullfile, destination = file
+
+            if isinstance(destination, str):
+                return self.transfer(s3_fullfile, lambda callback: self.s3.download_file(S3_BUCKET_NAME, s3_fullfile, destination, Config=config, Callback=callback))
+
+            return self.transfer(s3_fullfile, lambda callback: self.s3.download_fileobj(S3_BUCKET_NAME, s3_fullfile, destination, Config=config, Callback=callback))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(download, files))
+
+    def transfer(self, s3_fullfile, run):
+
+        """
+            Run a single upload/download, timing it and counting the bytes that went through.
+        """
+
+        transferred = [0]
+        lock = threading.Lock()
+
+        # boto calls this from its own threads as parts complete
+        def callback(n):
+            with lock:
+                transferred[0] += n
+
+        result = { 's3_fullfile': s3_fullfile, 'success': False }
+        start = perf_counter()
+
+        try:
+            run(callback)
+            result['success'] = True
+        except BaseException as e:
+            print(f'ERROR transferring {s3_fullfile}: {str(e)}')
+
+        seconds = perf_counter() - start
+        result['bytes'] = transferred[0]
+        result['seconds'] = round(seconds, 3)
+        result['mb_per_second'] = round(transferred[0] / (1024 * 1024) / seconds, 2) if seconds > 0 else 0
+
+        if result['success'] == True:
+            print(f'INFO: Transferred {s3_fullfile} ({transferred[0] / (1024 * 1024):.1f} MB in {seconds:.1f}s, {result["mb_per_second"]} MB/s)')
+
+        return result
+
+    def list_s3_files(self, prefix='', raise_errors=False):
         """
         List files in the S3 bucket with optional prefix filter
         @param prefix: Optional prefix to filter files
+        @param raise_errors: Raise if the listing fails instead of returning an empty list,
+                             for callers that can't tell "no files" apart from "couldn't list"
         @return: List of file keys
         """
         
@@ -101,13 +246,23 @@ class Aws:
             raise Exception('Aws s3 client not connected, you must first call self.connect_s3()')
         
         try:
-            response = self.s3.list_objects_v2(Bucket=S3_BUCKET_NAME, Prefix=prefix)
-            
-            if 'Contents' in response:
-                return [obj['Key'] for obj in response['Contents']]
-            else:
-                return []
+
+            # list_objects_v2 returns at most 1000 keys at a time, so page through all of them
+            keys = []
+            paginator = self.s3.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=prefix):
+                keys.extend([obj['Key'] for obj in page.get('Contents', [])])
+
+            return keys
                 
         except BaseException as e:
             print(f'ERROR listing files: {str(e)}')
-            return []
\ No newline at end of file
+
+            if raise_errors:
+                raise
+
+            return []
+
+
+def transfer_config(chunksize=TRANSFER_CHUNKSIZE, concurrency=TRANSFER_CONCURRENCY):
+    return TransferConfig(multipart_threshold=chunksize, multipart_chunksize=chunksize, max_concurrency=concurrency)
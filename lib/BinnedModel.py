@@ -31,16 +31,16 @@ class BinnedModel:
             Get the model from the database
         """
 
+        db = Db('rca_db_prod')
+
         try:
 
-            db = Db('rca_db_prod')
             db.connect()
 
             table = sql.Identifier('models', name)
             string = sql.SQL('select * from {}').format(table)
 
             model = db.execute(string)
-            db.disconnect()
 
             return model
 
@@ -48,6 +48,10 @@ class BinnedModel:
             print(str(e))
             raise Exception(f'Error getting model with name {name} are you sure it exists?')
 
+        finally:
+            # Hand the connection back to the pool even if the query failed
+            db.disconnect()
+
     @staticmethod
     def build_db_model(df, name):
 
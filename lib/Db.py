@@ -1,5 +1,15 @@
+import gzip
+import hashlib
+import io
+import json
 import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from time import perf_counter
+from uuid import uuid4
 
 import numpy as np
 import pandas as pd
@@ -8,9 +18,11 @@ import psycopg2.extras
 from psycopg2 import sql
 from psycopg2.extensions import AsIs, register_adapter
 
-from .Aws import Aws
+from .Aws import S3_BUCKET_NAME, Aws
+from .Metrics import count_rows_read, count_rows_written
 from .env import (AWS_ACCESS_KEY, AWS_SECRET_KEY, RCA_DB_DEV, RCA_DB_PROD,
-                  REPORTING_DB, TMP_FOLDER)
+                  REPORTING_DB, REPORTING_DB_MAX_CONNECTIONS, TMP_FOLDER,
+                  UNLOAD_CACHE_FOLDER)
 
 
 # Numpy type int64 adapter
@@ -23,12 +35,75 @@ def addapt_numpy_float64(numpy_float64):
 register_adapter(np.float64, addapt_numpy_float64)
 register_adapter(np.int64, addapt_numpy_int64)
 
+# Number of dataframe rows we serialize at a time when streaming a COPY into postgres
+COPY_CHUNKSIZE = 100000
+
+# Number of rows we fetch at a time from server side cursors in Db.iter_df
+FETCH_CHUNKSIZE = 50000
+
+# Postgres types we know how to write in binary COPY format, and the (big endian) numpy
+# type each one is sent as. Text types are sent as utf-8 bytes so they don't have one.
+BINARY_COPY_TYPES = {
+    'int2': '>i2',
+    'int4': '>i4',
+    'int8': '>i8',
+    'float4': '>f4',
+    'float8': '>f8',
+    'bool': '>u1',
+    'date': '>i4',
+    'timestamp': '>i8',
+    'text': None,
+    'varchar': None,
+    'bpchar': None
+}
+
+# big_insert_redshift splits frames into one gzipped part per cluster slice, but never
+# into parts smaller than REDSHIFT_PART_MIN_ROWS
+REDSHIFT_DEFAULT_SLICES = 4 # used if we can't read stv_slices
+REDSHIFT_SLICES_TIMEOUT = 10 # seconds we wait for a spare connection to read stv_slices with
+REDSHIFT_PART_MIN_ROWS = 10000
+REDSHIFT_UPLOAD_WORKERS = 8
+REDSHIFT_GZIP_LEVEL = 6
+
+# Db.unload_df downloads this many unload parts at once, and by default reuses
+# a cached result for the same query for UNLOAD_CACHE_TTL seconds
+UNLOAD_DOWNLOAD_WORKERS = 8
+UNLOAD_CACHE_TTL = 60 * 60
+
+# Slice counts we've looked up, by connection name
+_redshift_slices = {}
+
+# Postgres column types we give staging tables, keyed by what pandas infers a column to hold
+STAGING_TYPES = {
+    'integer': 'bigint',
+    'floating': 'double precision',
+    'mixed-integer-float': 'double precision',
+    'decimal': 'numeric',
+    'boolean': 'boolean',
+    'datetime64': 'timestamp',
+    'datetime': 'timestamp',
+    'date': 'date'
+}
+
+# Postgres stores dates/timestamps relative to 2000-01-01
+POSTGRES_EPOCH = np.datetime64('2000-01-01', 'us')
+
 db_connections = {
     'rca_db_prod': RCA_DB_PROD,
     'rca_db_dev': RCA_DB_DEV,
     'reporting_db': REPORTING_DB
 }
 
+# Maximum number of connections we hold open at once to each database. Checkouts past this
+# wait for a connection to be returned (the reporting redshift is shared with everyone else).
+POOL_MAX_CONNECTIONS = {
+    'rca_db_prod': 20,
+    'rca_db_dev': 20,
+    'reporting_db': REPORTING_DB_MAX_CONNECTIONS
+}
+POOL_TIMEOUT = 600 # seconds to wait for a connection before giving up
+POOL_PING_AFTER = 60 # seconds a connection can sit idle in the pool before we check it still works on checkout
+
 
 class Db:
 
@@ -77,13 +152,70 @@ class Db:
 
         self.conn.rollback()
 
-    def execute(self, string, params = {}):
+    def execute(self, string, params = {}, dtypes = None):
+
+        """
+            Run a query and return the results as a dataframe (None if the query doesn't return rows).
+
+            @param dtypes | Optional { column: dtype } map, those columns are built directly with that
+                            dtype instead of being inferred from python objects and converted later
+        """
 
         if self.cur is None:
             raise Exception(f'Cursor to {self.db_name} not active.')
 
         self.cur.execute(string, params)
-        return self.df()
+
+        # Statements that don't return anything (insert/update/delete/copy) report how many rows they touched
+        if self.cur.description is None:
+            count_rows_written(self.cur.rowcount)
+
+        return self.df(dtypes)
+
+    def iter_df(self, string, params = {}, chunksize = FETCH_CHUNKSIZE, dtypes = None):
+
+        """
+            Run a query on a server side (named) cursor and yield the results as dataframes
+            of at most chunksize rows, so we never hold the whole result on the client.
+            Always yields at least one (possibly empty) dataframe.
+
+            The cursor lives inside the current transaction, so temp tables created on this
+            connection are visible to it.
+
+            Example:
+                for df in db.iter_df('select * from misc.signed_artists', chunksize=10000):
+                    ...
+        """
+
+        if self.conn is None:
+            raise Exception(f'Connection to {self.db_name} not active.')
+
+        cur = self.conn.cursor(name=f'iter_df_{uuid4().hex}')
+        cur.itersize = chunksize
+
+        try:
+
+            cur.execute(string, params)
+
+            first = True
+            while True:
+
+                data = cur.fetchmany(chunksize)
+
+                if len(data) == 0 and first == False:
+                    break
+
+                cols = [i[0] for i in cur.description] if cur.description is not None else []
+                count_rows_read(len(data))
+                yield build_df(data, cols, dtypes)
+
+                first = False
+
+                if len(data) < chunksize:
+                    break
+
+        finally:
+            cur.close()
 
     def commit(self):
 
@@ -92,20 +224,38 @@ class Db:
 
         self.conn.commit()
 
-    def connect(self):
+    def connect(self, timeout=POOL_TIMEOUT):
+
+        """
+            Check out a connection from the process wide pool for this database
+            (see ConnectionPool), only opening a new one if none are idle.
+            Raises if none frees up within timeout seconds.
+        """
+
+        if self.conn is not None:
+            self.disconnect()
 
-        self.conn = psycopg2.connect(self.connection_string)
+        self.conn = get_pool(self.db_name).checkout(timeout)
         self.cur = self.conn.cursor()
         print(f'Connected to {self.db_name}...')
 
     def disconnect(self):
 
+        """
+            Return the connection to the pool. Anything that wasn't committed is rolled back.
+        """
+
         if self.cur is not None:
-            self.cur.close()
+            try:
+                self.cur.close()
+            except Exception:
+                pass
+            self.cur = None
 
         if self.conn is not None:
-            self.conn.close()
-            print(f'Connection to {self.db_name} closed...')
+            get_pool(self.db_name).checkin(self.conn)
+            self.conn = None
+            print(f'Connection to {self.db_name} released...')
 
     def cols(self):
 
@@ -121,7 +271,7 @@ class Db:
 
         return [i[0] for i in self.cur.description]
     
-    def df(self):
+    def df(self, dtypes=None):
 
         """
             Take what's in the cursor and return it as a dataframe
@@ -139,10 +289,11 @@ class Db:
 
         # Extract data from cursor
         data = self.cur.fetchall()
+        count_rows_read(len(data))
 
-        return pd.DataFrame(data, columns=cols)
+        return build_df(data, cols, dtypes)
 
-    def big_insert(self, df, table, commit=False):
+    def big_insert(self, df, table, commit=False, chunksize=COPY_CHUNKSIZE, copy_format='csv'):
 
         """
             Wrapper method around the psycopg2 copy_expert method
@@ -150,18 +301,237 @@ class Db:
 
             Quick method to copy data into the database that
             has a schema and table.
+
+            copy_format='binary' sends the data in postgres' binary COPY format, built straight
+            from the dataframe's numpy arrays using the table's column types. That skips formatting
+            and parsing csv text, which is most of the work for wide numeric frames. If any column
+            can't be written as its table type we fall back to csv.
         """
 
+        if copy_format == 'binary':
+
+            if self.cur is None:
+                raise Exception(f'Cursor to {self.db_name} not active.')
+
+            columns = self.binary_copy_columns(df, table)
+
+            if columns is not None:
+                string = create_copy_expert_string(table, df.columns, copy_format='binary')
+                self.cur.copy_expert(string, BinaryStream(columns, len(df), chunksize))
+                count_rows_written(len(df))
+
+                if commit is True:
+                    self.commit()
+
+                return
+
+            print(f'Unable to binary copy into {table}, falling back to csv')
+
+        elif copy_format != 'csv':
+            raise Exception(f'Invalid copy format: {copy_format}, only accepts csv or binary')
+
         # Build query
         string = create_copy_expert_string(table, df.columns)
 
         # Copy to database
-        self.copy_expert(df, string)
+        self.copy_expert(df, string, chunksize=chunksize)
 
         # Commit changes if we specify it
         if commit is True:
             self.commit()
 
+    def table_types(self, table):
+
+        """
+            Get the postgres type name of every column in a table (works for temp tables too).
+        """
+
+        string = """
+            select a.attname as name, t.typname as type
+            from pg_attribute a
+            join pg_type t on a.atttypid = t.oid
+            where a.attrelid = %(table)s::regclass
+                and a.attnum > 0
+                and not a.attisdropped
+        """
+        df = self.execute(string, { 'table': table })
+
+        return dict(zip(df['name'], df['type']))
+
+    def binary_copy_columns(self, df, table):
+
+        """
+            Prepare every column of the dataframe for a binary copy into table.
+            Returns None if any column can't be sent in binary format.
+        """
+
+        types = self.table_types(table)
+
+        columns = []
+        for col in df.columns:
+
+            if col not in types:
+                return None
+
+            column = prepare_binary_column(df[col], types[col])
+
+            if column is None:
+                print(f'Column {col} ({df[col].dtype}) can not be written as {types[col]} in binary format')
+                return None
+
+            columns.append(column)
+
+        return columns
+
+    @contextmanager
+    def staging(self, df, name, schema=None, types=None, reuse=False, analyze=False, copy_format='binary'):
+
+        """
+            Load a dataframe into a staging table for the duration of a with block, replaces the
+            usual "create temp table, big_insert, ..., drop table" steps.
+
+            @param df | dataframe to load, the table's columns are inferred from its dtypes
+            @param name | table name
+            @param schema | None for a temp table, otherwise an unlogged table is made in this schema
+            @param types | Optional { column: postgres type } map for columns where the inferred
+                           type isn't right (uuid, dates stored as strings...)
+            @param reuse | Instead of dropping the table when we're done, empty it and keep it around
+                           so the next staging() with the same name only has to truncate it
+            @param analyze | Run analyze after loading so the planner knows the table's size before we join on it
+            @param copy_format | big_insert copy format, binary falls back to csv if it can't be used
+
+            Yields the table name to use in queries. Temp tables that aren't reused are created
+            with on commit drop, so nothing is left behind if the block commits. If the block
+            raises nothing is cleaned up, rolling back the transaction takes care of it.
+
+            Example:
+                with self.db.staging(df, 'tmp_colors') as table:
+                    self.db.execute(f'update ... from {table} c where ...')
+        """
+
+        table = name if schema is None else f'{schema}.{name}'
+        identifier = sql.Identifier(name) if schema is None else sql.Identifier(schema, name)
+
+        exists = False
+        if reuse == True:
+            lookup = f'pg_temp.{name}' if schema is None else table
+            exists = self.execute('select to_regclass(%(table)s) is not null as exists', { 'table': lookup })['exists'].iloc[0]
+
+        if exists:
+            self.execute(sql.SQL('truncate {}').format(identifier))
+
+        else:
+
+            types = types or {}
+            columns = sql.SQL(', ').join([
+                sql.SQL('{} {}').format(sql.Identifier(col), sql.SQL(types.get(col) or infer_staging_type(df[col])))
+                for col in df.columns
+            ])
+
+            if schema is None:
+                on_commit = 'preserve rows' if reuse == True else 'drop'
+                string = sql.SQL('create temp table {} ({}) on commit ' + on_commit).format(identifier, columns)
+            else:
+                string = sql.SQL('create unlogged table {} ({})').format(identifier, columns)
+
+            self.execute(string)
+
+        self.big_insert(df, table, copy_format=copy_format)
+
+        if analyze == True:
+            self.execute(sql.SQL('analyze {}').format(identifier))
+
+        yield table
+
+        if reuse == True:
+            self.execute(sql.SQL('truncate {}').format(identifier))
+        else:
+            self.execute(sql.SQL('drop table if exists {}').format(identifier))
+
+    def upsert(self, df, table, key_columns, update_columns=None, only_if_changed=True):
+
+        """
+            Insert the rows of a dataframe into a table, updating the rows that already exist, in a
+            single insert ... on conflict do update statement.
+
+            @param df | rows to upsert, its columns must exist in table
+            @param table | schema.table
+            @param key_columns | columns of a unique index/constraint on table to match rows by
+            @param update_columns | columns to overwrite on existing rows, defaults to every non key column.
+                                    Pass an empty list to only insert new rows.
+            @param only_if_changed | only rewrite existing rows where one of the update_columns is
+                                     actually different, so unchanged rows don't generate dead tuples/WAL
+
+            @returns { 'inserts': <rows inserted>, 'updates': <rows updated> }
+
+            The dataframe is staged through Db.staging with the target table's column types. The staging
+            table is reused between calls with the same table & columns, so calling this in a loop
+            (ex. once per country) only truncates it instead of creating a new table every time.
+            If the dataframe has duplicate keys, the last row wins.
+        """
+
+        if update_columns is None:
+            update_columns = [col for col in df.columns if col not in key_columns]
+
+        df = df.drop_duplicates(subset=key_columns, keep='last')
+
+        # Stage using the target's types so the insert doesn't need any casts
+        types = self.table_types(table)
+        staging_types = { col: types[col] for col in df.columns if col in types }
+
+        key = table + ':' + ','.join(df.columns)
+        name = 'tmp_upsert_' + hashlib.md5(key.encode()).hexdigest()[:12]
+
+        columns = sql.SQL(', ').join([sql.Identifier(col) for col in df.columns])
+
+        if len(update_columns) == 0:
+            action = sql.SQL('nothing')
+
+        else:
+
+            action = sql.SQL('update set {}').format(sql.SQL(', ').join([
+                sql.SQL('{} = excluded.{}').format(sql.Identifier(col), sql.Identifier(col))
+                for col in update_columns
+            ]))
+
+            if only_if_changed == True:
+                action += sql.SQL(' where ({}) is distinct from ({})').format(
+                    sql.SQL(', ').join([sql.Identifier('t', col) for col in update_columns]),
+                    sql.SQL(', ').join([sql.Identifier('excluded', col) for col in update_columns])
+                )
+
+        # xmax is 0 on rows that were just inserted, rows that were skipped because nothing
+        # changed aren't returned at all
+        string = sql.SQL("""
+            with upserted as (
+                insert into {table} as t ({columns})
+                select {columns} from {staging}
+                on conflict ({keys}) do {action}
+                returning (xmax = 0) as inserted
+            )
+            select
+                count(*) filter (where inserted) as inserts,
+                count(*) filter (where not inserted) as updates
+            from upserted
+        """).format(
+            table=sql.Identifier(*table.split('.')),
+            columns=columns,
+            staging=sql.Identifier(name),
+            keys=sql.SQL(', ').join([sql.Identifier(col) for col in key_columns]),
+            action=action
+        )
+
+        with self.staging(df, name, types=staging_types, reuse=True):
+            results = self.execute(string)
+
+        counts = {
+            'inserts': int(results['inserts'].iloc[0]),
+            'updates': int(results['updates'].iloc[0])
+        }
+        count_rows_written(counts['inserts'] + counts['updates'])
+
+        return counts
+
     def big_insert_redshift(self, df, table):
 
         """
@@ -176,9 +546,10 @@ class Db:
             This is the same idea as self.big_insert except we have
             to do things a bit differently when inserting to a redshift db.
 
-            First we have to write the file to a csv locally, then we have
-            to upload it to s3, then we have to copy it into the redshift
-            from the s3 bucket.
+            The dataframe is split into gzipped csv parts (one per slice in the cluster so
+            every slice loads in parallel, fewer for small frames), which are uploaded to s3
+            concurrently straight from memory. Then we copy them all into redshift with a
+            single copy from a manifest, and delete the parts.
 
         """
 
@@ -186,49 +557,103 @@ class Db:
         # we must clean the dataframe of those
         df = df[df.columns].replace({ "'": '', '"': '' }, regex=True)
 
-        # Build files/folders
-        csv_filename = f'tmp_df_{datetime.now()}.csv'
-        local_csv_fullfile = os.path.join(TMP_FOLDER, csv_filename)
-        remote_csv_fullfile = os.path.join('tmp', csv_filename)
+        # Split into parts, but don't bother splitting small frames into tiny files
+        parts = min(self.redshift_slices(), max(1, int(np.ceil(len(df) / REDSHIFT_PART_MIN_ROWS))))
+        bounds = np.linspace(0, len(df), parts + 1).astype(int)
 
-        # Write the temporary file
-        df.to_csv(local_csv_fullfile, index=False, na_rep='NaN')
+        remote_folder = f'tmp/redshift_copy_{uuid4().hex}'
+        remote_manifest = f'{remote_folder}/manifest'
+        remote_parts = [f'{remote_folder}/part_{i:04d}.csv.gz' for i in range(parts)]
 
-        # Upload the file to the s3 bucket
         aws = Aws()
         aws.connect_s3()
-        aws.upload_s3(local_csv_fullfile, remote_csv_fullfile)
-
-        string_options = """
-            from 's3://busd-rca-projects/{}'
-            credentials 'aws_access_key_id={};aws_secret_access_key={}'
-            ignoreheader 1
-            delimiter ','
-            emptyasnull
-            escape removequotes
-        """.format(
-            remote_csv_fullfile,
-            AWS_ACCESS_KEY,
-            AWS_SECRET_KEY
-        )
 
-        # Copy the file from the s3 bucket over to the redshift
-        string = sql.SQL('copy {} ({})\n' + string_options).format(
-            sql.Identifier(*table.split('.')),
-            sql.SQL(',').join([sql.Identifier(i) for i in df.columns])
-        )
+        def build_part(i):
+
+            buffer = io.BytesIO()
+            with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=REDSHIFT_GZIP_LEVEL) as file:
+                file.write(df.iloc[bounds[i]:bounds[i + 1]].to_csv(index=False, na_rep='NaN').encode('utf-8'))
+
+            buffer.seek(0)
+            return buffer
+
+        try:
+
+            with ThreadPoolExecutor(max_workers=REDSHIFT_UPLOAD_WORKERS) as executor:
+                buffers = list(executor.map(build_part, range(parts)))
 
-        self.execute(string)
+            results = aws.upload_many(list(zip(buffers, remote_parts)), workers=REDSHIFT_UPLOAD_WORKERS)
+            if not all(r['success'] for r in results):
+                raise Exception(f'Failed to upload all parts for copy into {table}')
 
-        # Delete the file from the s3 bucket
-        aws.delete_file_s3(remote_csv_fullfile)
+            manifest = {
+                'entries': [{ 'url': f's3://{S3_BUCKET_NAME}/{key}', 'mandatory': True } for key in remote_parts]
+            }
+            aws.upload_fileobj_s3(io.BytesIO(json.dumps(manifest).encode('utf-8')), remote_manifest)
 
-        # Delete the local file
-        os.remove(local_csv_fullfile)
+            string_options = """
+                from 's3://{}/{}'
+                credentials 'aws_access_key_id={};aws_secret_access_key={}'
+                manifest
+                gzip
+                ignoreheader 1
+                delimiter ','
+                emptyasnull
+                escape removequotes
+            """.format(
+                S3_BUCKET_NAME,
+                remote_manifest,
+                AWS_ACCESS_KEY,
+                AWS_SECRET_KEY
+            )
 
-        print('Copied successfully')
+            # Copy the files from the s3 bucket over to the redshift
+            string = sql.SQL('copy {} ({})\n' + string_options).format(
+                sql.Identifier(*table.split('.')),
+                sql.SQL(',').join([sql.Identifier(i) for i in df.columns])
+            )
 
-    def big_unload_redshift(self, query, s3_path, file_format='CSV', download_local=False):
+            self.execute(string)
+            count_rows_written(len(df))
+
+        finally:
+
+            # Delete the files from the s3 bucket
+            aws.delete_files_s3(remote_parts + [remote_manifest])
+
+        print(f'Copied successfully ({parts} parts)')
+
+    def redshift_slices(self):
+
+        """
+            Number of slices in the redshift cluster, that's how many files a copy can load at once.
+        """
+
+        if self.db_name not in _redshift_slices:
+
+            # Look it up on a separate connection, if it fails we don't want to abort the caller's transaction
+            db = Db(self.db_name)
+
+            try:
+                # The caller is already holding a connection, if every other one is in use we'd rather
+                # go with the default this time than hold up the copy
+                db.connect(timeout=REDSHIFT_SLICES_TIMEOUT)
+            except Exception as e:
+                print(str(e))
+                return REDSHIFT_DEFAULT_SLICES
+
+            try:
+                _redshift_slices[self.db_name] = int(db.execute('select count(*) as slices from stv_slices')['slices'].iloc[0]) or REDSHIFT_DEFAULT_SLICES
+            except Exception as e:
+                # We may not have access to the system tables
+                print(str(e))
+                _redshift_slices[self.db_name] = REDSHIFT_DEFAULT_SLICES
+            finally:
+                db.disconnect()
+
+        return _redshift_slices[self.db_name]
+
+    def big_unload_redshift(self, query, s3_path, file_format='CSV', download_local=False, local_folder=TMP_FOLDER):
         """
         IMPORTANT:
         This method will only work when the connection provided for
@@ -241,6 +666,7 @@ class Db:
         @param s3_path: S3 path where files will be stored (without s3:// prefix)
         @param file_format: 'CSV' or 'PARQUET' (default: 'CSV')
         @param download_local: If True, downloads the files locally after unload
+        @param local_folder: Where to download the files to
         @return: List of S3 file paths created
         """
         
@@ -285,82 +711,619 @@ class Db:
         # If download_local is True, download the files
         local_files = []
         if download_local:
-            aws = Aws()
-            aws.connect_s3()
-            
-            # List files in the S3 path to download them
-            import boto3
-            s3_client = boto3.client('s3', 
-                                   aws_access_key_id=AWS_ACCESS_KEY, 
-                                   aws_secret_access_key=AWS_SECRET_KEY)
-            
-            # Extract bucket and prefix from full_s3_path
-            s3_prefix = f"{s3_path}/unload_{timestamp}_"
-            
+
             try:
-                response = s3_client.list_objects_v2(
-                    Bucket='busd-rca-projects',
-                    Prefix=s3_prefix
-                )
-                
-                if 'Contents' in response:
-                    for obj in response['Contents']:
-                        s3_key = obj['Key']
-                        filename = os.path.basename(s3_key)
-                        local_file_path = os.path.join(TMP_FOLDER, filename)
-                        
-                        # Download the file
-                        s3_client.download_file('busd-rca-projects', s3_key, local_file_path)
-                        local_files.append(local_file_path)
-                        print(f'Downloaded: {local_file_path}')
-                
+                local_files = self.download_unload(f"{s3_path}/unload_{timestamp}_", local_folder)
             except Exception as e:
                 print(f'Error downloading files: {str(e)}')
         
         return {
             's3_path': full_s3_path,
+            's3_prefix': f"{s3_path}/unload_{timestamp}_",
             'local_files': local_files if download_local else [],
             'format': file_format
         }
 
-    def copy_expert(self, df, string):
+    def download_unload(self, s3_prefix, local_folder):
+
+        """
+            Download every file an unload wrote under s3_prefix into local_folder, a few at a time.
+            Returns the local files in the order redshift numbered them.
+        """
+
+        aws = Aws()
+        aws.connect_s3()
+
+        # A failed listing must not look like an empty result, unload_df would cache it as complete
+        s3_files = sorted(aws.list_s3_files(s3_prefix, raise_errors=True))
+        local_files = [os.path.join(local_folder, os.path.basename(s3_file)) for s3_file in s3_files]
+
+        results = aws.download_many(list(zip(s3_files, local_files)), workers=UNLOAD_DOWNLOAD_WORKERS)
+
+        failed = [r['s3_fullfile'] for r in results if r['success'] == False]
+        if len(failed) > 0:
+            raise Exception(f'Failed to download {failed}')
+
+        return local_files
+
+    def unload_df(self, query, format='PARQUET', iterator=False, ttl=UNLOAD_CACHE_TTL):
+
+        """
+            IMPORTANT:
+            Like big_unload_redshift, only works on a redshift connection.
+
+            Run a query through a (parallel) redshift unload instead of fetching it over the cursor,
+            which is much faster for big results. The parts are downloaded concurrently and cached in
+            UNLOAD_CACHE_FOLDER by a hash of the query, so running the same query again within ttl
+            seconds reads the local files instead of going back to redshift.
+
+            @param query | select statement
+            @param format | 'PARQUET' or 'CSV'
+            @param iterator | if True returns a generator of one dataframe per part instead of one big dataframe
+            @param ttl | seconds a cached result is good for, None to always unload
+
+            NOTE: Parquet needs pyarrow installed.
+        """
+
+        format = format.upper()
+
+        key = hashlib.sha256(f'{self.db_name}:{format}:{query}'.encode()).hexdigest()[:24]
+        folder = os.path.join(UNLOAD_CACHE_FOLDER, key)
+        marker = os.path.join(folder, '_complete.json')
+
+        local_files = None
+        if ttl is not None and os.path.isfile(marker):
+
+            with open(marker) as file:
+                cached = json.load(file)
+
+            if datetime.now().timestamp() - cached['created'] < ttl:
+                local_files = [os.path.join(folder, f) for f in cached['files']]
+                print(f'Using cached unload from {folder}')
+
+        if local_files is None:
+
+            # Start from a clean folder, an old result or a half finished download might be in there
+            if os.path.isdir(folder):
+                shutil.rmtree(folder)
+            os.makedirs(folder)
+
+            unload = self.big_unload_redshift(query, f'tmp/unload/{key}', file_format=format)
+
+            try:
+                local_files = self.download_unload(unload['s3_prefix'], folder)
+            finally:
+                aws = Aws()
+                aws.connect_s3()
+                aws.delete_files_s3(aws.list_s3_files(unload['s3_prefix']))
+
+            # Only mark the result complete once every part is on disk
+            with open(marker, 'w') as file:
+                json.dump({
+                    'created': datetime.now().timestamp(),
+                    'query': query,
+                    'files': [os.path.basename(f) for f in local_files]
+                }, file)
+
+        parts = (read_unload_part(f, format) for f in local_files)
+
+        if iterator == True:
+            return parts
+
+        dfs = list(parts)
+        if len(dfs) == 0:
+            return pd.DataFrame()
+
+        return pd.concat(dfs, ignore_index=True)
+
+    def copy_expert(self, df, string, chunksize=COPY_CHUNKSIZE):
 
         """
             This is similar to self.big_insert except it allows you
             to build your query string yourself so it's a bit more
             flexible, but requires a bit more work prior.
+
+            The dataframe is streamed straight into the copy as csv, chunksize rows
+            at a time, so we never write it to disk and only ever hold one chunk of
+            csv text in memory.
         """
 
         if self.cur is None:
             raise Exception(f'Cursor to {self.db_name} not active.')
 
-        # Build the temporary filename
-        csv_filename = f'tmp_df_{datetime.now()}.csv'
-        csv_fullfile = os.path.join(TMP_FOLDER, csv_filename)
-
-        # Write temporary file
-        df.to_csv(csv_fullfile, index=False, na_rep='NaN')
-
         # Copy into table
-        with open(csv_fullfile) as csv_file:
-            self.cur.copy_expert(string, csv_file)
+        self.cur.copy_expert(string, CsvStream(df, chunksize))
 
-        # Remove temporary csv file
-        os.remove(csv_fullfile)
+        count_rows_written(len(df))
 
     def __del__(self):
-        self.disconnect()
+
+        try:
+            self.disconnect()
+        except Exception:
+            pass
 
     def __repr__(self):
         return f'<Db connected={self.conn is not None and self.cur is not None} />'
 
 
-def create_copy_expert_string(table, columns=None):
+class ConnectionPool:
+
+    """
+        Keeps connections to one of our databases open between uses so that every Db in the
+        process (pipelines, helper functions, models) shares them instead of doing a new handshake
+        each time. At most max_connections are open at once, checkouts past that wait.
+
+        Connections are reset before going back in the pool: anything uncommitted is rolled back
+        and temp tables are dropped, so the next user gets a clean session.
+    """
+
+    def __init__(self, db_name, max_connections):
+
+        self.db_name = db_name
+        self.connection_string = db_connections[db_name]
+        self.max_connections = max_connections
+        self.idle = [] # (connection, time it was returned)
+        self.open = 0
+        self.condition = threading.Condition()
+
+    def checkout(self, timeout=POOL_TIMEOUT):
+
+        deadline = perf_counter() + timeout
+
+        while True:
+
+            conn = None
+            returned_at = 0
+
+            with self.condition:
+
+                if len(self.idle) > 0:
+                    conn, returned_at = self.idle.pop()
+
+                elif self.open < self.max_connections:
+                    self.open += 1
+
+                else:
+
+                    remaining = deadline - perf_counter()
+                    if remaining <= 0:
+                        raise Exception(f'Timed out waiting for a connection to {self.db_name}, all {self.max_connections} are in use')
+
+                    self.condition.wait(remaining)
+                    continue
+
+            # We reserved a spot for a new connection
+            if conn is None:
+
+                try:
+                    return psycopg2.connect(self.connection_string)
+                except Exception:
+                    self.release()
+                    raise
+
+            if self.healthy(conn, returned_at):
+                return conn
+
+            self.discard(conn)
+
+    def checkin(self, conn):
+
+        try:
+
+            if conn.closed != 0:
+                raise Exception('Connection closed')
+
+            conn.rollback()
+            self.drop_temp_tables(conn)
+
+        except Exception:
+            self.discard(conn)
+            return
+
+        with self.condition:
+            self.idle.append((conn, perf_counter()))
+            self.condition.notify()
+
+    def healthy(self, conn, returned_at):
+
+        if conn.closed != 0:
+            return False
+
+        # Only bother pinging connections that have been sitting around for a while
+        if perf_counter() - returned_at < POOL_PING_AFTER:
+            return True
+
+        try:
+
+            with conn.cursor() as cur:
+                cur.execute('select 1')
+
+            conn.rollback()
+            return True
+
+        except Exception:
+            return False
+
+    def drop_temp_tables(self, conn):
+
+        """
+            Temp tables live as long as the session, so drop whatever the last user left behind
+            (works on both postgres and redshift).
+        """
+
+        with conn.cursor() as cur:
+
+            cur.execute("""
+                select n.nspname, c.relname
+                from pg_class c
+                join pg_namespace n on c.relnamespace = n.oid
+                where n.nspname like 'pg\\_temp\\_%'
+                    and c.relkind = 'r'
+                    and pg_table_is_visible(c.oid)
+            """)
+
+            for schema, table in cur.fetchall():
+                cur.execute(sql.SQL('drop table if exists {}').format(sql.Identifier(schema, table)))
+
+        conn.commit()
+
+    def discard(self, conn):
+
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+        self.release()
+
+    def release(self):
+
+        with self.condition:
+            self.open -= 1
+            self.condition.notify()
+
+    def close(self):
+
+        with self.condition:
+            idle = self.idle
+            self.idle = []
+
+        for conn, _ in idle:
+            self.discard(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_name):
+
+    with _pools_lock:
+
+        if db_name not in _pools:
+            _pools[db_name] = ConnectionPool(db_name, POOL_MAX_CONNECTIONS[db_name])
+
+        return _pools[db_name]
+
+def close_pools():
+
+    """
+        Close every idle pooled connection, call this when the process is done with the databases.
+    """
+
+    with _pools_lock:
+        pools = list(_pools.values())
+
+    for pool in pools:
+        pool.close()
+
+    print('Closed all pooled db connections...')
+
+
+def read_unload_part(fullfile, file_format):
+
+    """
+        Read one file written by a redshift unload (see Db.big_unload_redshift for the csv options).
+    """
+
+    if file_format == 'PARQUET':
+        return pd.read_parquet(fullfile)
+
+    return pd.read_csv(fullfile, na_values=['NULL'], keep_default_na=False, escapechar='\\')
+
+
+def infer_staging_type(values):
+
+    """
+        Postgres type for a staging table column holding these values, text unless pandas
+        can tell us it's something more specific.
+    """
+
+    if pd.api.types.is_integer_dtype(values.dtype) and values.dtype.itemsize <= 4:
+        return 'int'
+
+    return STAGING_TYPES.get(pd.api.types.infer_dtype(values, skipna=True), 'text')
+
+
+def build_df(data, cols, dtypes=None):
+
+    """
+        Build a dataframe out of the rows fetched from a cursor. Columns in dtypes are built
+        one at a time straight into arrays of that dtype, rather than going through a frame of
+        python objects first and converting afterwards.
+    """
+
+    if dtypes is None or len(dtypes) == 0 or len(set(cols)) != len(cols):
+        df = pd.DataFrame(data, columns=cols)
+        return df.astype(dtypes) if dtypes else df
+
+    values = list(zip(*data)) if len(data) > 0 else [() for _ in cols]
+
+    return pd.DataFrame({ col: build_column(v, dtypes.get(col)) for col, v in zip(cols, values) }, columns=cols)
+
+
+def build_column(values, dtype=None):
+
+    if dtype is None:
+        return pd.Series(values, dtype=object).infer_objects() if len(values) > 0 else pd.Series(values, dtype=object)
+
+    # Plain numpy types can be filled straight from the tuple, anything with nulls
+    # (or a pandas extension type) goes through pandas so nulls become NaN/NA
+    try:
+        return np.fromiter(values, dtype=np.dtype(dtype), count=len(values))
+    except (TypeError, ValueError):
+        return pd.Series(values, dtype=dtype)
+
+
+class CsvStream:
+
+    """
+        Read-only file-like object over a dataframe for psycopg2's copy_expert.
+
+        It writes the same csv that df.to_csv(index=False, na_rep='NaN') would, header
+        included, but only serializes the next chunk of rows when the previous one
+        has been read.
+    """
+
+    def __init__(self, df, chunksize=COPY_CHUNKSIZE):
+
+        self.df = df
+        self.chunksize = max(int(chunksize), 1)
+        self.position = 0
+        self.header = True
+        self.buffer = io.StringIO()
+
+    def next_chunk(self):
+
+        # The header still has to be written even if the dataframe is empty
+        if self.position >= len(self.df) and self.header == False:
+            return False
+
+        chunk = self.df.iloc[self.position:self.position + self.chunksize]
+        self.buffer = io.StringIO(chunk.to_csv(index=False, header=self.header, na_rep='NaN'))
+
+        self.header = False
+        self.position += self.chunksize
+
+        return True
+
+    def read(self, size=-1):
+
+        data = self.buffer.read(size)
+
+        while (size < 0 or len(data) < size) and self.next_chunk():
+            data += self.buffer.read(size - len(data) if size >= 0 else -1)
+
+        return data
+
+
+class BinaryStream:
+
+    """
+        Read-only file-like object that writes columns prepared with prepare_binary_column
+        in postgres' binary COPY format, chunksize rows at a time.
+
+        Every row is a 16 bit field count followed by each field as a 32 bit byte length
+        (-1 for null) and its bytes. We build a whole chunk at once with numpy by working out
+        where each field starts and scattering the bytes into a single buffer.
+    """
+
+    HEADER = b'PGCOPY\n\xff\r\n\x00' + np.array([0, 0], dtype='>i4').tobytes()
+    TRAILER = np.array([-1], dtype='>i2').tobytes()
+
+    def __init__(self, columns, n, chunksize=COPY_CHUNKSIZE):
+
+        self.columns = columns
+        self.n = n
+        self.chunksize = max(int(chunksize), 1)
+        self.position = 0
+        self.finished = False
+        self.buffer = io.BytesIO(self.HEADER)
+
+    def next_chunk(self):
+
+        if self.finished == True:
+            return False
+
+        if self.position >= self.n:
+            self.buffer = io.BytesIO(self.TRAILER)
+            self.finished = True
+            return True
+
+        start, end = self.position, min(self.position + self.chunksize, self.n)
+        self.buffer = io.BytesIO(build_binary_rows([encode_binary_column(c, start, end) for c in self.columns], end - start))
+        self.position = end
+
+        return True
+
+    def read(self, size=-1):
+
+        data = self.buffer.read(size)
+
+        while (size < 0 or len(data) < size) and self.next_chunk():
+            data += self.buffer.read(size - len(data) if size >= 0 else -1)
+
+        return data
+
+
+def prepare_binary_column(values, typname):
+
+    """
+        Converts a dataframe column into what we need to write it as the postgres type typname:
+
+        {
+            "type": <postgres type name>,
+            "null": <boolean numpy array, True where the value is null>,
+            "values": <big endian numpy array for fixed width types, object array of strings for text>
+        }
+
+        Nulls follow the same rules as our csv copies (null "NaN"), so NaN/None/NaT and the
+        string 'NaN' are all null. Returns None if the column can't safely be written as that type.
+    """
+
+    if typname not in BINARY_COPY_TYPES:
+        return None
+
+    np_type = BINARY_COPY_TYPES[typname]
+    kind = values.dtype.kind
+    null = pd.isnull(values).to_numpy()
+
+    if np_type is None:
+
+        if pd.api.types.infer_dtype(values, skipna=True) not in ['string', 'empty']:
+            return None
+
+        null = null | (values == 'NaN').to_numpy()
+        return { 'type': typname, 'null': null, 'values': values.to_numpy(dtype=object) }
+
+    if typname in ['int2', 'int4', 'int8']:
+
+        if kind not in 'iu':
+            return None
+
+        arr = values[~null].to_numpy(dtype=np.int64)
+        info = np.iinfo(np_type)
+        if len(arr) > 0 and (arr.min() < info.min or arr.max() > info.max):
+            return None
+
+        arr = values.fillna(0).to_numpy(dtype=np.int64).astype(np_type)
+
+    elif typname in ['float4', 'float8']:
+
+        if kind not in 'iuf':
+            return None
+
+        arr = values.fillna(0).to_numpy(dtype=np.float64).astype(np_type)
+
+    elif typname == 'bool':
+
+        if kind != 'b' and pd.api.types.infer_dtype(values, skipna=True) not in ['boolean', 'empty']:
+            return None
+
+        arr = values.fillna(False).to_numpy(dtype=bool).astype(np_type)
+
+    else:
+
+        # date / timestamp, strings get parsed and anything that doesn't parse goes to csv
+        if kind == 'O':
+            try:
+                values = pd.to_datetime(values)
+            except Exception:
+                return None
+
+        if values.dtype.kind != 'M' or getattr(values.dt, 'tz', None) is not None:
+            return None
+
+        null = pd.isnull(values).to_numpy()
+        us = values.fillna(pd.Timestamp('2000-01-01')).to_numpy(dtype='datetime64[us]')
+
+        if typname == 'date':
+            arr = (us.astype('datetime64[D]') - POSTGRES_EPOCH.astype('datetime64[D]')).astype(np.int64).astype(np_type)
+        else:
+            arr = (us - POSTGRES_EPOCH).astype(np.int64).astype(np_type)
+
+    return { 'type': typname, 'null': null, 'values': arr }
+
+
+def encode_binary_column(column, start, end):
+
+    """
+        Encode rows [start, end) of a prepared column into (null mask, byte length of each
+        non-null value, all non-null values as one flat uint8 array).
+    """
+
+    null = column['null'][start:end]
+    values = column['values'][start:end][~null]
+
+    if column['values'].dtype == object:
+        encoded = [str(v).encode('utf-8') for v in values]
+        lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=len(encoded))
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return null, lengths, data
+
+    values = np.ascontiguousarray(values)
+    lengths = np.full(len(values), values.dtype.itemsize, dtype=np.int64)
+
+    return null, lengths, values.view(np.uint8).ravel()
+
+
+def build_binary_rows(columns, n):
+
+    """
+        Build n binary COPY rows out of encoded columns (see encode_binary_column).
+    """
+
+    # Every field is a 4 byte length followed by its data (nothing for nulls)
+    field_sizes = np.full((n, len(columns)), 4, dtype=np.int64)
+    for j, (null, lengths, _) in enumerate(columns):
+        field_sizes[~null, j] += lengths
+
+    row_sizes = 2 + field_sizes.sum(axis=1)
+    row_starts = np.cumsum(row_sizes) - row_sizes
+
+    out = np.empty(int(row_sizes.sum()), dtype=np.uint8)
+    scatter_fixed(out, row_starts, np.full(n, len(columns), dtype='>i2'))
+
+    field_starts = row_starts + 2
+    for j, (null, lengths, data) in enumerate(columns):
+
+        field_lengths = np.full(n, -1, dtype='>i4')
+        field_lengths[~null] = lengths
+        scatter_fixed(out, field_starts, field_lengths)
+
+        # Every byte of value i goes to data_starts[i] + its offset within the value
+        if len(data) > 0:
+            data_starts = field_starts[~null] + 4
+            value_offsets = np.cumsum(lengths) - lengths
+            out[np.repeat(data_starts - value_offsets, lengths) + np.arange(len(data))] = data
+
+        field_starts = field_starts + field_sizes[:, j]
+
+    return out.tobytes()
+
+
+def scatter_fixed(out, starts, values):
+
+    width = values.dtype.itemsize
+    out[starts[:, None] + np.arange(width)] = values.view(np.uint8).reshape(-1, width)
+
+
+def create_copy_expert_string(table, columns=None, copy_format='csv'):
 
     """
         This is just the standardized way of building the copy_expert strings.
     """
 
+    if copy_format == 'binary':
+
+        string = sql.SQL("""
+            copy {} ({})
+            from stdin (
+                format binary
+            )
+        """).format(sql.Identifier(*table.split('.')), sql.SQL(',').join([sql.Identifier(i) for i in columns]))
+        return string
+
     if columns is not None:
 
         string = sql.SQL("""
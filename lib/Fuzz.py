@@ -1,5 +1,45 @@
+import json
+import math
+import os
+import shutil
+from collections import Counter
+from uuid import uuid4
+
 import fuzzyset
+import Levenshtein
 import numpy as np
+from scipy import sparse
+
+# Same grams as fuzzyset (it tries 3 first), strings are padded with '-' on both ends
+FUZZ_GRAM_SIZE = 3
+
+# How many of the closest strings by cosine similarity we rescore with levenshtein (same as fuzzyset)
+FUZZ_CANDIDATES = 50
+
+# How many strings we score per sparse matrix product in check_many (bounds memory)
+FUZZ_CHUNKSIZE = 5000
+
+# Points at the folder of the latest saved index (see Fuzz.save)
+FUZZ_INDEX_MANIFEST = 'index.json'
+
+def save_strings(fullfile, strings):
+
+    """
+        Save strings as one utf-8 blob plus character offsets, so they can be loaded without pickling.
+    """
+
+    blob = ''.join(strings)
+    offsets = np.cumsum([0] + [len(string) for string in strings], dtype='int64')
+
+    np.save(fullfile + '.npy', np.frombuffer(blob.encode('utf-8'), dtype='uint8'))
+    np.save(fullfile + '_offsets.npy', offsets)
+
+def load_strings(fullfile):
+
+    blob = np.load(fullfile + '.npy', mmap_mode='r').tobytes().decode('utf-8')
+    offsets = np.load(fullfile + '_offsets.npy', mmap_mode='r')
+
+    return np.array([blob[start:end] for start, end in zip(offsets[:-1], offsets[1:])], dtype=object)
 
 # Class to abstract away a lot of the fuzzyset steps
 # For fast cosine similarity
@@ -10,10 +50,127 @@ class Fuzz:
         # Detach reference
         strings = np.array(strings)
         
-        fuzzyset, dictionary = self.create_fuzzyset(strings)
+        # Preprocessed string -> original string
+        self.dictionary = self.create_dictionary(strings)
         
-        self.fuzzyset = fuzzyset
-        self.dictionary = dictionary
+        # Built the first time they're used (check uses the fuzzyset, check_many uses the gram matrix)
+        self.fuzzyset = None
+        self.index = None
+        
+        # Whatever the set was built from (e.g. a table version), when it's saved
+        self.version = None
+        
+    @classmethod
+    def load(cls, folder):
+
+        """
+            Load a Fuzz saved with Fuzz.save, returns None if there isn't one. The gram matrix is memory mapped
+            so nothing gets preprocessed or counted again.
+        """
+
+        manifest_fullfile = os.path.join(folder, FUZZ_INDEX_MANIFEST)
+        if os.path.exists(manifest_fullfile) == False:
+            return None
+
+        with open(manifest_fullfile, 'r') as file:
+            manifest = json.load(file)
+
+        index_folder = os.path.join(folder, manifest['folder'])
+        keys = load_strings(os.path.join(index_folder, 'keys'))
+        originals = load_strings(os.path.join(index_folder, 'originals'))
+
+        with open(os.path.join(index_folder, 'vocabulary.json'), 'r') as file:
+            vocabulary = { gram: i for i, gram in enumerate(json.load(file)) }
+
+        matrix = sparse.csr_matrix((
+            np.load(os.path.join(index_folder, 'data.npy'), mmap_mode='r'),
+            np.load(os.path.join(index_folder, 'indices.npy'), mmap_mode='r'),
+            np.load(os.path.join(index_folder, 'indptr.npy'), mmap_mode='r')
+        ), shape=(len(vocabulary), len(keys)), copy=False)
+
+        fuzz = cls.__new__(cls)
+        fuzz.dictionary = dict(zip(keys, originals))
+        fuzz.fuzzyset = None
+        fuzz.index = (keys, vocabulary, matrix)
+        fuzz.version = manifest['version']
+
+        return fuzz
+
+    def save(self, folder, version):
+
+        """
+            Save the set and its gram matrix to a folder for Fuzz.load, tagged with a version of whatever
+            it was built from. Each save goes to a new subfolder and the manifest is swapped last,
+            so a failed save never leaves a half written index behind.
+        """
+
+        if self.index is None:
+            self.index = self.create_index()
+
+        keys, vocabulary, matrix = self.index
+
+        index_folder = uuid4().hex
+        index_fullfolder = os.path.join(folder, index_folder)
+        os.makedirs(index_fullfolder)
+
+        save_strings(os.path.join(index_fullfolder, 'keys'), list(keys))
+        save_strings(os.path.join(index_fullfolder, 'originals'), [str(self.dictionary[k]) for k in keys])
+
+        with open(os.path.join(index_fullfolder, 'vocabulary.json'), 'w') as file:
+            json.dump(list(vocabulary), file)
+
+        np.save(os.path.join(index_fullfolder, 'data.npy'), matrix.data)
+        np.save(os.path.join(index_fullfolder, 'indices.npy'), matrix.indices)
+        np.save(os.path.join(index_fullfolder, 'indptr.npy'), matrix.indptr)
+
+        manifest_fullfile = os.path.join(folder, FUZZ_INDEX_MANIFEST)
+        with open(manifest_fullfile + '.tmp', 'w') as file:
+            json.dump({ 'version': version, 'folder': index_folder, 'strings': len(keys) }, file)
+        os.replace(manifest_fullfile + '.tmp', manifest_fullfile)
+
+        self.version = version
+
+        # Clean up older saves (anything that still has them memory mapped keeps working)
+        for name in os.listdir(folder):
+            fullfolder = os.path.join(folder, name)
+            if name != index_folder and os.path.isdir(fullfolder):
+                shutil.rmtree(fullfolder, ignore_errors=True)
+
+    def add(self, strings):
+
+        """
+            Add more strings to the set, only the new ones get preprocessed and counted into the gram matrix.
+        """
+
+        new_keys = []
+        for string in strings:
+
+            pstring = self.cos_preprocess(string)
+
+            if len(pstring) > 0:
+                if pstring not in self.dictionary:
+                    new_keys.append(pstring)
+                self.dictionary[pstring] = string
+
+        if len(new_keys) == 0:
+            return
+
+        if self.fuzzyset is not None:
+            for key in new_keys:
+                self.fuzzyset.add(key)
+
+        if self.index is not None:
+
+            keys, vocabulary, matrix = self.index
+            new_keys = np.array(new_keys, dtype=object)
+            grams = self.create_gram_matrix(new_keys, vocabulary, grow=True)
+
+            # Empty postings for the grams we hadn't seen yet, then the postings of the new strings
+            indptr = np.r_[matrix.indptr, np.full(len(vocabulary) - matrix.shape[0], matrix.indptr[-1])]
+            matrix = sparse.csr_matrix((matrix.data, matrix.indices, indptr), shape=(len(vocabulary), matrix.shape[1]))
+            matrix = sparse.hstack([matrix, grams.T], format='csr')
+
+            self.index = (np.concatenate([keys, new_keys]), vocabulary, matrix)
         
     def check(self, string):
         
@@ -22,6 +179,9 @@ class Fuzz:
         if len(string) == 0:
             return 0, '', False
         
+        if self.fuzzyset is None:
+            self.fuzzyset = self.create_fuzzyset()
+        
         res = self.fuzzyset.get(string)
         
         # If we got absolutely nothing, return nothing
@@ -38,6 +198,86 @@ class Fuzz:
         m = self.dictionary[match] if match in self.dictionary else None
         
         return ratio, m, isMatch
+
+    def check_many(self, strings):
+
+        """
+            Same as check, but for a whole array of strings at once. Returns arrays of
+            ratios, matches and isMatch in the same order as the strings.
+
+            Instead of walking the fuzzyset for each string, the grams of every string are
+            counted into a sparse matrix, so the cosine similarity against everything in the set
+            is a matrix product. The closest few are then rescored with levenshtein like fuzzyset does.
+        """
+
+        # Preprocess and only score each distinct string once
+        pstrings = np.array([self.cos_preprocess(s if isinstance(s, str) else None) for s in strings], dtype=object)
+        unique, inverse = np.unique(pstrings, return_inverse=True)
+        lengths = np.array([len(s) for s in unique], dtype=int)
+
+        ratios = np.zeros(len(unique))
+        pmatches = np.full(len(unique), '', dtype=object)
+
+        # Exact matches don't need scoring
+        exact = np.array([s in self.dictionary for s in unique], dtype=bool)
+        ratios[exact] = 1
+        pmatches[exact] = unique[exact]
+
+        # Score everything else against the set
+        rest = np.flatnonzero(~exact & (lengths > 0))
+        if len(rest) > 0 and len(self.dictionary) > 0:
+
+            if self.index is None:
+                self.index = self.create_index()
+
+            for start in range(0, len(rest), FUZZ_CHUNKSIZE):
+                chunk = rest[start:start + FUZZ_CHUNKSIZE]
+                rows, ratio, match = self.best_matches(unique[chunk])
+                ratios[chunk[rows]] = ratio
+                pmatches[chunk[rows]] = match
+
+        # Add the substring points (see add_substring_points), a preprocessed string has no spaces so it's one substring
+        isMatch = np.array([len(s) > 0 and len(m) > 0 and s in m for s, m in zip(unique, pmatches)], dtype=bool)
+        residual = 1 - ratios
+        c = np.exp(lengths / 10) - 1
+        ratios = ratios + np.where(isMatch, np.minimum(residual * c, residual / 2), 0)
+
+        matches = np.array([self.dictionary.get(m) if len(m) > 0 else '' for m in pmatches], dtype=object)
+
+        return ratios[inverse], matches[inverse], isMatch[inverse]
+
+    # Closest string in the set for each of the (preprocessed) strings
+    def best_matches(self, pstrings):
+
+        keys, vocabulary, matrix = self.index
+
+        # Cosine similarity of every string against everything in the set
+        grams = self.create_gram_matrix(pstrings, vocabulary, grow=False)
+        scores = (grams @ matrix).tocsr()
+
+        if scores.nnz == 0:
+            return np.array([], dtype=int), np.array([]), np.array([], dtype=object)
+
+        # Take the top candidates in each row
+        lengths = np.diff(scores.indptr)
+        rows = np.repeat(np.arange(len(pstrings)), lengths)
+        order = np.lexsort((-scores.data, rows))
+        rank = np.arange(scores.nnz) - np.repeat(scores.indptr[:-1], lengths)
+        order = order[rank < FUZZ_CANDIDATES]
+
+        rows = rows[order]
+        cols = scores.indices[order]
+        cosine = scores.data[order]
+
+        # Rescore with levenshtein (like fuzzyset) and keep the best per row, ties go to the higher cosine similarity
+        distance = np.array([
+            1 - Levenshtein.distance(pstrings[r], keys[c]) / max(len(pstrings[r]), len(keys[c]))
+            for r, c in zip(rows, cols)
+        ])
+        best = np.lexsort((-cosine, -distance, rows))
+        best = best[np.r_[True, rows[best][1:] != rows[best][:-1]]]
+
+        return rows[best], distance[best], keys[cols[best]]
     
     # Return the number of points we should add for substring matches
     def add_substring_points(self, string, match, ratio):
@@ -88,31 +328,69 @@ class Fuzz:
                 
         return additional, isMatch
         
-    # Create a preprocessed fuzzyset to compare against
-    def create_fuzzyset(self, strings):
+    # Preprocess the strings in the set, keeping a reference to the original strings
+    def create_dictionary(self, strings):
 
-        # Init
-        fuzz = fuzzyset.FuzzySet()
         dictionary = {}
 
-        # Preprocess the strings in the set
         for i in range(len(strings)):
 
             # Preprocess the string for cosine similarity
             pstring = self.cos_preprocess(strings[i])
-            
-            # Save a reference to the original string
-            dictionary[pstring] = strings[i]
-            
-            # Modify into the preprocessed string
-            strings[i] = pstring
 
-        # Add to the fuzzyset if there is anything left
-        for s in strings:
-            if len(s) > 0:
-                fuzz.add(s)
+            # Save a reference to the original string (if there is anything left)
+            if len(pstring) > 0:
+                dictionary[pstring] = strings[i]
+
+        return dictionary
+
+    # Create a preprocessed fuzzyset to compare against
+    def create_fuzzyset(self):
+
+        fuzz = fuzzyset.FuzzySet()
+
+        for s in self.dictionary:
+            fuzz.add(s)
+
+        return fuzz
+
+    # Create the gram matrix (grams x strings) of the set for check_many
+    def create_index(self):
+
+        keys = np.array(list(self.dictionary), dtype=object)
+        vocabulary = {}
+        matrix = self.create_gram_matrix(keys, vocabulary, grow=True)
+
+        return keys, vocabulary, matrix.T.tocsr()
+
+    # Count the grams of each string into a sparse matrix (strings x grams) with unit length rows
+    def create_gram_matrix(self, strings, vocabulary, grow):
+
+        rows, cols, counts = [], [], []
+        norms = np.zeros(len(strings))
+
+        for i, string in enumerate(strings):
+
+            padded = '-' + string + '-'
+            padded += '-' * max(0, FUZZ_GRAM_SIZE - len(padded))
+            grams = Counter(padded[j:j + FUZZ_GRAM_SIZE] for j in range(len(padded) - FUZZ_GRAM_SIZE + 1))
+
+            # Grams that aren't in the set don't score, but they still count towards the norm
+            norms[i] = math.sqrt(sum(count ** 2 for count in grams.values()))
+
+            for gram, count in grams.items():
+
+                col = vocabulary.get(gram)
+                if col is None:
+                    if grow == False:
+                        continue
+                    col = vocabulary[gram] = len(vocabulary)
+
+                rows.append(i)
+                cols.append(col)
+                counts.append(count / norms[i])
 
-        return fuzz, dictionary
+        return sparse.csr_matrix((counts, (rows, cols)), shape=(len(strings), len(vocabulary)), dtype='float64')
 
     # Preprocess a string for cosine similarity
     def cos_preprocess(self, string):
@@ -0,0 +1,215 @@
+import json
+import os
+import threading
+from datetime import datetime
+from time import perf_counter, process_time
+
+import psutil
+
+from .env import METRICS_FOLDER
+
+# How often (in seconds) we sample the process memory while functions are running
+RSS_SAMPLE_INTERVAL = 0.25
+
+# Every thread keeps a reference to the function record it is currently running (if any),
+# that way the Db / api clients can attribute their work without knowing about the pipeline
+_local = threading.local()
+
+
+def count_rows_read(n):
+    _increment('rows_read', n)
+
+def count_rows_written(n):
+    _increment('rows_written', n)
+
+def count_http_call(n=1):
+    _increment('http_calls', n)
+
+def count_rate_limited(n=1):
+    _increment('rate_limited', n)
+
+def count_throttle_time(seconds):
+    _increment('throttle_time', seconds)
+
+def count_cache_hit(n=1):
+    _increment('cache_hits', n)
+
+def count_cache_miss(n=1):
+    _increment('cache_misses', n)
+
+def _increment(key, n):
+
+    record = getattr(_local, 'record', None)
+
+    if record is None or n is None or n < 0:
+        return
+
+    record[key] += n
+
+
+class Metrics:
+
+    """
+        Collects per function metrics for a pipeline run and writes them as
+        json lines (one line per function) to METRICS_FOLDER.
+
+        Each record has the following structure.
+
+        {
+            "pipeline": <pipeline class name>,
+            "run_date": <date the pipeline is running for>,
+            "run_id": <timestamp of when this run started>,
+            "name": <function name>,
+            "success": <boolean>,
+            "wall_time": <seconds>,
+            "cpu_time": <seconds of process cpu time>,
+            "rss_start": <MB>,
+            "rss_peak_delta": <MB above rss_start at the highest sampled point>,
+            "rows_read": <rows fetched through Db>,
+            "rows_written": <rows inserted/updated/copied through Db>,
+            "http_calls": <http requests made through our api clients>,
+            "rate_limited": <429s our api clients got back>,
+            "throttle_time": <seconds our api clients spent waiting on their rate limiter>,
+            "cache_hits": <api responses we got from a local cache instead>,
+            "cache_misses": <api responses we had to go out and fetch>
+        }
+
+        NOTE: Cpu time and memory are process wide, so when functions run in parallel
+              they include the work of whatever else was running at the same time.
+    """
+
+    def __init__(self, pipeline, run_date):
+
+        if os.path.isdir(METRICS_FOLDER) == False:
+            os.makedirs(METRICS_FOLDER)
+
+        self.pipeline = pipeline
+        self.run_date = run_date.strftime('%Y-%m-%d')
+        self.run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.fullfile = os.path.join(METRICS_FOLDER, f'{pipeline}_{self.run_id}.jsonl')
+
+        self.records = []
+        self.active = []
+        self.lock = threading.Lock()
+        self.process = psutil.Process(os.getpid())
+
+        self.sampler = None
+        self.sampling = threading.Event()
+
+    def rss(self):
+        return self.process.memory_info().rss / (1024 * 1024)
+
+    def start(self, name):
+
+        """
+            Start tracking a function on the current thread.
+        """
+
+        rss = self.rss()
+        record = {
+            'pipeline': self.pipeline,
+            'run_date': self.run_date,
+            'run_id': self.run_id,
+            'name': name,
+            'success': False,
+            'wall_time': perf_counter(),
+            'cpu_time': process_time(),
+            'rss_start': rss,
+            'rss_peak_delta': 0,
+            'rows_read': 0,
+            'rows_written': 0,
+            'http_calls': 0,
+            'rate_limited': 0,
+            'throttle_time': 0,
+            'cache_hits': 0,
+            'cache_misses': 0
+        }
+
+        with self.lock:
+            self.active.append(record)
+
+        _local.record = record
+        self.start_sampler()
+
+    def stop(self, success):
+
+        """
+            Stop tracking the function running on the current thread and write its record.
+        """
+
+        record = getattr(_local, 'record', None)
+        _local.record = None
+
+        if record is None:
+            return
+
+        self.sample(record)
+
+        record['success'] = success
+        record['wall_time'] = round(perf_counter() - record['wall_time'], 3)
+        record['cpu_time'] = round(process_time() - record['cpu_time'], 3)
+        record['rss_start'] = round(record['rss_start'], 2)
+        record['rss_peak_delta'] = round(record['rss_peak_delta'], 2)
+        record['throttle_time'] = round(record['throttle_time'], 3)
+
+        with self.lock:
+
+            self.active.remove(record)
+            self.records.append(record)
+
+            with open(self.fullfile, 'a') as file:
+                file.write(json.dumps(record) + '\n')
+
+    def sample(self, record):
+
+        delta = self.rss() - record['rss_start']
+        if delta > record['rss_peak_delta']:
+            record['rss_peak_delta'] = delta
+
+    def start_sampler(self):
+
+        if self.sampler is not None:
+            return
+
+        def sample_loop():
+            while self.sampling.wait(RSS_SAMPLE_INTERVAL) == False:
+                with self.lock:
+                    for record in self.active:
+                        self.sample(record)
+
+        self.sampler = threading.Thread(target=sample_loop, daemon=True)
+        self.sampler.start()
+
+    def close(self):
+
+        if self.sampler is not None:
+            self.sampling.set()
+            self.sampler.join()
+            self.sampler = None
+
+    def summary(self):
+
+        """
+            Converts the records into a readable table for the pipeline report.
+        """
+
+        if len(self.records) == 0:
+            return ''
+
+        summary = 'Metrics (wall | cpu | peak rss delta | rows read | rows written | http calls | rate limited | throttled | cache hits | cache misses):\n'
+        for r in self.records:
+            summary += '{}: {}s | {}s | {} MB | {} | {} | {} | {} | {}s | {} | {}\n'.format(
+                r['name'],
+                r['wall_time'],
+                r['cpu_time'],
+                r['rss_peak_delta'],
+                r['rows_read'],
+                r['rows_written'],
+                r['http_calls'],
+                r['rate_limited'],
+                r['throttle_time'],
+                r['cache_hits'],
+                r['cache_misses']
+            )
+
+        return summary
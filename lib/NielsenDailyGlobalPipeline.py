@@ -2,7 +2,7 @@
 
 from .env import LOCAL_DOWNLOAD_FOLDER
 from datetime import datetime, timedelta
-from .Sftp import Sftp
+from .Sftp import Sftp, get_many, list_many, remove_local
 from .PipelineBase import PipelineBase
 from pandas.errors import EmptyDataError
 import pandas as pd
@@ -39,8 +39,6 @@ class NielsenDailyGlobalPipeline(PipelineBase):
 
     def __init__(self, db_name):
         PipelineBase.__init__(self, db_name)
-        self.sftp_conn_name = None
-        self.sftp_conn = None
 
     def getNewFiles(self):
 
@@ -48,9 +46,12 @@ class NielsenDailyGlobalPipeline(PipelineBase):
             Constructs a list of all the new files that we need to process
             during this session.
         """
+        # List all the servers at once
+        server_filenames = list_many(GLOBAL_SERVER_NAMES)
+
         server_files = []
         for server_name in GLOBAL_SERVER_NAMES:
-            new_files = self.getNewFilesFromServer(server_name)
+            new_files = self.getNewFilesFromServer(server_name, server_filenames[server_name])
             server_files.append(new_files)
 
         return pd.concat(server_files)
@@ -102,16 +103,19 @@ class NielsenDailyGlobalPipeline(PipelineBase):
 
         return files_df
 
-    def getNewFilesFromServer(self, server_name):
+    def getNewFilesFromServer(self, server_name, filenames=None):
 
         """
             Creates two dataframes, each represent new files on the server_name that
             need to be processed in this session. One dataframe is for artists, the other for songs.
+
+            Pass filenames if you've already listed the server.
         """
 
         # Get all the existing files on the server
-        sftp = Sftp(server_name)
-        filenames = sftp.list()
+        if filenames is None:
+            sftp = Sftp(server_name)
+            filenames = sftp.list()
 
         # First construct a list of all the relevant filenames
         # We only care about the song & artist files (not isrc files)
@@ -155,30 +159,14 @@ class NielsenDailyGlobalPipeline(PipelineBase):
         files_df = pd.DataFrame(files)
 
         # Next we need to compare these files to the files we've already processed to see which ones we need to process
-        string = """
-            create temp table tmp_global_files (
-                filename text,
-                date date,
-                country text,
-                server_name text,
-                type text
-            );
-        """
-        self.db.execute(string)
-        self.db.big_insert(files_df, 'tmp_global_files')
-
         string = """
             select t.*
             from tmp_global_files t
             left join misc.nielsen_global_daily_files_completed e on t.filename = e.filename
             where e.file_id is null
         """
-        files_df = self.db.execute(string)
-
-        string = """
-            drop table tmp_global_files;
-        """
-        self.db.execute(string)
+        with self.db.staging(files_df, 'tmp_global_files', types={ 'date': 'date' }):
+            files_df = self.db.execute(string)
 
         # If None we did something wrong
         if files_df is None:
@@ -254,46 +242,23 @@ class NielsenDailyGlobalPipeline(PipelineBase):
                 Perform database updates on a cleaned global daily artist file.
             """
 
-            # Create temporary tables
-            string = f"""
-                create temp table tmp_meta (
-                    unified_artist_id text,
-                    artist text
-                );
-
-                create temp table tmp_streams (
-                    unified_artist_id text,
-                    date date,
-                    {country_name} int
-                );
-            """
-            self.db.execute(string)
-
-            # Fill temporary tables
-            self.db.big_insert(meta, 'tmp_meta')
-            self.db.big_insert(streams, 'tmp_streams')
+            # The ids are text in the db, make sure we merge on the same type
+            meta = meta.astype({ 'unified_artist_id': 'str' })
+            streams = streams.astype({ 'unified_artist_id': 'str' })
 
-            # Insert metadata
-            string = f"""
-                insert into nielsen_artist.meta (unified_artist_id, artist, is_global)
-                select unified_artist_id, artist, true from tmp_meta
-                on conflict (unified_artist_id) do update
-                set artist = excluded.artist;
+            # Insert metadata, is_global is only set on new artists
+            self.db.upsert(meta.assign(is_global=True), 'nielsen_artist.meta', ['unified_artist_id'], ['artist'])
 
-                insert into nielsen_artist.streams (artist_id, date, {country_name})
-                select
-                    m.id as artist_id,
-                    ts.date,
-                    ts.{country_name}
-                from tmp_streams ts
-                join nielsen_artist.meta m on ts.unified_artist_id = m.unified_artist_id
-                on conflict (artist_id, date) do update
-                set {country_name} = excluded.{country_name};
-
-                drop table tmp_meta;
-                drop table tmp_streams;
+            string = """
+                select id as artist_id, unified_artist_id
+                from nielsen_artist.meta
+                where unified_artist_id = any(%(unified_artist_ids)s)
             """
-            self.db.execute(string)
+            ids = self.db.execute(string, { 'unified_artist_ids': meta['unified_artist_id'].tolist() })
+
+            # Only this country's streams column is touched
+            streams = pd.merge(streams, ids, on='unified_artist_id', how='inner')
+            self.db.upsert(streams[['artist_id', 'date', country_name]], 'nielsen_artist.streams', ['artist_id', 'date'], [country_name])
 
         df, fullfiles = self.initFileProcess(file)
 
@@ -366,51 +331,23 @@ class NielsenDailyGlobalPipeline(PipelineBase):
 
         def dbUpdates(meta, streams, country_name):
 
-            # Create temporary tables
-            string = f"""
-                create temp table tmp_meta (
-                    unified_song_id text,
-                    title text,
-                    artist text,
-                    isrc text
-                );
-
-                create temp table tmp_streams (
-                    unified_song_id text,
-                    date date,
-                    {country_name} int
-                );
-            """
-            self.db.execute(string)
-
-            # Fill temporary tables
-            self.db.big_insert(meta, 'tmp_meta')
-            self.db.big_insert(streams, 'tmp_streams')
-
-            # Insert metadata & update isrcs
-            string = f"""
-                insert into nielsen_song.meta (unified_song_id, artist, title, isrc, is_global)
-                select unified_song_id, artist, title, isrc, true from tmp_meta
-                on conflict (unified_song_id) do update
-                set
-                    artist = excluded.artist,
-                    title = excluded.title,
-                    isrc = excluded.isrc;
-
-                insert into nielsen_song.streams (song_id, date, {country_name})
-                select
-                    m.id as song_id,
-                    ts.date,
-                    ts.{country_name}
-                from tmp_streams ts
-                join nielsen_song.meta m on ts.unified_song_id = m.unified_song_id
-                on conflict (song_id, date) do update
-                set {country_name} = excluded.{country_name};
-
-                drop table tmp_meta;
-                drop table tmp_streams;
+            # The ids are text in the db, make sure we merge on the same type
+            meta = meta.astype({ 'unified_song_id': 'str' })
+            streams = streams.astype({ 'unified_song_id': 'str' })
+
+            # Insert metadata & update isrcs, is_global is only set on new songs
+            self.db.upsert(meta.assign(is_global=True), 'nielsen_song.meta', ['unified_song_id'], ['artist', 'title', 'isrc'])
+
+            string = """
+                select id as song_id, unified_song_id
+                from nielsen_song.meta
+                where unified_song_id = any(%(unified_song_ids)s)
             """
-            self.db.execute(string)
+            ids = self.db.execute(string, { 'unified_song_ids': meta['unified_song_id'].tolist() })
+
+            # Only this country's streams column is touched
+            streams = pd.merge(streams, ids, on='unified_song_id', how='inner')
+            self.db.upsert(streams[['song_id', 'date', country_name]], 'nielsen_song.streams', ['song_id', 'date'], [country_name])
 
         df, fullfiles = self.initFileProcess(file)
 
@@ -421,19 +358,15 @@ class NielsenDailyGlobalPipeline(PipelineBase):
 
     def initFileProcess(self, file):
 
-        # Make sure that we are set to the right connection
-        if self.sftp_conn is None or self.sftp_conn_name is None or file['server_name'] != self.sftp_conn_name:
-            sftp = Sftp(file['server_name'])
-            self.sftp_conn = sftp.connect()
-            self.sftp_conn_name = file['server_name']
-
         # Create the fullfiles
         remote_fullfile = os.path.join(NIELSEN_GLOBAL_FILES_LOCATION, file['filename'])
         local_fullfile = os.path.join(LOCAL_DOWNLOAD_FOLDER, file['filename'])
         s3_fullfile = GLOBAL_S3_UPLOAD_FOLDER_TEMPLATE.format(file['filename'])
 
-        # Download files from the server
-        self.sftp_conn.get(remote_fullfile, local_fullfile)
+        # Download the file from the server, unless downloadFiles already got it
+        if os.path.exists(local_fullfile) == False:
+            sftp = Sftp(file['server_name'])
+            sftp.get(remote_fullfile, local_fullfile)
 
         try:
 
@@ -473,7 +406,23 @@ class NielsenDailyGlobalPipeline(PipelineBase):
             self.commit()
 
         # Must do this after uploading to s3
-        os.remove(fullfiles['local_fullfile'])
+        remove_local(fullfiles['local_fullfile'])
+
+    def downloadFiles(self, files):
+
+        """
+            Download all the files we're going to process from every server at once. Anything
+            that fails here is downloaded again when its file is processed.
+        """
+
+        get_many([
+            (
+                file['server_name'],
+                os.path.join(NIELSEN_GLOBAL_FILES_LOCATION, file['filename']),
+                os.path.join(LOCAL_DOWNLOAD_FOLDER, file['filename'])
+            )
+            for file in files
+        ])
 
     def addProcessFuncFromFile(self, file):
 
@@ -542,9 +491,11 @@ class NielsenDailyGlobalPipeline(PipelineBase):
 
         # Sort them by date & server name
         # date, because we need to process them in the correct order (oldest->newest)
-        # server name, so that we don't have to change sftp connections every time we change files
         files = files.sort_values(by=['server_name', 'date'], ascending=True).reset_index(drop=True).to_dict('records')
 
+        if len(files) > 0:
+            self.add_function(lambda: self.downloadFiles(files), 'Download Files', skip_on_resume=False)
+
         # Create a process function for each file separately
         for file in files:
             self.addProcessFuncFromFile(file)
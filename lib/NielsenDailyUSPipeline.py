@@ -1,5 +1,6 @@
+import io
 import os
-import random
+import threading
 import unicodedata
 from datetime import datetime, timedelta
 from uuid import uuid4
@@ -9,16 +10,21 @@ import numpy as np
 import pandas as pd
 import requests
 
+from .AsyncSpotify import AsyncSpotify
 from .BinnedModel import BinnedModel
 from .Db import Db
-from .env import LOCAL_ARCHIVE_FOLDER, LOCAL_DOWNLOAD_FOLDER, REPORTS_FOLDER
-from .functions import (chunker, filter_signed_artists_with_nielsen_label_list,
-                        match2Nielsen, today)
+from .env import (LOCAL_ARCHIVE_FOLDER, LOCAL_DOWNLOAD_FOLDER, REPORTS_FOLDER,
+                  SIGNED_ARTISTS_INDEX_FOLDER)
+from .functions import (chunker, compile_label_matcher,
+                        filter_signed_artists_with_nielsen_label_list,
+                        match2Nielsen, match_labels, resolve_spotify_tracks,
+                        today)
 from .Fuzz import Fuzz
+from .Metrics import count_http_call
 from .PipelineBase import PipelineBase
 from .RapidApi import RapidApi
 from .ServiceApi import ServiceApi
-from .Sftp import Sftp
+from .Sftp import Sftp, remove_local
 from .Spotify import Spotify
 
 NIELSEN_US_DAILY_ARCHIVE_FOLDER = '/' # location on nielsen's remote sftp server where the US daily files are located
@@ -30,6 +36,140 @@ EXPORTS_TEMPLATE = '{}_exports'
 US_S3_UPLOAD_FOLDER_TEMPLATE = 'nielsen_archive/us/{}'
 MAC_FOLDER = '__MACOSX'
 
+# How nielsen's columns map to ours, these are also the only columns we parse out of the files (along with the daily streams)
+NIELSEN_ARTIST_COLUMNS = {
+    'TW Rank': 'tw_rank',
+    'LW Rank': 'lw_rank',
+    'Artist': 'artist',
+    'UnifiedArtistID': 'unified_artist_id',
+    'TD On-Demand Video': 'td_odv',
+    'TD Digital Track Sales': 'td_dts',
+    'TW On-Demand Audio Streams': 'tw_oda_streams',
+    'LW On-Demand Audio Streams': 'lw_oda_streams',
+    'L2W_On_Demand_Audio_Streams': 'l2w_oda_streams',
+    'Weekly %change On-Demand Audio Streams': 'weekly_pct_chg_oda_streams',
+    'YTD On-Demand Audio Streams': 'ytd_oda_streams',
+    'RTD On-Demand Audio Streams': 'rtd_oda_streams',
+    'WTD Building ODA (Friday-Thursday)': 'wtd_building_oda_fri_thurs',
+    '7-day rolling ODA': 'tw_rolling_oda',
+    'pre-7 day rolling oda': 'lw_rolling_oda',
+    'TW Album Sales': 'tw_album_sales',
+    'YTD Album Sales': 'ytd_album_sales',
+    'RTD Album Sales': 'rtd_album_sales',
+    'TW Digital Track Sales': 'tw_digital_track_sales',
+    'YTD Digital Track Sales': 'ytd_digital_track_sales',
+    'RTD Digital Track Sales': 'rtd_digital_track_sales',
+    'TW On-Demand Video': 'tw_odv',
+    'LW On-Demand Video': 'lw_odv',
+    'YTD On-Demand Video': 'ytd_odv',
+    'RTD On-Demand Video': 'rtd_odv'
+}
+
+NIELSEN_SONG_COLUMNS = {
+    'TW Rank': 'tw_rank',
+    'LW Rank': 'lw_rank',
+    'Artist': 'artist',
+    'Title': 'title',
+    'Unified Song Id': 'unified_song_id',
+    'Label Abbrev': 'label',
+    'CoreGenre': 'core_genre',
+    'Top ISRC': 'isrc',
+    'Release_date': 'release_date',
+    'TW On-Demand Audio Streams': 'tw_oda_streams',
+    'LW On-Demand Audio Streams': 'lw_oda_streams',
+    'L2W_On_Demand_Audio_Streams': 'l2w_oda_streams',
+    'Weekly %change On-Demand Audio Streams': 'weekly_pct_chg_oda_streams',
+    'YTD On-Demand Audio Streams': 'ytd_oda_streams',
+    'RTD On-Demand Audio Streams': 'rtd_oda_streams',
+    'RTD On-Demand Audio Streams - Premium': 'rtd_oda_streams_premium',
+    'RTD On-Demand Audio Streams - Ad Supported': 'rtd_oda_streams_ad_supported',
+    'WTD Building ODA (Friday-Thursday)': 'wtd_building_fri_thurs',
+    '7-day Rolling ODA': 'tw_rolling_oda',
+    'pre-7days rolling ODA': 'lw_rolling_oda',
+    'TW Digital Track Sales': 'tw_digital_track_sales',
+    'YTD Digital Track Sales': 'ytd_digital_track_sales',
+    'ATD Digital Track Sales': 'atd_digital_track_sales',
+    'TW On-Demand Video': 'tw_odv',
+    'LW On-Demand Video': 'lw_odv',
+    'YTD On-Demand Video': 'ytd_odv',
+    'ATD On-Demand Video': 'atd_odv'
+}
+
+# Everything else in the files is a number
+NIELSEN_TEXT_COLUMNS = [
+    'Artist',
+    'Title',
+    'Label Abbrev',
+    'CoreGenre',
+    'Top ISRC',
+    'Release_date',
+    'Weekly %change On-Demand Audio Streams'
+]
+
+def find_zip_member(zip_file, filename):
+
+    """
+        Find the member of a zip with this filename, wherever it is in the zip (ignoring mac metadata).
+    """
+
+    for name in zip_file.namelist():
+        if os.path.basename(name) == filename and MAC_FOLDER not in name:
+            return name
+
+    raise Exception(f'Missing {filename} from zip: {zip_file.filename}')
+
+def read_zip_csv(zip_fullfile, filename, encoding='UTF-16', **kwargs):
+
+    """
+        Read a csv in a zip straight into pandas, the member is decompressed and decoded
+        as pandas reads it so nothing is extracted to disk.
+    """
+
+    with ZipFile(zip_fullfile, 'r') as zip_file:
+        with zip_file.open(find_zip_member(zip_file, filename)) as raw, io.TextIOWrapper(raw, encoding=encoding, newline='') as text:
+            return pd.read_csv(text, **kwargs)
+
+def nielsen_column_types(header, rename_columns):
+
+    """
+        Pick out the columns we use from one of nielsen's file headers and what to parse them as.
+        The daily streaming columns are named by date ('01/14/2024' or '01/14/2024 - Total ODA').
+    """
+
+    dtypes = {}
+    for col in header:
+        if col in NIELSEN_TEXT_COLUMNS:
+            dtypes[col] = object
+        elif col in rename_columns or str2Date(col.split(' - ')[0]):
+            dtypes[col] = 'float64'
+
+    return dtypes
+
+def reshape_song_streams(total, premium, ad_supported):
+
+    """
+        Turn the wide daily streaming frames from cleanSongs (a unified_song_id column and one column per date)
+        into one long frame with a row per song per date. Same result as melting each of them and merging them
+        on ['unified_song_id', 'date'], but straight from the numpy blocks: the ids are repeated, the dates tiled,
+        and all three measures raveled into a single array.
+    """
+
+    # Only the dates that every measure has (like the inner merge would)
+    dates = [col for col in getDateCols(total.columns) if col in premium.columns and col in ad_supported.columns]
+    ids = total['unified_song_id'].to_numpy()
+
+    # One row per song per date, ordered by song then date
+    values = np.empty((len(ids) * len(dates), 3), dtype='int64')
+    for i, measure in enumerate([total, ad_supported, premium]):
+        block = measure[dates].to_numpy(dtype='float64')
+        values[:, i] = np.nan_to_num(block, nan=0).ravel()
+
+    streams = pd.DataFrame(values, columns=['streams', 'ad_supported', 'premium'])
+    streams.insert(0, 'unified_song_id', np.repeat(ids, len(dates)))
+    streams.insert(1, 'date', np.tile(np.array(dates, dtype=object), len(ids)))
+
+    return streams
+
 def str2Date(s):
     """Convert a string to a date object"""
     try:
@@ -101,6 +241,10 @@ class NielsenDailyUSPipeline(PipelineBase):
     def __init__(self, db_name):
         PipelineBase.__init__(self, db_name)
 
+        # This pipeline takes a long time, so keep each function's work as soon as it's done.
+        # If something fails late in the run we can fix it and pick back up with --resume.
+        self.commit_each_function = True
+
         # Make folders if they don't already exist
         if os.path.isdir(LOCAL_ARCHIVE_FOLDER) == False:
             os.mkdir(LOCAL_ARCHIVE_FOLDER)
@@ -127,6 +271,8 @@ class NielsenDailyUSPipeline(PipelineBase):
         old_song_fullfile = os.path.join(LOCAL_DOWNLOAD_FOLDER, NIELSEN_US_DAILY_SONG_FILENAME_OLD.format(formatted_date))
         song_fullfile = os.path.join(LOCAL_DOWNLOAD_FOLDER, NIELSEN_US_DAILY_SONG_FILENAME.format(formatted_date))
         artist_fullfile = os.path.join(LOCAL_DOWNLOAD_FOLDER, NIELSEN_US_DAILY_ARTIST_FILENAME.format(formatted_date))
+        song_cache_fullfile = os.path.join(LOCAL_ARCHIVE_FOLDER, os.path.splitext(song_filename)[0] + '.parquet')
+        artist_cache_fullfile = os.path.join(LOCAL_ARCHIVE_FOLDER, os.path.splitext(artist_filename)[0] + '.parquet')
 
         self.files = {
             'zip': zip_filename,
@@ -141,9 +287,28 @@ class NielsenDailyUSPipeline(PipelineBase):
             'zip_remote_archive': zip_remote_archive_fullfile,
             'old_song': old_song_fullfile,
             'song': song_fullfile,
-            'artist': artist_fullfile
+            'artist': artist_fullfile,
+            'song_cache': song_cache_fullfile,
+            'artist_cache': artist_cache_fullfile
+        }
+
+        # Columns we parse out of each file
+        self.file_columns = {
+            'song': NIELSEN_SONG_COLUMNS,
+            'artist': NIELSEN_ARTIST_COLUMNS
         }
 
+        # Functions can run in parallel, make sure only one of them parses a file
+        self.file_cache_lock = threading.Lock()
+
+        # Compiled label lists (see getLabelMatcher), by table
+        self.label_matchers = {}
+
+        # Fuzz over misc.signed_artists (see getSignedArtistsFuzz), saved to disk between runs
+        self.signed_artists_fuzz = None
+        self.signed_artists_lock = threading.Lock()
+        self.signed_artists_index_folder = os.path.join(SIGNED_ARTISTS_INDEX_FOLDER, self.db_name)
+
         self.folders = {
             'exports': os.path.join(REPORTS_FOLDER, EXPORTS_TEMPLATE.format(formatted_date))
         }
@@ -176,36 +341,27 @@ class NielsenDailyUSPipeline(PipelineBase):
     def downloadFiles(self):
 
         """
-            If we haven't already downloaded the files, download them
-            from nielsen.
+            If we haven't already downloaded the zip, download it from nielsen. We don't extract
+            it, the files we use are read straight out of the archived zip (see readNielsenFile).
         """
 
-        # Only download if some file is missing
-        if os.path.exists(self.fullfiles['artist']) == False or os.path.exists(self.fullfiles['song']) == False:
+        # Only download if we don't have today's zip yet
+        if os.path.exists(self.fullfiles['zip_local_archive']) == False:
 
             # Init SFTP client
             sftp = Sftp('nielsen_daily')
 
-            # Download remote zip file to our local download folder
+            # Download remote zip file to our local download folder (resumes if a previous run was interrupted)
             sftp.get(self.fullfiles['zip_remote_archive'], self.fullfiles['zip'])
 
-            # Unzip
+            # Make sure the files we need are in there
             with ZipFile(self.fullfiles['zip'], 'r') as file_ref:
-                file_ref.extractall(LOCAL_DOWNLOAD_FOLDER)
-
-            # We can delete the old song file
-            os.remove(self.fullfiles['old_song'])
+                for filename in [self.files['artist'], self.files['song']]:
+                    find_zip_member(file_ref, filename)
 
             # Move the zip files into the archive (don't do this unless we have the required files)
             os.rename(self.fullfiles['zip'], self.fullfiles['zip_local_archive'])
-
-            # Remove this annoying folder that sometimes comes from our zip files
-            if os.path.isdir(os.path.join(LOCAL_DOWNLOAD_FOLDER, MAC_FOLDER)):
-                os.rmdir(MAC_FOLDER)
-
-            # Create an exports directory
-            if os.path.isdir(self.folders['exports']) == False:
-                os.mkdir(self.folders['exports'])
+            remove_local(self.fullfiles['zip']) # the download manifest
 
             print(f"Initialized file: {self.fullfiles['zip']}")
 
@@ -213,6 +369,61 @@ class NielsenDailyUSPipeline(PipelineBase):
 
             print(f"File {self.fullfiles['zip']} already initialized")
 
+        # Create an exports directory
+        if os.path.isdir(self.folders['exports']) == False:
+            os.mkdir(self.folders['exports'])
+
+    def readNielsenHeader(self, name):
+
+        """
+            Read just the header row of one of nielsen's files ('artist' or 'song').
+        """
+
+        return read_zip_csv(self.fullfiles['zip_local_archive'], self.files[name], nrows=0).columns
+
+    def cacheNielsenFile(self, name):
+
+        """
+            Parse one of nielsen's files ('artist' or 'song') out of today's zip and save it as parquet
+            next to the zip. We only parse the columns we use, with explicit types, and only once per zip.
+        """
+
+        with self.file_cache_lock:
+
+            cache_fullfile = self.fullfiles[f'{name}_cache']
+            zip_fullfile = self.fullfiles['zip_local_archive']
+
+            # Already parsed this zip
+            if os.path.exists(cache_fullfile) and os.path.getmtime(cache_fullfile) >= os.path.getmtime(zip_fullfile):
+                return
+
+            dtypes = nielsen_column_types(self.readNielsenHeader(name), self.file_columns[name])
+            df = read_zip_csv(zip_fullfile, self.files[name], usecols=list(dtypes), dtype=dtypes)
+
+            # Write to the side first so a failed write never leaves a partial cache
+            tmp_fullfile = cache_fullfile + '.tmp'
+            df.to_parquet(tmp_fullfile, index=False)
+            os.replace(tmp_fullfile, cache_fullfile)
+
+            print(f'Cached {self.files[name]}: {df.shape[0]} rows, {df.shape[1]} columns')
+
+    def readNielsenFile(self, name, columns=None):
+
+        """
+            Read one of nielsen's files ('artist' or 'song') from its parsed cache (parsing it first if we need to).
+            Optionally only read some of the (raw) columns.
+        """
+
+        self.cacheNielsenFile(name)
+
+        df = pd.read_parquet(self.fullfiles[f'{name}_cache'], columns=columns)
+
+        # Parquet gives us missing text back as None, keep it as nan like read_csv does
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].fillna(np.nan)
+
+        return df
+
     def deleteFiles(self):
 
         """
@@ -229,6 +440,11 @@ class NielsenDailyUSPipeline(PipelineBase):
         if os.path.exists(self.fullfiles['song']):
             os.remove(self.fullfiles['song'])
 
+        # Delete the parsed copies of the files
+        for name in ['artist_cache', 'song_cache']:
+            if os.path.exists(self.fullfiles[name]):
+                os.remove(self.fullfiles[name])
+
     def validateSession(self):
 
         """
@@ -243,17 +459,18 @@ class NielsenDailyUSPipeline(PipelineBase):
         """
 
         # Our artist / song files should exist
-        if os.path.exists(self.fullfiles['artist']) == False:
-            raise Exception(f"Missing artist file from zip: {self.fullfiles['zip']}")
+        if os.path.exists(self.fullfiles['zip_local_archive']) == False:
+            raise Exception(f"Missing zip: {self.fullfiles['zip_local_archive']}")
 
-        if os.path.exists(self.fullfiles['song']) == False:
-            raise Exception(f"Missing song file from zip: {self.fullfiles['zip']}")
+        with ZipFile(self.fullfiles['zip_local_archive'], 'r') as file_ref:
+            find_zip_member(file_ref, self.files['artist'])
+            find_zip_member(file_ref, self.files['song'])
 
         print('Check 1: Files exist')
 
-        # We should be able to read those files into a dataframe
-        artists = pd.read_csv(self.fullfiles['artist'], encoding='UTF-16')
-        songs = pd.read_csv(self.fullfiles['song'], encoding='UTF-16')
+        # We should be able to read those files into a dataframe (this is the only time we parse them)
+        self.cacheNielsenFile('artist')
+        self.cacheNielsenFile('song')
 
         print('Check 2: Files are readable')
 
@@ -267,10 +484,10 @@ class NielsenDailyUSPipeline(PipelineBase):
 
             return date_columns
 
-        def hasRequiredColumns(df, required_columns, filename):
+        def hasRequiredColumns(columns, required_columns, filename):
 
             for col in required_columns:
-                if col not in df.columns:
+                if col not in columns:
                     raise Exception(f'{filename} file is missing required column: {col}')
 
         # Create columns for artist file
@@ -312,8 +529,8 @@ class NielsenDailyUSPipeline(PipelineBase):
         ]
 
         # Validate that all the required columns exist
-        hasRequiredColumns(artists, artist_required_columns, 'Artists')
-        hasRequiredColumns(songs, song_required_columns, 'Songs')
+        hasRequiredColumns(self.readNielsenHeader('artist'), artist_required_columns, 'Artists')
+        hasRequiredColumns(self.readNielsenHeader('song'), song_required_columns, 'Songs')
 
         print('Check 3: Files are formatted properly')
 
@@ -337,49 +554,91 @@ class NielsenDailyUSPipeline(PipelineBase):
         
         print('All checks passed!')
 
-    def findSignedByCopyrights(self, df):
+    def getLabelMatcher(self, table):
 
+        """
+            Load one of our label lists (misc.list_of_labels or misc.nielsen_labels) and compile it
+            for match_labels, only once per run.
         """
 
-            Basic check between copyrights and our list of labels.
+        if table not in self.label_matchers:
 
-            Uses: misc.list_of_labels
+            labels = self.db.execute(f'select label from {table}')
 
-            @param df(copyrights, signed, *)
-            @returns df(copyrights, signed, *)
+            if labels is None:
+                raise Exception(f'Labels do not exist: {table}')
+
+            self.label_matchers[table] = compile_label_matcher(labels['label'].values)
+
+        return self.label_matchers[table]
+
+    def signedArtistsVersion(self):
 
         """
-        
-        def findSignedByCopyrightsFilter(row, labels):
-            
-            if row['signed'] == True:
-                return True
+            Identifies the current contents of misc.signed_artists, so we know if a saved index is out of date.
+        """
 
-            # Extract values
-            df_label = row['copyrights'].lower()
+        string = """
+            select count(*)::text || ':' || coalesce(md5(string_agg(artist, E'\\n' order by artist)), '') as version
+            from misc.signed_artists
+        """
+        return self.db.execute(string)['version'][0]
 
-            # Find matches
-            res = [ele for ele in labels if(ele.lower() in df_label)]
-            res = bool(res)
+    def getSignedArtistsFuzz(self):
 
-            if res == True:
-                return True
-            else:
-                return False
+        """
+            Fuzz over misc.signed_artists. It's saved to disk and kept up to date by appendToSignedArtistList,
+            so normally this is just a (memory mapped) load, we only rebuild it when the table changed some other way.
+        """
 
-        # Load in nielsen_labels
-        nielsen_labels = self.db.execute('select * from misc.list_of_labels')
+        with self.signed_artists_lock:
 
-        if nielsen_labels is None:
-            raise Exception('Nielsen labels do not exist.')
+            version = self.signedArtistsVersion()
 
-        labels = nielsen_labels['label'].values
+            if self.signed_artists_fuzz is not None and self.signed_artists_fuzz.version == version:
+                return self.signed_artists_fuzz
+
+            fuzz = Fuzz.load(self.signed_artists_index_folder)
+
+            if fuzz is None or fuzz.version != version:
+
+                artists_df = self.db.execute('select artist from misc.signed_artists')
+
+                if artists_df is None:
+                    raise Exception('Missing signed artists template.')
+
+                fuzz = Fuzz(artists_df.drop_duplicates(keep='first').artist.values)
+
+                if os.path.isdir(self.signed_artists_index_folder) == False:
+                    os.makedirs(self.signed_artists_index_folder)
+
+                fuzz.save(self.signed_artists_index_folder, version)
+                print(f'Rebuilt signed artists index: {len(fuzz.dictionary)} artists')
+
+            self.signed_artists_fuzz = fuzz
+
+            return fuzz
+
+    def findSignedByCopyrights(self, df):
+
+        """
+
+            Basic check between copyrights and our list of labels.
+
+            Uses: misc.list_of_labels
+
+            @param df(copyrights, signed, *)
+            @returns df(copyrights, signed, *)
+
+        """
+        
+        matcher = self.getLabelMatcher('misc.list_of_labels')
 
         # Fill na values to avoid errors
         df['copyrights'] = df['copyrights'].fillna('')
 
-        # Apply filter fn
-        df['signed'] = df.apply(findSignedByCopyrightsFilter, labels=labels, axis=1)
+        # Already signed, or the copyrights contain one of the labels
+        df['signed'] = (df['signed'] == True).to_numpy() | match_labels(df['copyrights'], matcher)
 
         return df
      
@@ -392,37 +651,13 @@ class NielsenDailyUSPipeline(PipelineBase):
 
         # Apply another layer of detecting 'signed' with a running list of signed artists
         def filterBySignedArtistsList(df):
-            
-            def filterBySignedArtistsListFilter(row, fuzz):
-
-                # If we already know they're signed, return
-                if row['signed'] == True:
-                    return True
-
-                # Preprocess the artist name
-                artist = row['artist']
-
-                # Check against fuzzyset
-                ratio, _, _ = fuzz.check(artist)
-
-                if ratio >= 0.95:
-                    return True
-                else:
-                    return False
-
-            # Read in the csv for signed_artists
-            artists_df = self.db.execute('select * from misc.signed_artists')
-
-            if artists_df is None:
-                raise Exception('Missing signed artists template.')
 
-            artists = artists_df.drop_duplicates(keep='first').artist.values
+            # Fuzzyset of signed_artists
+            fuzz = self.getSignedArtistsFuzz()
 
-            # Create fuzzyset
-            fuzz = Fuzz(artists)
-
-            # Check each artist name against fuzzyset and determine if they are signed
-            df['signed'] = df.apply(filterBySignedArtistsListFilter, fuzz=fuzz, axis=1)
+            # Check every artist name against fuzzyset at once, over 95% (or already signed) they're signed
+            ratios, _, _ = fuzz.check_many(df['artist'].values)
+            df['signed'] = (df['signed'] == True).to_numpy() | (ratios >= 0.95)
 
             return df
 
@@ -435,36 +670,9 @@ class NielsenDailyUSPipeline(PipelineBase):
 
     def cleanArtists(self, df):
         
-        # Rename columns for consistency & database usage
-        rename_columns = {
-            'TW Rank': 'tw_rank',
-            'LW Rank': 'lw_rank',
-            'Artist': 'artist',
-            'UnifiedArtistID': 'unified_artist_id',
-            'TD On-Demand Video': 'td_odv',
-            'TD Digital Track Sales': 'td_dts',
-            'TW On-Demand Audio Streams': 'tw_oda_streams',
-            'LW On-Demand Audio Streams': 'lw_oda_streams',
-            'L2W_On_Demand_Audio_Streams': 'l2w_oda_streams',
-            'Weekly %change On-Demand Audio Streams': 'weekly_pct_chg_oda_streams',
-            'YTD On-Demand Audio Streams': 'ytd_oda_streams',
-            'RTD On-Demand Audio Streams': 'rtd_oda_streams',
-            'WTD Building ODA (Friday-Thursday)': 'wtd_building_oda_fri_thurs',
-            '7-day rolling ODA': 'tw_rolling_oda',
-            'pre-7 day rolling oda': 'lw_rolling_oda',
-            'TW Album Sales': 'tw_album_sales',
-            'YTD Album Sales': 'ytd_album_sales',
-            'RTD Album Sales': 'rtd_album_sales',
-            'TW Digital Track Sales': 'tw_digital_track_sales',
-            'YTD Digital Track Sales': 'ytd_digital_track_sales',
-            'RTD Digital Track Sales': 'rtd_digital_track_sales',
-            'TW On-Demand Video': 'tw_odv',
-            'LW On-Demand Video': 'lw_odv',
-            'YTD On-Demand Video': 'ytd_odv',
-            'RTD On-Demand Video': 'rtd_odv'
-        }
 
-        df.rename(columns=rename_columns, inplace=True)
+        # Rename columns for consistency & database usage
+        df.rename(columns=NIELSEN_ARTIST_COLUMNS, inplace=True)
 
         # Drop unnecessary columns
         drop_columns = [
@@ -565,7 +773,7 @@ class NielsenDailyUSPipeline(PipelineBase):
     def filterBySignedArtistsList(self, df):
         
         # Read in the signed artists that are tracked
-        artists_df = self.db.execute('select * from misc.signed_artists')
+        artists_df = self.db.execute('select artist from misc.signed_artists')
 
         if artists_df is None:
             raise Exception('Missing signed artists template')
@@ -590,149 +798,31 @@ class NielsenDailyUSPipeline(PipelineBase):
     def artistsDbUpdates(self, meta, streams):
 
         # META
+        meta_updates = meta[['artist', 'unified_artist_id']].assign(is_global=False)
+        self.db.upsert(meta_updates, 'nielsen_artist.meta', ['unified_artist_id'], ['artist', 'is_global'])
+
+        # Get the ids of every artist in the file
         string = """
-            create temp table tmp_meta (
-                tw_rank int,
-                artist text,
-                unified_artist_id text,
-                tw_oda_streams int,
-                rtd_oda_streams bigint,
-                tw_album_sales int,
-                rtd_album_sales int,
-                tw_digital_track_sales int,
-                rtd_digital_track_sales bigint,
-                tw_odv int,
-                rtd_odv bigint,
-                signed boolean,
-                report_id uuid,
-                report_date date
-            );
+            select id as artist_id, unified_artist_id
+            from nielsen_artist.meta
+            where unified_artist_id = any(%(unified_artist_ids)s)
         """
-        self.db.execute(string)
-        self.db.big_insert(meta, 'tmp_meta')
+        ids = self.db.execute(string, { 'unified_artist_ids': meta['unified_artist_id'].tolist() })
 
         # REPORTS
-        string = """
-            -- Insert new artists into meta table
-            insert into nielsen_artist.meta (artist, unified_artist_id)
-            select artist, unified_artist_id from tmp_meta
-            on conflict (unified_artist_id) do update
-            set
-                artist = excluded.artist,
-                is_global = false;
-
-            -- Insert reports
-            insert into nielsen_artist.reports (
-                artist_id, report_id, tw_rank, tw_oda_streams, rtd_oda_streams, tw_album_sales, rtd_album_sales,
-                tw_digital_track_sales, rtd_digital_track_sales, tw_odv, rtd_odv, signed, report_date
-            )
-            select
-                m.id as artist_id,
-                tm.report_id,
-                tm.tw_rank,
-                tm.tw_oda_streams,
-                tm.rtd_oda_streams,
-                tm.tw_album_sales,
-                tm.rtd_album_sales,
-                tm.tw_digital_track_sales,
-                tm.rtd_digital_track_sales,
-                tm.tw_odv,
-                tm.rtd_odv,
-                tm.signed,
-                tm.report_date
-            from tmp_meta tm
-            left join nielsen_artist.meta m on tm.unified_artist_id = m.unified_artist_id;
-        """
-        self.db.execute(string)
+        reports = pd.merge(meta, ids, on='unified_artist_id', how='inner')
+        reports = reports[[
+            'artist_id', 'report_id', 'tw_rank', 'tw_oda_streams', 'rtd_oda_streams', 'tw_album_sales', 'rtd_album_sales',
+            'tw_digital_track_sales', 'rtd_digital_track_sales', 'tw_odv', 'rtd_odv', 'signed', 'report_date'
+        ]]
+        self.db.big_insert(reports, 'nielsen_artist.reports')
 
         # STREAMS
-        string = """
-            create temp table tmp_streams (
-                unified_artist_id text,
-                date date,
-                streams int
-            );
-        """
-        self.db.execute(string)
-        self.db.big_insert(streams, 'tmp_streams')
-        
-        # Streaming inserts / updates
-        string = """
-            create temp table streams as (
-                select
-                    m.id as artist_id,
-                    ts.date,
-                    ts.streams,
-                    case
-                        when existing_streams.artist_id is null then false
-                        else true
-                    end as record_exists,
-                    existing_streams.streams as existing_streams
-                from tmp_streams ts
-                left join nielsen_artist.meta m on ts.unified_artist_id = m.unified_artist_id
-                left join (
-                    select s.*
-                    from nielsen_artist.streams s
-                    where date > now() - interval '20 days'
-                        and artist_id in (
-                            select m.id
-                            from tmp_meta tm
-                            left join nielsen_artist.meta m on tm.unified_artist_id = m.unified_artist_id
-                        )
-                ) existing_streams on m.id = existing_streams.artist_id and ts.date = existing_streams.date
-            );
-
-            create temp table updates as (
-                select
-                    artist_id,
-                    date,
-                    streams
-                from streams s
-                where record_exists is true
-                    and streams is distinct from existing_streams
-            );
-
-            create temp table inserts as (
-                select
-                    artist_id,
-                    date,
-                    streams
-                from streams
-                where record_exists is false
-            );
-
-            update nielsen_artist.streams s
-            set streams = updates.streams
-            from updates
-            where s.artist_id = updates.artist_id
-            and s.date::date = updates.date::date;
-
-            insert into nielsen_artist.streams (artist_id, date, streams)
-            select artist_id, date::date, streams from inserts;
-
-            select count(*) as value, 'updates' as name from updates
-            union all
-            select count(*) as value, 'inserts' as name from inserts
-        """
-        results = self.db.execute(string)
-
-        # Clean up
-        string = """
-            drop table tmp_meta;
-            drop table tmp_streams;
-            drop table streams;
-            drop table inserts;
-            drop table updates;
-        """
-        self.db.execute(string)
-
-        if results is None:
-            raise Exception('Error getting artist updates')
+        streams = pd.merge(streams, ids, on='unified_artist_id', how='inner')
+        results = self.db.upsert(streams[['artist_id', 'date', 'streams']], 'nielsen_artist.streams', ['artist_id', 'date'], ['streams'])
 
         # RESULTS
-        num_inserts = results.loc[results['name'] == 'inserts', 'value'].iloc[0]
-        num_updates = results.loc[results['name'] == 'updates', 'value'].iloc[0]
-        print(f'Artist updates: {num_inserts} inserts | {num_updates} updates')
+        print(f'Artist updates: {results["inserts"]} inserts | {results["updates"]} updates')
 
     def processArtists(self):
 
@@ -741,7 +831,7 @@ class NielsenDailyUSPipeline(PipelineBase):
         """
 
         # Read in the data
-        df = pd.read_csv(self.fullfiles['artist'], encoding='UTF-16')
+        df = self.readNielsenFile('artist')
 
         # If we're in test mode, just take a subset
         if self.settings['is_testing'] == True:
@@ -754,34 +844,7 @@ class NielsenDailyUSPipeline(PipelineBase):
         self.artistsDbUpdates(meta, streams)
 
     def filterSignedSongs(self, df):
-        
-        def filterSignedFilter(row, labels, labels_fuzz, artists):
-        
-            # Extract values
-            df_label = row['label'].lower()
-
-            # Find matches
-            res = [ele for ele in labels if(ele.lower() in df_label)]
-            res = bool(res)
-
-            # If we found the label match then return it
-            if res:
-                return True
-            
-            # If we didn't find the label match, then our fallback is to fuzzy match
-            ratio, match, _ = labels_fuzz.check(df_label)
 
-            # If the fuzzy ratio is over 90% then you can say we found a match
-            if df_label == match or ratio > 0.9:
-                return True
-
-            # Last chance, if it's in our list of signed artists
-            if row['artist'] in artists:
-                return True
-            
-            # Passed no checks, mark unsigned
-            return False
-        
         # Load in nielsen_labels
         nielsen_labels = self.db.execute('select * from misc.nielsen_labels')
 
@@ -794,51 +857,32 @@ class NielsenDailyUSPipeline(PipelineBase):
         labels_fuzz = Fuzz(labels)
         
         # Read in the csv for signed_artists
-        artists_df = self.db.execute('select * from misc.signed_artists where artist is not null')
+        artists_df = self.db.execute('select artist from misc.signed_artists where artist is not null')
 
         if artists_df is None:
             raise Exception('Error getting signed artists template')
 
         artists = artists_df.drop_duplicates(keep='first').artist.values
-        
-        df['signed'] = df.apply(filterSignedFilter, labels=labels, labels_fuzz=labels_fuzz, artists=artists, axis=1)
+
+        # First check whether the label contains any of the nielsen labels
+        signed = match_labels(df['label'], self.getLabelMatcher('misc.nielsen_labels'))
+
+        # If we didn't find the label match, then our fallback is to fuzzy match (over 90% we can say we found a match)
+        unmatched = np.flatnonzero(~signed)
+        df_labels = df['label'].iloc[unmatched].str.lower().to_numpy(dtype=object)
+        ratios, matches, _ = labels_fuzz.check_many(df_labels)
+        signed[unmatched] = (df_labels == matches) | (ratios > 0.9)
+
+        # Last chance, if it's in our list of signed artists
+        df['signed'] = signed | df['artist'].isin(artists).to_numpy()
         
         return df
 
     def cleanSongs(self, df):
         
-        # Rename the remaining columns for consistency and database usage
-        renameable = {
-            'TW Rank': 'tw_rank',
-            'LW Rank': 'lw_rank',
-            'Artist': 'artist',
-            'Title': 'title',
-            'Unified Song Id': 'unified_song_id',
-            'Label Abbrev': 'label',
-            'CoreGenre': 'core_genre',
-            'Top ISRC': 'isrc',
-            'Release_date': 'release_date',
-            'TW On-Demand Audio Streams': 'tw_oda_streams',
-            'LW On-Demand Audio Streams': 'lw_oda_streams',
-            'L2W_On_Demand_Audio_Streams': 'l2w_oda_streams',
-            'Weekly %change On-Demand Audio Streams': 'weekly_pct_chg_oda_streams',
-            'YTD On-Demand Audio Streams': 'ytd_oda_streams',
-            'RTD On-Demand Audio Streams': 'rtd_oda_streams',
-            'RTD On-Demand Audio Streams - Premium': 'rtd_oda_streams_premium',
-            'RTD On-Demand Audio Streams - Ad Supported': 'rtd_oda_streams_ad_supported',
-            'WTD Building ODA (Friday-Thursday)': 'wtd_building_fri_thurs',
-            '7-day Rolling ODA': 'tw_rolling_oda',
-            'pre-7days rolling ODA': 'lw_rolling_oda',
-            'TW Digital Track Sales': 'tw_digital_track_sales',
-            'YTD Digital Track Sales': 'ytd_digital_track_sales',
-            'ATD Digital Track Sales': 'atd_digital_track_sales',
-            'TW On-Demand Video': 'tw_odv',
-            'LW On-Demand Video': 'lw_odv',
-            'YTD On-Demand Video': 'ytd_odv',
-            'ATD On-Demand Video': 'atd_odv'
-        }
 
-        df = df.rename(columns=renameable)
+        # Rename the remaining columns for consistency and database usage
+        df = df.rename(columns=NIELSEN_SONG_COLUMNS)
 
         # Drop unnecessary columns
         drop_columns = [
@@ -941,13 +985,16 @@ class NielsenDailyUSPipeline(PipelineBase):
         signed_df = df.loc[df['signed'] == True, ['artist']].reset_index(drop=True)
 
         # Get the existing signed artists
-        signed_existing = self.db.execute('select * from misc.signed_artists')
+        signed_existing = self.db.execute('select artist from misc.signed_artists')
         if signed_existing is None:
             raise Exception('Missing signed artists template')
 
         # Get the artists in our new df that don't exist already
         new_signed = signed_df[(~signed_df['artist'].isin(signed_existing['artist'])) & (~signed_df['artist'].isnull())].reset_index(drop=True)
         
+        # Where the table is at before we insert (to know if the saved index is too)
+        version = self.signedArtistsVersion()
+
         # Upload newly signed artists to the tracker
         string = """
             create temp table tmp_signed_artists (
@@ -965,6 +1012,16 @@ class NielsenDailyUSPipeline(PipelineBase):
         self.db.execute('drop table tmp_signed_artists')
         print(f'Inserted {new_signed.shape[0]} new signed artists to tracker...')
 
+        # Add them to the saved signed artists index, if it's out of date anyway it gets rebuilt the next time it's used
+        with self.signed_artists_lock:
+
+            fuzz = self.signed_artists_fuzz or Fuzz.load(self.signed_artists_index_folder)
+
+            if fuzz is not None and fuzz.version == version:
+                fuzz.add(new_signed['artist'].values)
+                fuzz.save(self.signed_artists_index_folder, self.signedArtistsVersion())
+                self.signed_artists_fuzz = fuzz
+
     def prepareSongData(self, df):
         
         # Basic cleanup and separation of datasets
@@ -985,182 +1042,41 @@ class NielsenDailyUSPipeline(PipelineBase):
         # Add signed artists to running list
         self.appendToSignedArtistList(meta)
         
-        # Pivot all the streaming data from wide to long format
-        total = total.melt(id_vars='unified_song_id', var_name='date', value_name='streams')
-        ad_supported = ad_supported.melt(id_vars='unified_song_id', var_name='date', value_name='ad_supported')
-        premium = premium.melt(id_vars='unified_song_id', var_name='date', value_name='premium')
-
-        # Merge streaming info together
-        streams = pd.merge(total, ad_supported, on=['unified_song_id', 'date'])
-        streams = pd.merge(streams, premium, on=['unified_song_id', 'date'])
-
-        # Make sure we don't have any null streaming values
-        streams['streams']  = streams['streams'].fillna(0).astype('int')
-        streams['premium']  = streams['premium'].fillna(0).astype('int')
-        streams['ad_supported']  = streams['ad_supported'].fillna(0).astype('int')
+        # Pivot all the streaming data from wide to long format (null streams become 0)
+        streams = reshape_song_streams(total, premium, ad_supported)
         
         return meta, streams
 
     def songsDbUpdates(self, meta, streams):
 
-        # META / REPORTS / ISRC UPDATES
-        string = """
-            create temp table tmp_meta (
-                tw_rank int,
-                artist text,
-                title text,
-                unified_song_id text,
-                label text,
-                core_genre text,
-                release_date date,
-                isrc text,
-                tw_oda_streams int,
-                rtd_oda_streams bigint,
-                rtd_oda_streams_premium bigint,
-                rtd_oda_streams_ad_supported bigint,
-                tw_digital_track_sales int,
-                atd_digital_track_sales int,
-                tw_odv int,
-                atd_odv bigint,
-                signed boolean,
-                report_date date
-            );
-        """
-        self.db.execute(string)
-        self.db.big_insert(meta, 'tmp_meta')
+        # META / ISRC UPDATES
+        meta_updates = meta[['artist', 'title', 'unified_song_id', 'label', 'core_genre', 'release_date', 'isrc']].assign(is_global=False)
+        update_columns = ['artist', 'title', 'label', 'core_genre', 'release_date', 'isrc', 'is_global']
+        self.db.upsert(meta_updates, 'nielsen_song.meta', ['unified_song_id'], update_columns)
 
+        # Get the ids of every song in the file
         string = """
-            -- META
-            insert into nielsen_song.meta (artist, title, unified_song_id, label, core_genre, release_date, isrc)
-            select artist, title, unified_song_id, label, core_genre, release_date, isrc from tmp_meta
-            on conflict (unified_song_id) do update
-            set
-                artist = excluded.artist,
-                title = excluded.title,
-                label = excluded.label,
-                core_genre = excluded.core_genre,
-                release_date = excluded.release_date,
-                isrc = excluded.isrc,
-                is_global = false;
-
-            -- REPORTS
-            insert into nielsen_song.reports (
-                song_id, tw_rank, tw_oda_streams, rtd_oda_streams, tw_digital_track_sales,
-                atd_digital_track_sales, tw_odv, atd_odv, signed, report_date
-            )
-            select
-                m.id as song_id,
-                tm.tw_rank,
-                tm.tw_oda_streams,
-                tm.rtd_oda_streams,
-                tm.tw_digital_track_sales,
-                tm.atd_digital_track_sales,
-                tm.tw_odv,
-                tm.atd_odv,
-                tm.signed,
-                tm.report_date
-            from tmp_meta tm
-            left join nielsen_song.meta m on tm.unified_song_id = m.unified_song_id;
-        """
-        self.db.execute(string)
-
-        # STREAMS
-        string = """
-            create temp table tmp_streams (
-                unified_song_id text,
-                date date,
-                streams int,
-                ad_supported int,
-                premium int
-            );
-        """
-        self.db.execute(string)
-        self.db.big_insert(streams, 'tmp_streams')
-
-        string = """
-            create temp table streams as (
-                select
-                    m.id as song_id,
-                    ts.date,
-                    ts.streams,
-                    existing_streams.streams as existing_streams,
-                    ts.ad_supported,
-                    ts.premium,
-                    case
-                        when existing_streams.song_id is null then false
-                        else true
-                    end as record_exists
-                from tmp_streams ts
-                left join nielsen_song.meta m on ts.unified_song_id = m.unified_song_id
-                left join (
-                    select s.*
-                    from nielsen_song.streams s
-                    where date > now() - interval '20 days'
-                        and song_id in (
-                            select m.id
-                            from tmp_meta tm
-                            left join nielsen_song.meta m on tm.unified_song_id = m.unified_song_id
-                        )
-                ) existing_streams on m.id = existing_streams.song_id and ts.date = existing_streams.date
-            );
-
-            create temp table updates as (
-                select
-                    song_id,
-                    date,
-                    streams,
-                    premium,
-                    ad_supported
-                from streams s
-                where record_exists is true
-                    and streams is distinct from existing_streams
-            );
-
-            create temp table inserts as (
-                select
-                    song_id,
-                    date,
-                    streams,
-                    premium,
-                    ad_supported
-                from streams
-                where record_exists is false
-            );
-
-            update nielsen_song.streams s
-            set streams = updates.streams,
-                ad_supported = updates.ad_supported,
-                premium = updates.premium
-            from updates
-            where s.song_id = updates.song_id
-                and s.date = updates.date;
-
-            insert into nielsen_song.streams (song_id, date, streams, ad_supported, premium)
-            select song_id, date, streams, ad_supported, premium from inserts;
-
-            select count(*) as value, 'updates' as name from updates
-            union all
-            select count(*) as value, 'inserts' as name from inserts
+            select id as song_id, unified_song_id
+            from nielsen_song.meta
+            where unified_song_id = any(%(unified_song_ids)s)
         """
-        results = self.db.execute(string)
+        ids = self.db.execute(string, { 'unified_song_ids': meta['unified_song_id'].tolist() })
 
-        # Clean up
-        string = """
-            drop table tmp_meta;
-            drop table tmp_streams;
-            drop table streams;
-            drop table inserts;
-            drop table updates;
-        """
-        self.db.execute(string)
+        # REPORTS
+        reports = pd.merge(meta, ids, on='unified_song_id', how='inner')
+        reports = reports[[
+            'song_id', 'tw_rank', 'tw_oda_streams', 'rtd_oda_streams', 'tw_digital_track_sales',
+            'atd_digital_track_sales', 'tw_odv', 'atd_odv', 'signed', 'report_date'
+        ]]
+        self.db.big_insert(reports, 'nielsen_song.reports')
 
-        if results is None:
-            raise Exception('Error getting song updates')
+        # STREAMS
+        streams = pd.merge(streams, ids, on='unified_song_id', how='inner')
+        streams = streams[['song_id', 'date', 'streams', 'ad_supported', 'premium']]
+        results = self.db.upsert(streams, 'nielsen_song.streams', ['song_id', 'date'], ['streams', 'ad_supported', 'premium'])
 
-        # Print the elapsed time & results
-        num_inserts = results.loc[results['name'] == 'inserts', 'value'].iloc[0]
-        num_updates = results.loc[results['name'] == 'updates', 'value'].iloc[0]
-        print(f'Song updates: {num_inserts} inserts | {num_updates} updates')
+        # Print the results
+        print(f'Song updates: {results["inserts"]} inserts | {results["updates"]} updates')
 
     def processSongs(self):
 
@@ -1169,7 +1085,7 @@ class NielsenDailyUSPipeline(PipelineBase):
         """
 
         # Read in the data
-        df = pd.read_csv(self.fullfiles['song'], encoding='UTF-16')
+        df = self.readNielsenFile('song')
 
         # If we're in test mode, just take a subset
         if self.settings['is_testing'] == True:
@@ -1275,28 +1191,6 @@ class NielsenDailyUSPipeline(PipelineBase):
                 'total_tracks': total_tracks
             }
 
-        def getSpotifyTracksManually(row, track_columns):
-
-            # If we already have the data, skip
-            if pd.notnull(row['spotify_track_id']):
-                return pd.Series({ key: row[key] for key in track_columns })
-
-            isrc = row['isrc']
-            if pd.notnull(isrc):
-
-                items = spotify.searchTracks(f'isrc:{isrc}')
-            
-                if len(items) > 0:
-                    return pd.Series(extractSongInfo(items[0]))
-
-            # If we don't find anything then just resort to searching by title / artist
-            res = spotify.searchByTitleAndArtist(row['title'], row['artist'])
-            if res is not None:
-                return pd.Series(extractSongInfo(res))
-            
-            # If everything fails, just return all None values for the columns we expect
-            return pd.Series({ key: None for key in track_columns })
-
         def getSpotifyTracks(df, spotify):
 
             """
@@ -1304,8 +1198,8 @@ class NielsenDailyUSPipeline(PipelineBase):
 
                 Input: Dataframe with columns { title, artist, isrc }
 
-                Steps:
-                    1. Use isrcs to attempt to match to reporting_db existing cache
+                Steps (see resolve_spotify_tracks):
+                    1. Use isrcs to match to our own cache and the reporting_db cache in bulk
                     2. Use isrcs to search manually and fill in the gaps
                     3. Use title / artist to search manually and fill in the gaps
             """
@@ -1338,59 +1232,11 @@ class NielsenDailyUSPipeline(PipelineBase):
                 df[track_columns] = None
                 return df
 
-            # Extract isrcs for bulk search
-            isrcs = tuple(df.loc[~df['isrc'].isnull(), 'isrc'].unique())
-            isrcs = []
-
-            # If we found any, do a bulk search
-            if len(isrcs) > 0:
-
-                # Attempt to match the spotify track ids to the isrcs we already have
-                string = """
-                    select
-                        isrc,
-                        spotify_track_id,
-                        popularity_score as popularity
-                    from chartmetric_raw.spotify
-                    where isrc in %(isrcs)s
-                """
-                params = { 'isrcs': isrcs }
-                spotify = self.reporting_db.execute(string, params)
-                if spotify is None:
-                    raise Exception('Error getting from chartmetric_raw.spotify')
-
-                # Remove duplicate isrcs and keep the ones with the highest popularity score
-                spotify = spotify.sort_values(by='popularity', ascending=False).drop_duplicates(subset=['isrc']).drop(columns='popularity').reset_index(drop=True)
-
-                # Merge the spotify track ids onto our main dataset
-                df = pd.merge(df, spotify, on='isrc', how='left')
-
-                # Loop through the spotify track ids we just got in bulk
-                data = []
-                chunks = chunker(df.loc[~df['spotify_track_id'].isnull(), 'spotify_track_id'].unique(), 50)
-                for spotify_track_ids in chunks:
-                    
-                    # Get spotify info from api
-                    tracks = spotify.tracks(spotify_track_ids)
-
-                    # Extract information we're interested in
-                    tracks = [extractSongInfo(i) for i in tracks]
+            tracks = resolve_spotify_tracks(df, spotify, self.db, self.reporting_db)
 
-                    # Append to list
-                    data = [ *data, *tracks ]
-
-                # Convert to dataframe for easy merging
-                data = pd.DataFrame(data)
-
-                # Add info to our main dataframe
-                df = pd.merge(df, data, on=['isrc', 'spotify_track_id'], how='left')
-
-            else:
-
-                df['spotify_track_id'] = None
-
-            # Fill in the gaps by searching for missing spotify_track_ids by isrc, and then title & artist
-            df[track_columns] = df.apply(getSpotifyTracksManually, track_columns=track_columns, axis=1)
+            # Rows we couldn't match get None for every column
+            data = [extractSongInfo(i) if i is not None else { key: None for key in track_columns } for i in tracks]
+            df[track_columns] = pd.DataFrame(data, index=df.index)[track_columns]
 
             return df
 
@@ -1418,16 +1264,8 @@ class NielsenDailyUSPipeline(PipelineBase):
             # Get all the album ids
             album_ids = df.loc[(~df['spotify_album_id'].isnull()) & (df['spotify_album_id'] != ''), 'spotify_album_id'].unique().tolist()
 
-            # Loop through in chunks of 20
-            data = []
-            chunks = chunker(album_ids, 20)
-            for chunk in chunks:
-
-                res = spotify.albums(chunk)
-
-                res = [album2Data(i) for i in res]
-
-                data = [ *data, *res ]
+            # Get the albums in chunks of 20
+            data = [album2Data(i) for i in spotify.map(spotify.albums, album_ids, chunksize=20)]
 
             # Convert this to a dataframe
             data = pd.DataFrame(data)
@@ -1449,15 +1287,8 @@ class NielsenDailyUSPipeline(PipelineBase):
             # Get all the spotify track ids
             track_ids = df.loc[(~df['spotify_track_id'].isnull()) & (df['spotify_track_id'] != ''), 'spotify_track_id'].unique().tolist()
 
-            # Loop through in chunks of 100
-            data = []
-            max_chunk = 100
-            chunks = chunker(track_ids, max_chunk)
-            for chunk in chunks:
-
-                res = spotify.audio_features(chunk)
-
-                data = [ *data, *res ]
+            # Get the audio features in chunks of 100
+            data = spotify.map(spotify.audio_features, track_ids, chunksize=100)
 
             if len(data) > 0:
                 
@@ -1482,7 +1313,7 @@ class NielsenDailyUSPipeline(PipelineBase):
             return df
 
         # Init Spotify client
-        spotify = Spotify()
+        spotify = AsyncSpotify()
 
         df = getSpotifyTracks(df, spotify)
         df = getSpotifyAlbums(df, spotify)
@@ -1541,17 +1372,8 @@ class NielsenDailyUSPipeline(PipelineBase):
         # Get all the spotify artist ids
         artist_ids = df.loc[(~df['spotify_artist_id'].isnull()) & (df['spotify_artist_id'] != ''), 'spotify_artist_id'].unique().tolist()
 
-        # Loop through in chunks of 50
-        data = []
-        max_chunk = 50
-        chunks = chunker(artist_ids, max_chunk)
-        for chunk in chunks:
-
-            res = spotify.artists(chunk)
-
-            res = [transformSpotifyArtistObject(i) for i in res]
-
-            data = [ *data, *res ]
+        # Get the artists in chunks of 50
+        data = [transformSpotifyArtistObject(i) for i in spotify.map(spotify.artists, artist_ids, chunksize=50)]
 
         if len(data) > 0:
             
@@ -1573,37 +1395,16 @@ class NielsenDailyUSPipeline(PipelineBase):
             Manually search artists who didn't have a spotify artist id
         """
 
-        def transformSpotifyArtistObject2Series(obj):
-            if obj is None:
-                return pd.Series(tuple([None for _ in range(len(spotify_columns))]))
-            else:
-                return pd.Series(tuple([obj[i] for i in spotify_columns]))
-
-        def getSpotifyArtistManually(row, spotify):
-            
-            if ~pd.isnull(row['spotify_artist_id']) and row['spotify_artist_id'] != '' and row['spotify_artist_id'] is not None:
-                return transformSpotifyArtistObject2Series(row)
+        async def searchSpotifyArtist(name):
 
-            # Refresh the spotify token every so often
-            if random.random() < 0.1:
-                spotify.refresh()
-
-            name = row['artist']
-
-            res = spotify.searchArtistByName(name)
+            res = await spotify.searchArtistByName(name)
 
+            # A lot of the time, the name is just missing a "The" at
+            # the beginning, so we'll just try that
             if res is None:
+                res = await spotify.searchArtistByName('The ' + name)
 
-                # A lot of the time, the name is just missing a "The" at
-                # the beginning, so we'll just try that
-                res = spotify.searchArtistByName('The ' + name)
-                
-                if res is not None:
-                    return transformSpotifyArtistObject2Series(transformSpotifyArtistObject(res))
-                
-                return pd.Series(tuple([None for _ in range(len(spotify_columns))]))
-
-            return transformSpotifyArtistObject2Series(transformSpotifyArtistObject(res))
+            return res
 
         spotify_columns = [
             'url',
@@ -1619,10 +1420,20 @@ class NielsenDailyUSPipeline(PipelineBase):
 
         # Only do something if we have data to get
         mask = (df['spotify_artist_id'].isnull()) | (df['spotify_artist_id'] == '')
-        total = df.shape[0]
-        if total > 0:
+        if mask.any():
+
+            new_columns = [i for i in spotify_columns if i not in df.columns]
+            if len(new_columns) > 0:
+                df[new_columns] = None
 
-            df[spotify_columns] = df.apply(getSpotifyArtistManually, spotify=spotify, axis=1)
+            # Search all the missing artists concurrently
+            res = spotify.map(searchSpotifyArtist, df.loc[mask, 'artist'].tolist())
+
+            data = pd.DataFrame(
+                [transformSpotifyArtistObject(i) if i is not None else { key: None for key in spotify_columns } for i in res],
+                index=df.index[mask]
+            )
+            df.loc[mask, spotify_columns] = data[spotify_columns]
 
         return df
 
@@ -1632,31 +1443,16 @@ class NielsenDailyUSPipeline(PipelineBase):
             Attach the ids of the most popular album / track.
         """
 
-        # Attach the album id of the artists most popular track    
-        def getPopularTrackId(row, spotify):
-
-            # We can't search if we don't have a spotify_artist_id for the artist
-            if pd.isnull(row['spotify_artist_id']) or row['spotify_artist_id'] == '' or row['spotify_artist_id'] is None:
-                return pd.Series((None, None))
-
-            popular_tracks = spotify.artist_top_tracks(row['spotify_artist_id'])
-
-            # If we didn't get anything then we can just exit
-            if len(popular_tracks) == 0:
-                return pd.Series((None, None))
-
-            # Get the top tracks album id
-            spotify_popular_track_id = popular_tracks[0]['id']
-            spotify_popular_album_id = popular_tracks[0]['album']['id']
-
-            # This is where we exit so that we can bulk search for album ids later
-            return pd.Series((spotify_popular_track_id, spotify_popular_album_id))
-
-        total = df.shape[0]
         cols = ['spotify_popular_track_id', 'spotify_popular_album_id']
         df[cols] = None
-        if total > 0:
-            df[cols] = df.apply(getPopularTrackId, spotify=spotify, axis=1)
+
+        # We can't search if we don't have a spotify_artist_id for the artist
+        mask = (df['spotify_artist_id'].notnull()) & (df['spotify_artist_id'] != '')
+        if mask.any():
+
+            # Attach the ids of the artists most popular track and its album
+            res = spotify.map(spotify.artist_top_track, df.loc[mask, 'spotify_artist_id'].tolist())
+            df.loc[mask, cols] = [(i['id'], i['album']['id']) if i is not None else (None, None) for i in res]
 
         return df
 
@@ -1681,15 +1477,8 @@ class NielsenDailyUSPipeline(PipelineBase):
         # Get all the popular track album ids
         album_ids = df.loc[(pd.notnull(df['spotify_popular_album_id'])) & (df['spotify_popular_album_id'] != ''), 'spotify_popular_album_id'].unique().tolist()
 
-        # Loop through in chunks of 20
-        data = []
-        chunks = chunker(album_ids, 20)
-        for chunk in chunks:
-
-            res = spotify.albums(chunk)
-            res = [album2Data(i) for i in res]
-
-            data = [ *data, *res ]
+        # Get the albums in chunks of 20
+        data = [album2Data(i) for i in spotify.map(spotify.albums, album_ids, chunksize=20)]
 
         # Convert this to a dataframe
         data = pd.DataFrame(data)
@@ -1748,7 +1537,7 @@ class NielsenDailyUSPipeline(PipelineBase):
             raise Exception('Error getting spotify artists to cache')
 
         # Init spotify client
-        spotify = Spotify()
+        spotify = AsyncSpotify()
 
         # Get spotify info
         df = self.bulkGetSpotifyArtistInfo(df, spotify)
@@ -2114,33 +1903,15 @@ class NielsenDailyUSPipeline(PipelineBase):
             Use the spotify copyrights to filter signed artists
         """
 
-        def aaronMethodNielsenLabelsSignedToSongFilter(row, labels):
-        
-            # Extract values
-            df_label = row['spotify_copyrights'].lower()
+        def aaronMethodNielsenLabelsSignedToSong(df):
             
-            # Find matches
-            res = [ele for ele in labels if(ele in df_label)]
-            res = bool(res)
-            
-            if res == True:
-                return True
-            else:
-                return False
-
-        def aaronMethodNielsenLabelsSignedToSong(df, db):
-            
-            # Load in nielsen_labels
-            nielsen_labels = db.execute('select * from misc.list_of_labels')
-            labels = [i.lower() for i in nielsen_labels['label'].values]
-            
-            df['signed'] = df.apply(aaronMethodNielsenLabelsSignedToSongFilter, labels=labels, axis=1)
+            df['signed'] = match_labels(df['spotify_copyrights'], self.getLabelMatcher('misc.list_of_labels'))
             
             return df
 
-        def filterSigned(df, db):
+        def filterSigned(df):
 
-            df = aaronMethodNielsenLabelsSignedToSong(df, db)
+            df = aaronMethodNielsenLabelsSignedToSong(df)
             return df[df['signed'] == True].reset_index(drop=True)
 
         # Get artists to check
@@ -2185,8 +1956,8 @@ class NielsenDailyUSPipeline(PipelineBase):
         songs = self.db.execute(string)
 
         # Perform filter
-        artists = filterSigned(artists, self.db).drop(columns=['artist', 'spotify_copyrights', 'signed'])
-        songs = filterSigned(songs, self.db).drop(columns=['artist', 'title', 'spotify_copyrights', 'signed'])
+        artists = filterSigned(artists).drop(columns=['artist', 'spotify_copyrights', 'signed'])
+        songs = filterSigned(songs).drop(columns=['artist', 'title', 'spotify_copyrights', 'signed'])
 
         # Create temp tables
         string = """
@@ -2255,23 +2026,14 @@ class NielsenDailyUSPipeline(PipelineBase):
             df.drop(columns=[ 'spotify_image', 'image_url' ], inplace=True) # end with columns [ song_id, dominant_color ]
 
             # Update the database
-            string = """
-                create temp table tmp_colors (
-                    song_id bigint,
-                    dominant_color text
-                );
-            """
-            self.db.execute(string)
-            self.db.big_insert(df, 'tmp_colors')
-
             string = """
                 update nielsen_song.meta m
                 set dominant_color = c.dominant_color
                 from tmp_colors c
                 where m.id = c.song_id;
             """
-            self.db.execute(string)
-            self.db.execute('drop table tmp_colors')
+            with self.db.staging(df, 'tmp_colors', types={ 'song_id': 'bigint', 'dominant_color': 'text' }):
+                self.db.execute(string)
         
     def updateArtistsDominantColors(self):
 
@@ -2300,23 +2062,14 @@ class NielsenDailyUSPipeline(PipelineBase):
             df = pd.merge(df, dc, left_on='spotify_image', right_on='image_url', how='inner')
             df.drop(columns=[ 'spotify_image', 'image_url' ], inplace=True) # end with columns [ artist_id, dominant_color ]
 
-            string = """
-                create temp table tmp_colors (
-                    artist_id bigint,
-                    dominant_color text
-                );
-            """
-            self.db.execute(string)
-            self.db.big_insert(df, 'tmp_colors')
-
             string = """
                 update nielsen_artist.meta m
                 set dominant_color = c.dominant_color
                 from tmp_colors c
                 where m.id = c.artist_id;
             """
-            self.db.execute(string)
-            self.db.execute('drop table tmp_colors')
+            with self.db.staging(df, 'tmp_colors', types={ 'artist_id': 'bigint', 'dominant_color': 'text' }):
+                self.db.execute(string)
     
     def refreshReportsRecent(self):
 
@@ -2575,16 +2328,15 @@ class NielsenDailyUSPipeline(PipelineBase):
                 join chartmetric_raw.instagram_stat igs on ig.instagram_id = igs.account_id
                 where date > dateadd('days', -16, current_date)
             """
-            xdf = self.reporting_db.execute(string)
+            # Stream the results in chunks so we never hold the whole pull as python objects, and drop null followers as we go
+            chunks = self.reporting_db.iter_df(string, dtypes={ 'ig_followers': 'float' })
+            xdf = pd.concat([chunk[~chunk['ig_followers'].isnull()] for chunk in chunks], ignore_index=True)
 
             string = 'drop table tmp_instagram_ids'
             self.reporting_db.execute(string)
 
             # Some preprocessing so that we can work with a clean dataset during our actual analysis
 
-            # Remove null values in followers column
-            xdf = xdf[~xdf['ig_followers'].isnull()].reset_index(drop=True)
-
             # Clean types
             xdf['date'] = pd.to_datetime(xdf['date'])
             xdf = xdf.astype({
@@ -2748,7 +2500,9 @@ class NielsenDailyUSPipeline(PipelineBase):
                 where sa.followers_latest > 2000
                     and date > dateadd('days', -16, current_date)
             """
-            xdf = self.reporting_db.execute(string)
+            # Stream the results in chunks so we never hold the whole pull as python objects, and drop null followers as we go
+            chunks = self.reporting_db.iter_df(string, dtypes={ 'sp_followers': 'float' })
+            xdf = pd.concat([chunk[~chunk['sp_followers'].isnull()] for chunk in chunks], ignore_index=True)
 
             # Drop the temporary table to stay clean
             string = 'drop table tmp_spotify_ids'
@@ -2756,9 +2510,6 @@ class NielsenDailyUSPipeline(PipelineBase):
 
             # Some preprocessing so that we can work with a clean dataset during our actual analysis
 
-            # Remove null values in followers column
-            xdf = xdf[~xdf['sp_followers'].isnull()].reset_index(drop=True)
-
             # Clean types
             xdf['date'] = pd.to_datetime(xdf['date'])
             xdf = xdf.astype({
@@ -2911,7 +2662,9 @@ class NielsenDailyUSPipeline(PipelineBase):
                     and tus.followers != 0
                     and date > dateadd('days', -21, current_date)
             """
-            xdf = self.reporting_db.execute(string)
+            # Stream the results in chunks so we never hold the whole pull as python objects, and drop null followers as we go
+            chunks = self.reporting_db.iter_df(string, dtypes={ 'tt_followers': 'float' })
+            xdf = pd.concat([chunk[~chunk['tt_followers'].isnull()] for chunk in chunks], ignore_index=True)
 
             # Drop the temporary table to stay clean
             string = 'drop table tmp_tiktok_ids'
@@ -2919,9 +2672,6 @@ class NielsenDailyUSPipeline(PipelineBase):
 
             # Some preprocessing so that we can work with a clean dataset during our actual analysis
 
-            # Remove null values in followers column
-            xdf = xdf[~xdf['tt_followers'].isnull()].reset_index(drop=True)
-
             # Clean types
             xdf['date'] = pd.to_datetime(xdf['date'])
             xdf = xdf.astype({
@@ -3460,6 +3210,7 @@ class NielsenDailyUSPipeline(PipelineBase):
         def get_genius_data(genre, page):
 
             url = f'https://genius.com/api/songs/chart?time_period=day&chart_genre={genre}&page={page}&per_page=50'
+            count_http_call()
             res = requests.get(url)
             res = res.json()
             
@@ -3702,7 +3453,7 @@ class NielsenDailyUSPipeline(PipelineBase):
             
             return df
 
-        df = pd.read_csv(self.fullfiles['song'], encoding='UTF-16')
+        df = self.readNielsenFile('song')
 
         # Clean columns
         df = cleanColumns(df)
@@ -3886,15 +3637,6 @@ class NielsenDailyUSPipeline(PipelineBase):
         # Drop any null values, empty strings & duplicates
         isrcs = isrcs[(~isrcs['isrc'].isnull()) & (isrcs['isrc'] != '')].drop_duplicates(subset=['isrc']).reset_index(drop=True)
 
-        # Create temp table for merge matching, we know this technique...
-        string = """
-            create temp table tmp_isrcs (
-                isrc text
-            );
-        """
-        self.db.execute(string)
-        self.db.big_insert(isrcs, 'tmp_isrcs')
-
         # Select the data from our tables using merge matching
         # Select data from both nielsen_song.spotify & nielsen_song.spotify_extra
         string = """
@@ -3941,11 +3683,10 @@ class NielsenDailyUSPipeline(PipelineBase):
             union all
             select * from sp_extra
         """
-        existing_isrcs = self.db.execute(string)
 
-        # Drop out temporary table to stay clean
-        string = 'drop table tmp_isrcs'
-        self.db.execute(string)
+        # Stage the isrcs for merge matching, we know this technique... (dropped when we're done)
+        with self.db.staging(isrcs, 'tmp_isrcs', types={ 'isrc': 'text' }, analyze=True):
+            existing_isrcs = self.db.execute(string)
 
         # Lastly, we can drop duplicate rows
         # But first we want to sort it by tw_streams, because we may have found 2 songs with the same
@@ -4255,7 +3996,7 @@ class NielsenDailyUSPipeline(PipelineBase):
             self.reporting_db.execute('drop table tmp_isrcs')
 
             # Use our list of labels and the spotify copyrights to filter signed things
-            shazam = filter_signed_artists_with_nielsen_label_list(shazam, self.db)
+            shazam = filter_signed_artists_with_nielsen_label_list(shazam, self.db, self.getLabelMatcher('misc.nielsen_labels'))
 
             # Rename any columns that need to be renamed
             rename_columns = {
@@ -4608,7 +4349,9 @@ class NielsenDailyUSPipeline(PipelineBase):
             where tw.tw_monthly_listeners >= 100000
                 and lw.lw_monthly_listeners != 0
         """
-        df = self.reporting_db.execute(string)
+
+        # This scans a lot of chartmetric data, so unload it instead of pulling it over the cursor
+        df = self.reporting_db.unload_df(string)
 
         # Do some stats calculations
         df['monthly_listeners_pct_chg'] = ((df['tw_monthly_listeners']).div(df['lw_monthly_listeners']) - 1) * 100
@@ -4831,7 +4574,7 @@ class NielsenDailyUSPipeline(PipelineBase):
     def report_nielsenWeeklyAudio(self):
 
         # Read in the data
-        df = pd.read_csv(self.fullfiles['song'], encoding='UTF-16')
+        df = self.readNielsenFile('song')
 
         # Rename the remaining columns for consistency and database usage
         renameable = {
@@ -6153,8 +5896,9 @@ class NielsenDailyUSPipeline(PipelineBase):
 
     def build(self):
 
-        self.add_function(self.downloadFiles, 'Download Files')
-        self.add_function(self.validateSession, 'Validate Session')
+        # The downloaded files might not be around anymore when we resume, so always run these
+        self.add_function(self.downloadFiles, 'Download Files', skip_on_resume=False)
+        self.add_function(self.validateSession, 'Validate Session', skip_on_resume=False)
 
         """
             Stage 1:
@@ -6176,8 +5920,8 @@ class NielsenDailyUSPipeline(PipelineBase):
                     = Depends on processSongs
                     = Caches spotify information about songs
         """
-        self.add_function(self.refreshStats, 'Refresh Stats')
-        self.add_function(self.cacheSpotifySongs, 'Cache Spotify Songs', error_on_failure=False)
+        self.add_function(self.refreshStats, 'Refresh Stats', depends_on=['Update Recent Date'])
+        self.add_function(self.cacheSpotifySongs, 'Cache Spotify Songs', error_on_failure=False, depends_on=['Process Songs'])
 
         """
             Stage 3:
@@ -6189,8 +5933,8 @@ class NielsenDailyUSPipeline(PipelineBase):
                         : Uses the associated albums to each spotify song to cache
                 
         """
-        self.add_function(self.refreshArtistTracks, 'Refresh Artist Tracks')
-        self.add_function(self.cacheSpotifyAlbums, 'Cache Spotify Albums', error_on_failure=False)
+        self.add_function(self.refreshArtistTracks, 'Refresh Artist Tracks', depends_on=['Refresh Stats'])
+        self.add_function(self.cacheSpotifyAlbums, 'Cache Spotify Albums', error_on_failure=False, depends_on=['Cache Spotify Songs'])
 
         """
             Stage 4:
@@ -6214,11 +5958,11 @@ class NielsenDailyUSPipeline(PipelineBase):
                 - updateArtistsDominantColors | Update the dominant colors for artists
                     = Depends on cacheSpotifyArtists
         """
-        self.add_function(self.cacheChartmetricIds, 'Cache Chartmetric Ids', error_on_failure=False)
-        self.add_function(self.updateGenres, 'Update Genres')
-        self.add_function(self.filterSignedFromSpotifyCopyrights, 'Filter Signed from Spotify Copyrights')
-        self.add_function(self.updateSongsDominantColors, 'Update Songs Dominant Colors', error_on_failure=False)
-        self.add_function(self.updateArtistsDominantColors, 'Update Artists Dominant Colors', error_on_failure=False)
+        self.add_function(self.cacheChartmetricIds, 'Cache Chartmetric Ids', error_on_failure=False, depends_on=['Refresh Artist Tracks', 'Cache Spotify Songs'])
+        self.add_function(self.updateGenres, 'Update Genres', depends_on=['Refresh Artist Tracks', 'Cache Spotify Songs'])
+        self.add_function(self.filterSignedFromSpotifyCopyrights, 'Filter Signed from Spotify Copyrights', depends_on=['Refresh Artist Tracks', 'Cache Spotify Albums'])
+        self.add_function(self.updateSongsDominantColors, 'Update Songs Dominant Colors', error_on_failure=False, depends_on=['Cache Spotify Songs'])
+        self.add_function(self.updateArtistsDominantColors, 'Update Artists Dominant Colors', error_on_failure=False, depends_on=['Refresh Artist Tracks', 'Cache Spotify Songs'])
 
         """
             Stage 6:
@@ -6227,15 +5971,15 @@ class NielsenDailyUSPipeline(PipelineBase):
                 - recordGenreCharts | Record where everyone sits in their genres ranks
                     = Depends on updateGenres, refreshStats
         """
-        self.add_function(self.refreshReportsRecent, 'Refresh Reports Recent')
-        self.add_function(self.refreshCharts, 'Record Genre Charts')
+        self.add_function(self.refreshReportsRecent, 'Refresh Reports Recent', depends_on=['Filter Signed from Spotify Copyrights'])
+        self.add_function(self.refreshCharts, 'Record Genre Charts', depends_on=['Update Genres', 'Refresh Stats'])
 
         """
             Stage 7:
                 - refreshDailyReport | Daily song report for aaron
                     = Depends on refreshStats, cacheSpotifySongs, refreshReportsRecent
         """
-        self.add_function(self.refreshDailyReport, 'Refresh Daily Report')
+        self.add_function(self.refreshDailyReport, 'Refresh Daily Report', depends_on=['Refresh Stats', 'Cache Spotify Songs', 'Refresh Reports Recent'])
 
         """
             Stage 8:
@@ -6244,7 +5988,7 @@ class NielsenDailyUSPipeline(PipelineBase):
                 - refreshNotifications | Refresh notifications to send out
                     = Depends on pretty much everything
         """
-        self.add_function(self.refreshSimpleViews, 'Refresh Simple Views')
+        self.add_function(self.refreshSimpleViews, 'Refresh Simple Views', depends_on=['Refresh Daily Report', 'Record Genre Charts', 'Cache Chartmetric Ids', 'Update Songs Dominant Colors', 'Update Artists Dominant Colors'])
         self.add_function(self.refreshNotifications, 'Refresh Notifications')
 
         # Commit
@@ -6262,31 +6006,39 @@ class NielsenDailyUSPipeline(PipelineBase):
                     = Depends on refreshSimpleViews
                 - archiveNielsenFiles | Upload nielsen zip file to s3 bucket (does not delete the local copy)
         """
-        self.add_function(self.updateSpotifyCharts, 'Update Spotify Charts', error_on_failure=False)
-        self.add_function(self.archiveNielsenFiles, 'Archive Nielsen Files', error_on_failure=False)
-        self.add_function(self.updateArtistSocialCharts, 'Update Artist Social Charts', error_on_failure=False)
+        self.add_function(self.updateSpotifyCharts, 'Update Spotify Charts', error_on_failure=False, depends_on=['Commit'])
+        self.add_function(self.archiveNielsenFiles, 'Archive Nielsen Files', error_on_failure=False, depends_on=['Commit'])
+        self.add_function(self.updateArtistSocialCharts, 'Update Artist Social Charts', error_on_failure=False, depends_on=['Commit'])
 
         """
             Reporting
 
             This section now just has to do with creating and sending out reports according to our schedule.
-        """
-
-        self.add_function(self.report_genius, 'Genius Scrape', error_on_failure=False)
-        self.add_function(self.report_spotifyArtistStatGrowth, 'Spotify Artist Stat Growth', error_on_failure=False)
-        self.add_function(self.report_dailySongs, 'Daily Songs', error_on_failure=False)
-        self.add_function(self.report_shazam, 'Shazam', error_on_failure=False)
-        self.add_function(self.report_artist8WeekGrowth, 'Artist 8 Week Growth', error_on_failure=False)
-        self.add_function(self.report_song8WeekGrowth, 'Song 8 Week Growth', error_on_failure=False)
-        self.add_function(self.report_genres, 'Growing Genres Report', error_on_failure=False)
-        self.add_function(self.report_nielsenWeeklyAudio, 'Nielsen Weekly Audio', error_on_failure=False)
-        self.add_function(self.report_indieLongTermGrowth, 'Report Indie Long Term Growth', error_on_failure=False)
-        self.add_function(self.report_yallternativeLongTermGrowth, 'Report Yallternative Long Term Growth', error_on_failure=False)
-        self.add_function(self.report_artistSocialGrowth, 'Report Artist Social Growth', error_on_failure=False)
-        self.add_function(self.report_spotifyLongTermFollowerGrowth, 'Report Spotify Long Term Growth', error_on_failure=False)
-        self.add_function(self.report_shazamViralGrowth, 'Report Shazam Viral Growth', error_on_failure=False)
-        self.add_function(self.report_chartmetricRankGrowth, 'Report Chartmetric Rank Growth', error_on_failure=False)
-        self.add_function(self.emailReports, 'Email Reports', error_on_failure=False)
+            The reports don't depend on each other so they can all be generated at the same time, but we can only
+            email them out once every one of them has finished.
+        """
+
+        self.add_function(self.report_genius, 'Genius Scrape', error_on_failure=False, depends_on=['Commit'])
+        self.add_function(self.report_spotifyArtistStatGrowth, 'Spotify Artist Stat Growth', error_on_failure=False, depends_on=['Commit'])
+        self.add_function(self.report_dailySongs, 'Daily Songs', error_on_failure=False, depends_on=['Commit'])
+        self.add_function(self.report_shazam, 'Shazam', error_on_failure=False, depends_on=['Commit'])
+        self.add_function(self.report_artist8WeekGrowth, 'Artist 8 Week Growth', error_on_failure=False, depends_on=['Commit'])
+        self.add_function(self.report_song8WeekGrowth, 'Song 8 Week Growth', error_on_failure=False, depends_on=['Commit'])
+        self.add_function(self.report_genres, 'Growing Genres Report', error_on_failure=False, depends_on=['Commit'])
+        self.add_function(self.report_nielsenWeeklyAudio, 'Nielsen Weekly Audio', error_on_failure=False, depends_on=['Commit'])
+        self.add_function(self.report_indieLongTermGrowth, 'Report Indie Long Term Growth', error_on_failure=False, depends_on=['Commit'])
+        self.add_function(self.report_yallternativeLongTermGrowth, 'Report Yallternative Long Term Growth', error_on_failure=False, depends_on=['Commit'])
+        self.add_function(self.report_artistSocialGrowth, 'Report Artist Social Growth', error_on_failure=False, depends_on=['Update Artist Social Charts'])
+        self.add_function(self.report_spotifyLongTermFollowerGrowth, 'Report Spotify Long Term Growth', error_on_failure=False, depends_on=['Commit'])
+        self.add_function(self.report_shazamViralGrowth, 'Report Shazam Viral Growth', error_on_failure=False, depends_on=['Commit'])
+        self.add_function(self.report_chartmetricRankGrowth, 'Report Chartmetric Rank Growth', error_on_failure=False, depends_on=['Commit'])
+
+        self.add_function(self.emailReports, 'Email Reports', error_on_failure=False, depends_on=[
+            'Genius Scrape', 'Spotify Artist Stat Growth', 'Daily Songs', 'Shazam', 'Artist 8 Week Growth',
+            'Song 8 Week Growth', 'Growing Genres Report', 'Nielsen Weekly Audio', 'Report Indie Long Term Growth',
+            'Report Yallternative Long Term Growth', 'Report Artist Social Growth', 'Report Spotify Long Term Growth',
+            'Report Shazam Viral Growth', 'Report Chartmetric Rank Growth'
+        ])
 
     def test_build(self):
 
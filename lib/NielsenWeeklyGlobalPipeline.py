@@ -1,5 +1,5 @@
 from .PipelineBase import PipelineBase
-from .Sftp import Sftp
+from .Sftp import Sftp, get_many, list_many, remove_local
 from datetime import datetime, timedelta
 import pandas as pd
 import os
@@ -29,8 +29,6 @@ class NielsenWeeklyGlobalPipeline(PipelineBase):
 
     def __init__(self, db_name):
         PipelineBase.__init__(self, db_name)
-        self.sftp_conn_name = None
-        self.sftp_conn = None
     
     def getNewWeeklyFiles(self):
 
@@ -68,10 +66,12 @@ class NielsenWeeklyGlobalPipeline(PipelineBase):
         artist_filenames = []
         song_filenames = []
 
+        # List all the servers at once
+        server_filenames = list_many(GLOBAL_SERVER_NAMES)
+
         for server_name in GLOBAL_SERVER_NAMES:
 
-            sftp = Sftp(server_name)
-            filenames = sftp.list()
+            filenames = server_filenames[server_name]
             artist_filenames = [ *artist_filenames, *[ parse_filename(i, ARTISTS_STR_INDICATOR, server_name) for i in filenames if ARTISTS_STR_INDICATOR in i and '__NO_DATA' not in i and '.tsv' in i ] ]
             song_filenames = [ *song_filenames, *[ parse_filename(i, SONGS_STR_INDICATOR, server_name) for i in filenames if SONGS_STR_INDICATOR in i and '__NO_DATA' not in i and '.tsv' in i ] ]
 
@@ -444,16 +444,11 @@ class NielsenWeeklyGlobalPipeline(PipelineBase):
 
     def initFileProcess(self, file):
 
-        # Make sure that we are set to the right connection
-        if self.sftp_conn is None or self.sftp_conn_name is None or file['server_name'] != self.sftp_conn_name:
-            sftp = Sftp(file['server_name'])
-            self.sftp_conn = sftp.connect()
-            self.sftp_conn_name = file['server_name']
-
-        # Download files from the server if they don't exist already
+        # Download files from the server if they don't exist already (downloadFiles should have gotten them)
         fullfile = file['filename']
         if os.path.exists(fullfile) is False:
-            self.sftp_conn.get(fullfile, fullfile)
+            sftp = Sftp(file['server_name'])
+            sftp.get(fullfile, fullfile)
 
         # Read, clean and update
         df = pd.read_csv(fullfile, delimiter='\t', encoding='UTF-16')
@@ -462,12 +457,19 @@ class NielsenWeeklyGlobalPipeline(PipelineBase):
     
     def finishFileProcess(self, file):
 
-        fullfile = file['filename']
-        if os.path.exists(fullfile):
-            os.remove(fullfile)
+        remove_local(file['filename'])
 
         self.commit()
 
+    def downloadFiles(self, files):
+
+        """
+            Download all the files we're going to process from every server at once. Anything
+            that fails here is downloaded again when its file is processed.
+        """
+
+        get_many([(file['server_name'], file['filename'], file['filename']) for file in files])
+
     def addProcessFunc(self, file):
         
         processFunc = None
@@ -714,6 +716,9 @@ class NielsenWeeklyGlobalPipeline(PipelineBase):
 
         files = files.sort_values(by='server_name').reset_index(drop=True).to_dict('records')
 
+        if len(files) > 0:
+            self.add_function(lambda: self.downloadFiles(files), 'Download Files', skip_on_resume=False)
+
         for file in files:
             self.addProcessFunc(file)
 
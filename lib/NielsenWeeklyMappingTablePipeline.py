@@ -1,6 +1,6 @@
 from .env import MAPPING_TABLE_FOLDER
 from .PipelineBase import PipelineBase
-from .Sftp import Sftp
+from .Sftp import get_many, remove_local
 from datetime import datetime
 import pandas as pd
 import os
@@ -239,28 +239,24 @@ class NielsenWeeklyMappingTablePipeline(PipelineBase):
 
     def downloadFiles(self):
 
-        sftp = Sftp('mapping_table')
-        with sftp.connect() as conn:
+        # The end of this script removes all of these files so until then, they're in a "cached" state, which
+        # will be helpful if we have to debug an error, but we don't want to have to redownload everything every time
+        # we retry the script. Sftp.get skips files that are already complete and resumes ones that were interrupted.
+        print(f'Downloading {TOTAL_FILES_COUNT} files')
+        results = get_many([
+            ('mapping_table', remote_fullfile, local_fullfile)
+            for local_fullfile, remote_fullfile in zip(FILES_DICT['LOCAL_FILES'], FILES_DICT['REMOTE_FILES'])
+        ])
 
-            # Download each file
-            for idx, (local_fullfile, remote_fullfile) in enumerate(zip(FILES_DICT['LOCAL_FILES'], FILES_DICT['REMOTE_FILES'])):
-
-                # We're only going to download it if it doesn't already exist, the end of this script
-                # removes all of these files so until then, they're in a "cached" state, which will be helpful
-                # if we have to debug an error, but we don't want to have to redownload everything every time
-                # we retry the script.
-                if os.path.exists(local_fullfile):
-                    print(f'Local file {local_fullfile} already exists...skipping...')
-                    continue
-
-                print(f'Downloading {idx + 1}/{TOTAL_FILES_COUNT}')
-                conn.get(remote_fullfile, local_fullfile)
+        failed = [r['remote_fullfile'] for r in results if r['success'] == False]
+        if len(failed) > 0:
+            raise Exception(f'Failed to download {failed}')
 
     def deleteFiles(self):
 
-        # Delete the raw files
+        # Delete the raw files (and their download manifests)
         for fullfile in FILES_DICT['LOCAL_FILES']:
-            os.remove(fullfile)
+            remove_local(fullfile)
 
         # Delete the cleaned files
         for fullfile in FILES_DICT['LOCAL_CLEANED_FILES']:
@@ -285,11 +281,18 @@ class NielsenWeeklyMappingTablePipeline(PipelineBase):
     def archiveFiles(self):
 
         date = self.settings['date'].strftime('%Y-%m-%d')
-        for idx, local_fullfile in enumerate(LOCAL_CLEANED_FILES):
 
-            print(f'Archiving file {idx + 1}/{len(LOCAL_CLEANED_FILES)}')
-            s3_fullfile = GLOBAL_S3_UPLOAD_FOLDER_TEMPLATE.format(date, os.path.basename(local_fullfile))
-            self.aws.upload_s3(local_fullfile, s3_fullfile)
+        # These are big, so upload them all at once
+        print(f'Archiving {len(LOCAL_CLEANED_FILES)} files')
+        files = [
+            (local_fullfile, GLOBAL_S3_UPLOAD_FOLDER_TEMPLATE.format(date, os.path.basename(local_fullfile)))
+            for local_fullfile in LOCAL_CLEANED_FILES
+        ]
+        results = self.aws.upload_many(files)
+
+        failed = [r['s3_fullfile'] for r in results if r['success'] == False]
+        if len(failed) > 0:
+            print(f'ERROR: Failed to archive {failed}')
 
     def processArtists(self):
 
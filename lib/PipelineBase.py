@@ -1,5 +1,7 @@
 import os
+import threading
 from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from simple_chalk import chalk
 
@@ -7,8 +9,11 @@ from .Aws import Aws
 from .Db import Db
 from .Email import Email
 from .env import (LOCAL_ARCHIVE_FOLDER, LOCAL_DOWNLOAD_FOLDER,
-                  MAPPING_TABLE_FOLDER, REPORTS_FOLDER, TMP_FOLDER)
+                  MAPPING_TABLE_FOLDER, METRICS_FOLDER, REPORTING_DB_MAX_CONNECTIONS,
+                  REPORTS_FOLDER, TMP_FOLDER)
+from .Metrics import Metrics
 from .settings import get_settings
+from .Sftp import close_sessions
 from .Time import Time
 
 
@@ -32,18 +37,27 @@ class PipelineBase(ABC):
         if not os.path.exists(MAPPING_TABLE_FOLDER):
             os.makedirs(MAPPING_TABLE_FOLDER)
 
+        if not os.path.exists(METRICS_FOLDER):
+            os.makedirs(METRICS_FOLDER)
+
         # This is the database we'll be updating, our postgres database
         # This is a parameter because we might be running data into our dev db or prod db
         # The self.settings['is_testing'] does NOT cause our pipelines to run on the dev db, the IMPLEMENTATION is what handles which db we use
         self.db_name = db_name
-        self.db = Db(db_name)
-        self.db.connect()
+        self._db = Db(db_name)
+        self._db.connect()
 
         # Connect to the reporting db, I've decided that it's probabaly just best
         # to make the reporting db part of the pipeline rather than have to connect to it
-        # individually so many times
-        self.reporting_db = Db('reporting_db')
-        self.reporting_db.connect()
+        # individually so many times. The reporting db only allows a handful of connections,
+        # so it's checked out the first time something uses self.reporting_db.
+        self._reporting_db = Db('reporting_db')
+
+        # When we run functions in parallel, every function checks out its own connections
+        # to both databases from the pool (a single cursor can't be shared between threads).
+        # self.db and self.reporting_db resolve to the current thread's connections if it has any.
+        self._local = threading.local()
+        self._lock = threading.Lock()
 
         # Chalk settings
         self.fnCompleteColor = chalk.cyan
@@ -58,6 +72,23 @@ class PipelineBase(ABC):
         # to generate and send out on which days
         self.day_of_week = self.settings['date'].strftime('%A')
 
+        # Maximum number of functions we can run at the same time, anything above 1 runs
+        # the pipeline as a dependency graph (see self.add_function). Every function can hold a reporting db
+        # connection, so we leave at least one in the pool for the ones that check out a second (e.g. Db.redshift_slices)
+        self.max_workers = self.settings['workers']
+        if self.max_workers >= REPORTING_DB_MAX_CONNECTIONS:
+            self.max_workers = max(1, REPORTING_DB_MAX_CONNECTIONS - 1)
+            print(f'Only running {self.max_workers} functions at a time, the reporting db allows {REPORTING_DB_MAX_CONNECTIONS} connections')
+
+        # Whether we commit after every function that completes successfully when running sequentially
+        # (never when testing, that's one rollback at the end). Parallel runs always do. Committing per function means that if the pipeline fails late,
+        # everything before it is kept and the run can be picked back up with --resume.
+        self.commit_each_function = False
+
+        # Names of the functions that already completed for this pipeline/date in a previous run,
+        # only populated when we run with --resume
+        self.completed_functions = set()
+
         # Each pipeline has a list of functions that can be run
         self.functions = []
 
@@ -78,10 +109,29 @@ class PipelineBase(ABC):
         """
         self.report = []
 
+        # Wall time, cpu time, memory, rows read/written and http calls for every function we run,
+        # written as json lines to METRICS_FOLDER and summarized at the bottom of the report
+        self.metrics = Metrics(self.__class__.__name__, self.settings['date'])
+
         # For interacting with s3 mostly
         self.aws = Aws()
         self.aws.connect_s3()
 
+    @property
+    def db(self):
+        return getattr(self._local, 'db', None) or self._db
+
+    @property
+    def reporting_db(self):
+
+        reporting_db = getattr(self._local, 'reporting_db', None) or self._reporting_db
+
+        # Only check out a connection once a function actually uses it
+        if reporting_db.conn is None:
+            reporting_db.connect()
+
+        return reporting_db
+
     # Simple functions to print in colors our major events
     def printFnComplete(self, msg):
         print(self.fnCompleteColor(msg))
@@ -89,7 +139,7 @@ class PipelineBase(ABC):
     def printSuccess(self, msg):
         print(self.successColor(msg))
 
-    def add_function(self, func, name, error_on_failure = True):
+    def add_function(self, func, name, error_on_failure = True, depends_on = None, skip_on_resume = True):
 
         """
             Function object outline:
@@ -97,22 +147,48 @@ class PipelineBase(ABC):
             {
                 "func": <Callable function to run>,
                 "name": <Name of function>,
-                "error_on_failure": <Boolean indicating whether the whole program should exit should this function error out>
+                "error_on_failure": <Boolean indicating whether the whole program should exit should this function error out>,
+                "depends_on": <Names of the functions that have to finish before this one can start>,
+                "skip_on_resume": <Boolean indicating whether this function can be skipped with --resume if it already completed>
             }
+
+            If depends_on is None, the function depends on the function added right before it, which
+            is the same as running everything one after another. Pass a list (even an empty one) to declare
+            the real dependencies so that independent functions can run at the same time when the pipeline
+            runs with more than one worker. Dependencies must already have been added.
+
+            Functions that only prepare local state (like downloading files) should pass skip_on_resume=False
+            because that state might not be there anymore when we resume.
         """
 
+        names = [f['name'] for f in self.functions]
+
+        if name in names:
+            raise Exception(f'Function {name} has already been added to the pipeline')
+
+        if depends_on is None:
+            depends_on = names[-1:]
+
+        for dependency in depends_on:
+            if dependency not in names:
+                raise Exception(f'Function {name} depends on {dependency} which has not been added to the pipeline')
+
         self.functions.append({
             'func': func,
             'name': name,
-            'error_on_failure': error_on_failure
+            'error_on_failure': error_on_failure,
+            'depends_on': list(depends_on),
+            'skip_on_resume': skip_on_resume
         })
 
     def add_report(self, name, success, error):
-        self.report.append({
-            'name': name,
-            'success': success,
-            'error': error
-        })
+
+        with self._lock:
+            self.report.append({
+                'name': name,
+                'success': success,
+                'error': error
+            })
 
     def get_report(self):
 
@@ -135,6 +211,10 @@ class PipelineBase(ABC):
                 report += r['error']
                 report += '\n'
 
+        metrics = self.metrics.summary()
+        if len(metrics) > 0:
+            report += '\n' + metrics
+
         return report
 
     # Entry point
@@ -149,35 +229,23 @@ class PipelineBase(ABC):
         self.build() if self.settings['is_testing'] == False else self.test_build()
 
         pipelineTime = Time()
-        number_of_functions = len(self.functions)
         
         try:
 
-            for idx, function in enumerate(self.functions):
-
-                name = function['name']
-                func = function['func']
-                error_on_failure = function['error_on_failure']
+            self.init_checkpoints()
 
-                print(f'{idx}/{number_of_functions - 1} | Running function: {name}')
-                fnTime = Time()
-                
-                try:
+            # Parallel functions each commit on their own connection, when testing that would roll back
+            # every function's work before the ones that depend on it run, so tests run on one connection
+            if self.max_workers > 1 and self.settings['is_testing'] == True:
+                print('Running sequentially, --workers is ignored when testing')
+                self.run_sequential()
 
-                    func()
-                    self.add_report(name, True, '')
-
-                except Exception as e:
-                    print(str(e))
-                    self.add_report(name, False, str(e))
-                    if error_on_failure:
-                        raise e
-
-                self.printFnComplete(name + ': ' + fnTime.getElapsed())
+            elif self.max_workers > 1:
+                self.run_parallel()
+            else:
+                self.run_sequential()
 
             self.commit()
-            self.db.disconnect()
-            self.reporting_db.disconnect()
 
             # Print the finished time
             self.printSuccess(f'{self.__class__.__name__} success: {pipelineTime.getElapsed()}')
@@ -186,8 +254,215 @@ class PipelineBase(ABC):
 
             # Even if our pipeline exits prematurely, we still want to return the reporting to be handled
             # by our scheduler
+            self._db.disconnect()
+            self._reporting_db.disconnect()
+            close_sessions()
+            self.metrics.close()
             return self.get_report()
 
+    def run_function(self, idx, function):
+
+        """
+            Runs a single function from self.functions and reports on it.
+            Returns True if the function completed successfully.
+        """
+
+        name = function['name']
+        func = function['func']
+        error_on_failure = function['error_on_failure']
+
+        if function['skip_on_resume'] == True and name in self.completed_functions:
+            print(f'{idx}/{len(self.functions) - 1} | Skipping function: {name} (already completed)')
+            self.add_report(name, True, '')
+            return True
+
+        print(f'{idx}/{len(self.functions) - 1} | Running function: {name}')
+        fnTime = Time()
+        success = False
+        self.metrics.start(name)
+
+        try:
+
+            func()
+            self.save_checkpoint(name)
+            self.add_report(name, True, '')
+            success = True
+
+        except Exception as e:
+            print(str(e))
+            self.add_report(name, False, str(e))
+            if error_on_failure:
+                raise e
+
+        finally:
+            self.metrics.stop(success)
+
+        self.printFnComplete(name + ': ' + fnTime.getElapsed())
+
+        return success
+
+    def run_sequential(self):
+
+        """
+            Runs every function one after another, in the order they were added,
+            on the pipeline's own db connections.
+        """
+
+        for idx, function in enumerate(self.functions):
+
+            success = self.run_function(idx, function)
+
+            # When testing, self.commit rolls back, so we only do that once at the end of the run
+            # or later functions wouldn't see what the earlier ones did
+            if success == True and self.commit_each_function == True and self.settings['is_testing'] == False:
+                self.commit()
+
+    def run_parallel(self):
+
+        """
+            Runs the functions as a dependency graph. A function starts as soon as everything it
+            depends on has finished, and up to self.max_workers functions run at the same time.
+
+            Every function gets its own pooled db connections, so each function's changes are committed
+            as soon as it finishes, that way the functions that depend on it can see them (which is why
+            we never run in parallel when testing). If a function with error_on_failure fails we stop starting new functions,
+            wait for the ones that are already running, and then raise the error.
+        """
+
+        indicies = { function['name']: idx for idx, function in enumerate(self.functions) }
+        pending = list(self.functions)
+        finished = set()
+        running = {}
+        error = None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+
+            while len(pending) > 0 or len(running) > 0:
+
+                # Start everything that has all of its dependencies finished
+                if error is None:
+
+                    ready = [f for f in pending if all(d in finished for d in f['depends_on'])]
+                    for function in ready:
+                        pending.remove(function)
+                        future = executor.submit(self.run_worker_function, indicies[function['name']], function)
+                        running[future] = function
+
+                if len(running) == 0:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+
+                    function = running.pop(future)
+
+                    try:
+                        future.result()
+                    except Exception as e:
+                        if error is None:
+                            error = e
+
+                    finished.add(function['name'])
+
+        if error is not None:
+            raise error
+
+    def run_worker_function(self, idx, function):
+
+        """
+            Runs a function on a worker thread with connections to our db and the reporting db
+            checked out from the pool for just this function, they go back to the pool as soon
+            as it's done so idle workers don't hold on to them. The reporting db connection is
+            only checked out if the function uses self.reporting_db.
+        """
+
+        db = Db(self.db_name)
+        reporting_db = Db('reporting_db')
+
+        success = False
+        try:
+
+            db.connect()
+
+            self._local.db = db
+            self._local.reporting_db = reporting_db
+
+            success = self.run_function(idx, function)
+
+        finally:
+
+            if db.conn is not None:
+                self.commit() if success == True else db.rollback()
+
+            self._local.db = None
+            self._local.reporting_db = None
+
+            db.disconnect()
+            reporting_db.disconnect()
+
+    def init_checkpoints(self):
+
+        """
+            Makes sure our checkpoint journal exists, and if we're resuming, loads the
+            functions that already completed for this pipeline and run date.
+
+            The journal is written on the same connection (and in the same transaction) as the
+            function's own changes, so a function only counts as completed once its work is committed.
+        """
+
+        if self.settings['is_testing'] == True:
+            return
+
+        string = """
+            create table if not exists misc.pipeline_checkpoints (
+                pipeline text not null,
+                run_date date not null,
+                name text not null,
+                completed_at timestamp not null default current_timestamp,
+                primary key (pipeline, run_date, name)
+            )
+        """
+        self.db.execute(string)
+        self.db.commit()
+
+        if self.settings['resume'] == False:
+            return
+
+        string = """
+            select name
+            from misc.pipeline_checkpoints
+            where pipeline = %(pipeline)s
+            and run_date = %(run_date)s
+        """
+        df = self.db.execute(string, self.checkpoint_params())
+        self.completed_functions = set(df['name'].tolist())
+
+        print(f'Resuming {self.__class__.__name__}, {len(self.completed_functions)} functions already completed')
+
+    def save_checkpoint(self, name):
+
+        """
+            Record that a function completed successfully for this pipeline and run date.
+        """
+
+        if self.settings['is_testing'] == True:
+            return
+
+        string = """
+            insert into misc.pipeline_checkpoints (pipeline, run_date, name)
+            values (%(pipeline)s, %(run_date)s, %(name)s)
+            on conflict (pipeline, run_date, name) do update
+            set completed_at = current_timestamp
+        """
+        self.db.execute(string, { **self.checkpoint_params(), 'name': name })
+
+    def checkpoint_params(self):
+
+        return {
+            'pipeline': self.__class__.__name__,
+            'run_date': self.settings['date'].strftime('%Y-%m-%d')
+        }
+
     def commit(self):
         
         """
@@ -1,4 +1,5 @@
 from .env import RAPID_API_KEY
+from .Metrics import count_http_call
 import requests
 
 
@@ -15,6 +16,7 @@ class RapidApi:
                 'X-RapidAPI-Host': 'dad-jokes.p.rapidapi.com'
             }
 
+            count_http_call()
             response = requests.request('GET', url, headers=headers)
             response = response.json()
 
@@ -31,6 +33,7 @@ class RapidApi:
         try:
 
             url = 'https://zenquotes.io/api/quotes'
+            count_http_call()
             res = requests.get(url)
             res = res.json()
             return res[0]['q']
@@ -0,0 +1,155 @@
+import asyncio
+import random
+import threading
+from time import monotonic, sleep
+
+from .Metrics import count_rate_limited, count_throttle_time
+
+BACKOFF_BASE = 0.5 # seconds, doubled on every retry
+BACKOFF_MAX = 30 # seconds
+RETRY_AFTER_DEFAULT = 1 # seconds to wait on a 429 when the api doesn't tell us
+
+
+def parse_retry_after(headers):
+
+    """
+        Seconds to wait from a response's Retry-After header (None if it doesn't have one).
+    """
+
+    if headers is None:
+        return None
+
+    value = headers.get('Retry-After') or headers.get('retry-after')
+
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+
+    """
+        Client side token bucket shared by everything calling the same api (threads and coroutines).
+
+        Each request takes a token first, tokens refill at `rate` per second up to `burst`.
+        When the api answers 429 every caller is held back until its Retry-After has passed,
+        other failures back off exponentially with full jitter.
+
+        Use acquire() before a blocking request or `await acquire_async()` before an async one.
+
+        Keeps counters so we can tune the rate against the api's limits:
+            requests: requests let through
+            rate_limited: 429s we got back
+            retries: failed requests we backed off from (429s included)
+            sleep_time: total seconds callers spent waiting
+    """
+
+    def __init__(self, rate, burst=None):
+
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+
+        self.tokens = self.burst
+        self.updated = monotonic()
+        self.blocked_until = 0 # set from Retry-After, nobody goes before this
+        self.lock = threading.Lock()
+
+        self.stats = {
+            'requests': 0,
+            'rate_limited': 0,
+            'retries': 0,
+            'sleep_time': 0
+        }
+
+    def reserve(self):
+
+        """
+            Takes a token and returns how many seconds the caller has to wait before sending its request.
+        """
+
+        with self.lock:
+
+            now = monotonic()
+
+            # Refill for the time that passed since the last request
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            # Tokens go negative when callers are queued up, each one waits for its own
+            self.tokens -= 1
+            wait = max(-self.tokens / self.rate, self.blocked_until - now, 0)
+
+            self.stats['requests'] += 1
+
+            return wait
+
+    def acquire(self):
+        self.wait(self.reserve())
+
+    async def acquire_async(self):
+        await self.wait_async(self.reserve())
+
+    def rate_limited(self, retry_after=None):
+
+        """
+            The api told us to slow down, hold everybody back for retry_after seconds.
+            The caller waits it out in its next acquire like everyone else.
+        """
+
+        if retry_after is None:
+            retry_after = RETRY_AFTER_DEFAULT
+
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, monotonic() + retry_after)
+            self.stats['rate_limited'] += 1
+            self.stats['retries'] += 1
+
+        count_rate_limited()
+
+    def backoff(self, attempt):
+
+        """
+            Exponential backoff with full jitter for the attempt'th retry (starting at 0).
+            Returns how long the caller should wait before retrying.
+        """
+
+        with self.lock:
+            self.stats['retries'] += 1
+
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def wait(self, seconds):
+
+        if seconds <= 0:
+            return
+
+        self.add_sleep_time(seconds)
+        sleep(seconds)
+
+    async def wait_async(self, seconds):
+
+        if seconds <= 0:
+            return
+
+        self.add_sleep_time(seconds)
+        await asyncio.sleep(seconds)
+
+    def add_sleep_time(self, seconds):
+
+        with self.lock:
+            self.stats['sleep_time'] += seconds
+
+        count_throttle_time(seconds)
+
+    def summary(self):
+
+        with self.lock:
+            stats = dict(self.stats)
+
+        return '{} requests | {} rate limited | {} retries | {}s sleeping'.format(
+            stats['requests'],
+            stats['rate_limited'],
+            stats['retries'],
+            round(stats['sleep_time'], 2)
+        )
@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
 
+from .Db import close_pools
 from .Email import Email
 from .PipelineBase import PipelineBase
 from .settings import get_settings
@@ -60,6 +61,9 @@ class SchedulerBase(ABC):
             report = pipe.run()
             self.set_report(pipe.__class__.__name__, report)
 
+        # Pipelines hand their connections back to the pool, we're done with them now
+        close_pools()
+
         self.email_report()
 
     @abstractmethod
@@ -1,5 +1,6 @@
 from .env import X_SERVICE_TOKEN
 from .functions import request_wrapper, chunker
+from .Metrics import count_http_call
 import requests
 import json
 
@@ -43,6 +44,7 @@ class ServiceApi:
         """
 
         # Make the POST request
+        count_http_call()
         response = requests.post(url, headers=self.headers(), data=json.dumps(data))
         return response.json()
 
@@ -1,3 +1,10 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import perf_counter
+
 import pysftp
 
 from .env import (RCA_NIELSEN_EMERGING_DAILY_SFTP_PASSWORD,
@@ -103,6 +110,17 @@ CONNECTIONS = {
 CONNECTION_OPTIONS = pysftp.CnOpts(knownhosts=None)
 CONNECTION_OPTIONS.hostkeys = None  # type: ignore
 
+# Most sessions we keep open to a single server at once, this is also how many
+# files get_many downloads from one server at the same time
+SFTP_SESSIONS_PER_SERVER = 3
+SFTP_SESSION_TIMEOUT = 600 # seconds to wait for a free session before giving up
+
+# Sftp.get writes to local_fullfile + SFTP_PARTIAL_SUFFIX and keeps what it knows about the
+# remote file in local_fullfile + SFTP_MANIFEST_SUFFIX
+SFTP_PARTIAL_SUFFIX = '.part'
+SFTP_MANIFEST_SUFFIX = '.sftp.json'
+SFTP_READ_CHUNKSIZE = 1024 * 1024
+
 class Sftp:
 
     def __init__(self, connection_name):
@@ -144,9 +162,29 @@ class Sftp:
 
         raise Exception(f'Error: Too many retries while connecting to {self.connection_name}')
 
+    @contextmanager
+    def session(self):
+
+        """
+            Borrow an authenticated session to this server from the process wide pool
+            (see SessionPool), it's handed back when the with block exits.
+        """
+
+        pool = get_session_pool(self.connection_name)
+        conn = pool.checkout()
+
+        try:
+            yield conn
+        except Exception:
+            # We don't know what state the session is in, so don't give it to anyone else
+            pool.discard(conn)
+            raise
+        else:
+            pool.checkin(conn)
+
     def list(self, path='.'):
 
-        with self.connect() as sftp:
+        with self.session() as sftp:
             return sftp.listdir(path)
 
     def get(self, remote_fullfile, local_fullfile):
@@ -155,18 +193,291 @@ class Sftp:
             Get file from the server
             
             self.get(remote_fullfile, local_fullfile)
+
+            Downloads are verified and resumable. Next to the local file we keep a small manifest
+            (local_fullfile + SFTP_MANIFEST_SUFFIX) with the remote size & mtime:
+
+            - If the local file is already complete for the same remote size & mtime, we skip it
+            - Data goes to local_fullfile + SFTP_PARTIAL_SUFFIX first, if a download is interrupted
+              the next get picks up from where that file ends (as long as the remote file hasn't changed)
+            - Once every byte is there the partial file is renamed to local_fullfile
+
+            Returns True if we downloaded anything, False if the local file was already complete.
         """
 
-        with self.connect() as sftp:
-            print(f'Copying... Remote: {remote_fullfile} to Local: {local_fullfile}')
-            sftp.get(remote_fullfile, local_fullfile)
-            print('Copied successfully...')
+        partial_fullfile = local_fullfile + SFTP_PARTIAL_SUFFIX
+        manifest_fullfile = local_fullfile + SFTP_MANIFEST_SUFFIX
+
+        with self.session() as sftp:
+
+            stat = sftp.stat(remote_fullfile)
+            remote = { 'remote_fullfile': remote_fullfile, 'size': stat.st_size, 'mtime': stat.st_mtime }
+
+            manifest = read_manifest(manifest_fullfile)
+            same_remote = manifest is not None and all(manifest.get(k) == v for k, v in remote.items())
+
+            if os.path.exists(local_fullfile):
+
+                # Files we downloaded before we kept manifests only have their size to go on
+                complete = (same_remote and manifest.get('complete') == True) if manifest is not None else True
+                if complete and os.path.getsize(local_fullfile) == stat.st_size:
+                    print(f'Local file {local_fullfile} is up to date...skipping...')
+                    write_manifest(manifest_fullfile, { **remote, 'complete': True })
+                    return False
+
+            # Resume the partial file if it's for the same remote file, otherwise start over
+            offset = 0
+            if same_remote and os.path.exists(partial_fullfile) and os.path.getsize(partial_fullfile) <= stat.st_size:
+                offset = os.path.getsize(partial_fullfile)
+            elif os.path.exists(partial_fullfile):
+                os.remove(partial_fullfile)
+
+            write_manifest(manifest_fullfile, { **remote, 'complete': False })
+
+            if offset > 0:
+                print(f'Resuming... Remote: {remote_fullfile} to Local: {local_fullfile} from {offset}/{stat.st_size} bytes')
+            else:
+                print(f'Copying... Remote: {remote_fullfile} to Local: {local_fullfile}')
+
+            with sftp.open(remote_fullfile, 'rb') as remote_file, open(partial_fullfile, 'ab') as local_file:
+
+                remote_file.seek(offset)
+                remote_file.prefetch(stat.st_size)
+
+                while True:
+                    chunk = remote_file.read(SFTP_READ_CHUNKSIZE)
+                    if not chunk:
+                        break
+                    local_file.write(chunk)
+
+            size = os.path.getsize(partial_fullfile)
+            if size != stat.st_size:
+                raise Exception(f'Incomplete download of {remote_fullfile}: {size}/{stat.st_size} bytes')
 
-            sftp.close()
+            # Move the finished file into place in one step, so the local file is never half written
+            os.replace(partial_fullfile, local_fullfile)
+            os.utime(local_fullfile, (stat.st_atime, stat.st_mtime))
+            write_manifest(manifest_fullfile, { **remote, 'complete': True })
+
+            print('Copied successfully...')
+            return True
 
     def delete(self, remote_fullfile):
 
-        with self.connect() as sftp:
+        with self.session() as sftp:
             sftp.remove(remote_fullfile)
             print(f'Deleted {remote_fullfile} successfully')
-            
+
+
+def read_manifest(manifest_fullfile):
+
+    if os.path.exists(manifest_fullfile) == False:
+        return None
+
+    try:
+        with open(manifest_fullfile) as file:
+            return json.load(file)
+    except ValueError:
+        return None
+
+def write_manifest(manifest_fullfile, manifest):
+
+    with open(manifest_fullfile, 'w') as file:
+        json.dump(manifest, file)
+
+def remove_local(local_fullfile):
+
+    """
+        Delete a file Sftp.get downloaded along with its manifest & any partial download.
+    """
+
+    for fullfile in [local_fullfile, local_fullfile + SFTP_PARTIAL_SUFFIX, local_fullfile + SFTP_MANIFEST_SUFFIX]:
+        if os.path.exists(fullfile):
+            os.remove(fullfile)
+
+
+class SessionPool:
+
+    """
+        Keeps authenticated sessions to one sftp server open for the rest of the run, so we only
+        pay for the ssh handshake once instead of on every list/get/delete. At most max_sessions are
+        open at once, checkouts past that wait for one to be returned.
+    """
+
+    def __init__(self, connection_name, max_sessions):
+
+        self.connection_name = connection_name
+        self.max_sessions = max_sessions
+        self.idle = []
+        self.open = 0
+        self.condition = threading.Condition()
+
+    def checkout(self):
+
+        deadline = perf_counter() + SFTP_SESSION_TIMEOUT
+
+        while True:
+
+            conn = None
+
+            with self.condition:
+
+                if len(self.idle) > 0:
+                    conn = self.idle.pop()
+
+                elif self.open < self.max_sessions:
+                    self.open += 1
+
+                else:
+
+                    remaining = deadline - perf_counter()
+                    if remaining <= 0:
+                        raise Exception(f'Timed out waiting for an sftp session to {self.connection_name}')
+
+                    self.condition.wait(remaining)
+                    continue
+
+            # We reserved a spot for a new session
+            if conn is None:
+
+                try:
+                    return Sftp(self.connection_name).connect()
+                except Exception:
+                    self.release()
+                    raise
+
+            if self.alive(conn):
+                return conn
+
+            self.discard(conn)
+
+    def checkin(self, conn):
+
+        with self.condition:
+            self.idle.append(conn)
+            self.condition.notify()
+
+    def alive(self, conn):
+
+        try:
+            return conn.sftp_client.get_channel().get_transport().is_active()
+        except Exception:
+            return False
+
+    def discard(self, conn):
+
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+        self.release()
+
+    def release(self):
+
+        with self.condition:
+            self.open -= 1
+            self.condition.notify()
+
+    def close(self):
+
+        with self.condition:
+            idle = self.idle
+            self.idle = []
+
+        for conn in idle:
+            self.discard(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_session_pool(connection_name):
+
+    with _pools_lock:
+
+        if connection_name not in _pools:
+            _pools[connection_name] = SessionPool(connection_name, SFTP_SESSIONS_PER_SERVER)
+
+        return _pools[connection_name]
+
+def close_sessions():
+
+    """
+        Close every idle sftp session, call this when the run is done with the servers.
+    """
+
+    with _pools_lock:
+        pools = list(_pools.values())
+
+    for pool in pools:
+        pool.close()
+
+def list_many(connection_names, path='.'):
+
+    """
+        List the same path on many servers at once.
+
+        @returns { connection_name: [filenames] }
+    """
+
+    with ThreadPoolExecutor(max_workers=max(1, len(connection_names))) as executor:
+        filenames = executor.map(lambda name: Sftp(name).list(path), connection_names)
+        return dict(zip(connection_names, filenames))
+
+def get_many(files, max_per_server=SFTP_SESSIONS_PER_SERVER):
+
+    """
+        Download files from any number of servers at once, with at most max_per_server
+        downloads running against a single server at the same time.
+
+        @param files | list of (connection_name, remote_fullfile, local_fullfile)
+        @returns list of { 'connection_name', 'remote_fullfile', 'local_fullfile', 'success' }, in the same order as files
+    """
+
+    max_per_server = min(max_per_server, SFTP_SESSIONS_PER_SERVER)
+
+    servers = {}
+    for connection_name, _, _ in files:
+        servers[connection_name] = servers.get(connection_name, 0) + 1
+
+    limits = { name: threading.Semaphore(max_per_server) for name in servers }
+    workers = max(1, sum(min(count, max_per_server) for count in servers.values()))
+
+    def get(file):
+
+        connection_name, remote_fullfile, local_fullfile = file
+        result = {
+            'connection_name': connection_name,
+            'remote_fullfile': remote_fullfile,
+            'local_fullfile': local_fullfile,
+            'success': False
+        }
+
+        with limits[connection_name]:
+
+            try:
+                Sftp(connection_name).get(remote_fullfile, local_fullfile)
+                result['success'] = True
+            except Exception as e:
+                print(f'Error downloading {remote_fullfile} from {connection_name}: {str(e)}')
+
+        return result
+
+    # Start the files round robin between servers, so the workers aren't all stuck waiting on one server
+    queues = {}
+    for idx, file in enumerate(files):
+        queues.setdefault(file[0], []).append(idx)
+
+    order = []
+    while len(order) < len(files):
+        for queue in queues.values():
+            if len(queue) > 0:
+                order.append(queue.pop(0))
+
+    results = [None] * len(files)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for idx, result in zip(order, executor.map(get, [files[i] for i in order])):
+            results[idx] = result
+
+    return results
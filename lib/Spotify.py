@@ -1,33 +1,77 @@
 from spotipy import util
+from spotipy.cache_handler import CacheFileHandler
+from spotipy.exceptions import SpotifyException
+from .env import SPOTIFY_BURST, SPOTIFY_CACHE_FILE, SPOTIFY_REQUESTS_PER_SECOND
 from .Fuzz import Fuzz
+from .Metrics import count_http_call
+from .RateLimiter import RateLimiter, parse_retry_after
+from .SpotifyCache import SpotifyCache
+from time import time
 import pandas as pd
 import requests
 import spotipy
-import random
+import threading
 
+SPOTIFY_TOKEN_LIFETIME = 3600 # seconds, if we can't read the expiry from spotipy's token cache
+SPOTIFY_TOKEN_MARGIN = 60 # seconds before the token expires that we refresh it
+
+# Every spotify client in the process goes through the same limiter since they share the same app's limits
+spotify_rate_limiter = RateLimiter(SPOTIFY_REQUESTS_PER_SECOND, SPOTIFY_BURST)
+
+# Same for the response cache, so whatever one client fetched the others can reuse
+spotify_cache = SpotifyCache(SPOTIFY_CACHE_FILE)
+
+
+def create_spotipy_client(spotify_token):
+
+    """
+        Retries are handled by request_wrapper and our rate limiter, spotipy retrying on its
+        own just multiplies the requests we send while we're rate limited. So we give it a plain
+        session without urllib3's Retry adapter, that way every error status comes back as a
+        SpotifyException with the real status and headers (Retry-After) instead of spotipy's
+        header-less "Max Retries" 429.
+    """
+
+    return spotipy.Spotify(
+        auth=spotify_token,
+        requests_timeout=10,
+        requests_session=requests.Session()
+    )
 
 def request_wrapper(func):
 
     def wrapper(self, *args, **kwargs):
 
-        # Refresh the token
-        if random.random() < self.refresh_rate:
-            self.refresh()
+        for attempt in range(self.retries):
 
-        count = 0
-        while count < self.retries:
+            self.checkToken()
+            self.limiter.acquire()
 
             try:
 
                 # Search spotify api
+                count_http_call()
                 res = func(self, *args, **kwargs)
 
                 return res
 
+            except SpotifyException as e:
+                print(str(e))
+
+                # Too many requests, everybody waits as long as spotify asks us to
+                if e.http_status == 429:
+                    self.limiter.rate_limited(parse_retry_after(getattr(e, 'headers', None)))
+                    continue
+
+                # Our token expired early
+                if e.http_status == 401:
+                    self.refresh()
+                    continue
+
             except Exception as e:
                 print(str(e))
 
-            count += 1
+            self.limiter.wait(self.limiter.backoff(attempt))
 
         raise Exception(f'Error getting spotify data with query: ' + str(args[0]))
 
@@ -36,7 +80,7 @@ def request_wrapper(func):
 # Class for making spotify client handling easier
 class Spotify:
     
-    def __init__(self):
+    def __init__(self, limiter=None, cache=None):
         
         # Spotify Authentication
         self.client_id='13b0d9dd85864779a5af921822875398'
@@ -46,7 +90,10 @@ class Spotify:
         self.username = 'Aaron Dombey'
         self.scope = 'playlist-modify-public'
         self.retries = 5
-        self.refresh_rate = 0.1 # Every time we search for something we're gunna randomly refresh the access token at this rate
+        self.limiter = limiter or spotify_rate_limiter
+        self.cache = cache or spotify_cache
+        self.token_expires_at = 0
+        self.token_lock = threading.Lock()
 
         self.sp = self.create()
 
@@ -54,13 +101,33 @@ class Spotify:
 
         """
             Simple method to test and make sure that spotify's api is available and working.
+            Goes straight to the api, a cached search would pass without spotify ever answering.
         """
 
-        self.getArtistByName('John Mayer')
+        self.search('John Mayer', 'artist', 1)
         print('Successful connection to Spotify Api')
         
     def refresh(self):
-        self.sp = self.create()
+        with self.token_lock:
+            self.sp = self.create()
+
+    def tokenExpired(self):
+        return time() > self.token_expires_at - SPOTIFY_TOKEN_MARGIN
+
+    def checkToken(self):
+
+        """
+            Refresh the token if it's about to expire.
+        """
+
+        if self.tokenExpired() == False:
+            return
+
+        with self.token_lock:
+
+            # Someone else may have refreshed it while we were waiting
+            if self.tokenExpired():
+                self.sp = self.create()
         
     def create(self):
         
@@ -75,104 +142,79 @@ class Spotify:
 
         self.auth_token = 'Bearer ' + spotify_token
 
-        sp = spotipy.Spotify(
-            auth=spotify_token,
-            requests_timeout=10,
-            retries=10,
-            status_retries=10
-        )
-        
-        return sp
+        # prompt_for_user_token caches the token with its expiry under our username
+        token_info = CacheFileHandler(username=self.username).get_cached_token()
+        if token_info is not None and token_info.get('access_token') == spotify_token:
+            self.token_expires_at = token_info['expires_at']
+        else:
+            self.token_expires_at = time() + SPOTIFY_TOKEN_LIFETIME
+
+        return create_spotipy_client(spotify_token)
     
     def get(self, url):
-        
-        headers = { 'Authorization': self.auth_token }
-    
-        res = requests.get(url, headers=headers) # type: ignore
 
-        if res.status_code < 400:
+        for _ in range(self.retries):
+
+            self.checkToken()
+            self.limiter.acquire()
+
+            headers = { 'Authorization': self.auth_token }
+
+            count_http_call()
+            res = requests.get(url, headers=headers) # type: ignore
+
+            if res.status_code < 400:
 
-            return res.json()
+                return res.json()
+
+            if res.status_code == 429:
+                self.limiter.rate_limited(parse_retry_after(res.headers))
+                continue
+
+            return None
 
         return None
 
-    @request_wrapper
     def searchArtists(self, q, limit=25):
 
         """
             Generic search function to make requests to spotify for artists.
         """
 
-        # Search spotify api
-        res = self.sp.search(q=q, type='artist', limit=limit)
+        return self.cache.get('search', f'artist:{limit}:{q}', lambda: self.search(q, 'artist', limit))
 
-        if res is None:
-            raise Exception('Error getting spotify data from query: ' + q)
-
-        items = [i for i in res['artists']['items'] if i is not None]
-        return items
-
-    @request_wrapper
     def searchTracks(self, q, limit=25):
 
         """
             Generic search function to make requets to spotify for tracks.
         """
 
-        # Search spotify api
-        res = self.sp.search(q=q, type='track', limit=limit)
+        return self.cache.get('search', f'track:{limit}:{q}', lambda: self.search(q, 'track', limit))
 
-        if res is None:
-            raise Exception('Error getting spotify data from query: ' + q)
-
-        items = [i for i in res['tracks']['items'] if i is not None]
-        return items
-    
-    @request_wrapper
     def albums(self, album_ids, parse=False):
         """Maximum of 20 ids"""
-        
-        res = self.sp.albums(album_ids)
-
-        if res is None:
-            raise Exception('Error getting albums by spotify album ids: ' + ','.join(album_ids))
 
-        res = res['albums']
-        res = [i for i in res if i is not None]
+        res = self.cache.get_many('album', album_ids, self.fetchAlbums)
 
         if parse is True:
             return [transformAlbumData(i) for i in res]
 
         return res
 
-    @request_wrapper
     def tracks(self, track_ids, parse=False):
         """Maximum of 50 ids"""
 
-        res = self.sp.tracks(track_ids)
-
-        if res is None:
-            raise Exception('Error getting tracks by spotify track ids: ' + ','.join(track_ids))
-
-        res = res['tracks']
-        res = [i for i in res if i is not None]
+        res = self.cache.get_many('track', track_ids, self.fetchTracks)
 
         if parse is True:
             return [transformTrackData(i) for i in res]
 
         return res
 
-    @request_wrapper
     def artists(self, artist_ids, parse=False):
         """Maximum of 50 ids"""
 
-        res = self.sp.artists(artist_ids)
-
-        if res is None:
-            raise Exception('Error getting artists by spotify artist ids: ' + ','.join(artist_ids))
-
-        res = res['artists']
-        res = [i for i in res if i is not None]
+        res = self.cache.get_many('artist', artist_ids, self.fetchArtists)
 
         # If we don't want the raw data, transform it
         if parse is True:
@@ -180,33 +222,82 @@ class Spotify:
 
         return res
 
-    @request_wrapper
     def audio_features(self, track_ids):
         """Maximum of 100 ids"""
 
+        return self.cache.get_many('audio_features', track_ids, self.fetchAudioFeatures)
+
+    def artist_top_tracks(self, artist_id, parse=False):
+
+        res = self.cache.get('artist_top_tracks', artist_id, lambda: self.fetchArtistTopTracks(artist_id))
+
+        if parse is True:
+            return [transformArtistTopTrack(artist_id, i) for i in res]
+
+        return res
+
+    # The requests behind the methods above, these always go out to the api
+    @request_wrapper
+    def search(self, q, type, limit):
+
+        # Search spotify api
+        res = self.sp.search(q=q, type=type, limit=limit)
+
+        if res is None:
+            raise Exception('Error getting spotify data from query: ' + q)
+
+        items = [i for i in res[f'{type}s']['items'] if i is not None]
+        return items
+
+    @request_wrapper
+    def fetchAlbums(self, album_ids):
+
+        res = self.sp.albums(album_ids)
+
+        if res is None:
+            raise Exception('Error getting albums by spotify album ids: ' + ','.join(album_ids))
+
+        return [i for i in res['albums'] if i is not None]
+
+    @request_wrapper
+    def fetchTracks(self, track_ids):
+
+        res = self.sp.tracks(track_ids)
+
+        if res is None:
+            raise Exception('Error getting tracks by spotify track ids: ' + ','.join(track_ids))
+
+        return [i for i in res['tracks'] if i is not None]
+
+    @request_wrapper
+    def fetchArtists(self, artist_ids):
+
+        res = self.sp.artists(artist_ids)
+
+        if res is None:
+            raise Exception('Error getting artists by spotify artist ids: ' + ','.join(artist_ids))
+
+        return [i for i in res['artists'] if i is not None]
+
+    @request_wrapper
+    def fetchAudioFeatures(self, track_ids):
+
         res = self.sp.audio_features(track_ids)
 
         if res is None:
             raise Exception('Error getting audio features with spotify track ids: ' + ','.join(track_ids))
 
-        res = [i for i in res if i is not None]
-        return res
+        return [i for i in res if i is not None]
 
     @request_wrapper
-    def artist_top_tracks(self, artist_id, parse=False):
+    def fetchArtistTopTracks(self, artist_id):
 
         res = self.sp.artist_top_tracks(artist_id)
 
         if res is None:
-            raise Exception('Error getting artist top tracks with spotify artist ids: ' + ','.join(artist_id))
+            raise Exception('Error getting artist top tracks with spotify artist id: ' + artist_id)
 
-        res = res['tracks']
-        res = [i for i in res if i is not None]
-
-        if parse is True:
-            return [transformArtistTopTrack(i) for i in res]
-
-        return res
+        return [i for i in res['tracks'] if i is not None]
 
     def artist_top_track(self, artist_id, parse=False):
         """Get the top track for an artist"""
@@ -228,39 +319,17 @@ class Spotify:
             returns None if it is unable to find a good match.
         """
 
-        name = name.replace('[', '').replace(',', '').replace(']', '').replace('&', ' ').split('Feat.')[0][:100]
+        result = self.searchArtistByName(name)
 
-        if len(name) == 0:
+        if result is None:
             return None
-        
-        # Query the spotify api
-        items = self.searchArtists(name, limit=20)
-        
-        # Check for a perfect match on first item, if we find one, just return that
-        if len(items) > 0 and items[0]['name'] == name:
-            result = items[0]
-            return pd.DataFrame({ 'name': [result['name']], 'spotify_id': [result['id']] })
-        
-        # Get the names from the results to prepare for fuzzy matching
-        artist_names = [i['name'] for i in items]
-        
-        # Fuzzy match
-        fuzz = Fuzz(artist_names)
-        ratio, match, _ = fuzz.check(name)
-        
-        # Threshold is 0.9 for correctness
-        if ratio >= 0.9:
-            idx = artist_names.index(match)
-            result = items[idx]
-            return pd.DataFrame({ 'name': [result['name']], 'spotify_id': [result['id']] })
-            
-        # Else return None
-        return None
+
+        return pd.DataFrame({ 'name': [result['name']], 'spotify_id': [result['id']] })
     
     # This is essentially the same as self.getArtistByName but returns the entire artist object
     def searchArtistByName(self, name):
 
-        name = name.replace('[', '').replace(',', '').replace(']', '').replace('&', ' ').split('Feat.')[0][:100]
+        name = cleanArtistName(name)
 
         if len(name) == 0:
             return None
@@ -268,140 +337,208 @@ class Spotify:
         # Query the spotify api
         items = self.searchArtists(name, limit=20)
         
-        # Check for a perfect match on first item, if we find one, just return that
-        if len(items) > 0 and items[0]['name'] == name:
-            result = items[0]
-            return result
-        
-        # Get the names from the results to prepare for fuzzy matching
-        artist_names = [i['name'] for i in items]
-        
-        # Fuzzy match
-        fuzz = Fuzz(artist_names)
-        ratio, match, _ = fuzz.check(name)
-        
-        # Threshold is 0.9 for correctness
-        if ratio >= 0.9 and match is not None:
-            idx = artist_names.index(match)
-            result = items[idx]
-            return result
-            
-        # Else return None
-        return None
+        return matchArtistByName(name, items)
     
     def searchByTitleAndArtist(self, track, artist):
         
         # Extract artist & track (and clean artist name)
-        artist = ' '.join(str(artist).replace('[', '').replace(']', '').replace('&', ' ').replace('Feat.', ' ').replace(',', ' ').replace('(', ' ').replace(')', ' ').split(' ~ ')[0].split(' - ')[0].split())[:37]
-        title = ' '.join(str(track).replace('[', '').replace(']', '').replace('&', ' ').replace(',', ' ').replace('(', ' ').replace(')', ' ').split('Feat.')[0].strip().split(' - ')[0].split())[:37]
+        title, artist = cleanTitleAndArtist(track, artist)
 
         if len(artist) == 0 or len(title) == 0:
             return None
 
+        # Don't search again for songs we couldn't find recently
+        key = titleAndArtistKey(title, artist)
+        if self.cache.known_miss(key):
+            return None
+
         # Build query
         q = 'track:{} artist:{}'.format(title, artist)
 
         track_items = self.searchTracks(q, limit=10)
 
-        """
-        STRATEGY 1:
-        Create a list of all the track names, and fuzzy match our track
-        name to all the returned tracks to see if any of them are a good
-        match.
-        Also alphabetize everything to prevent unordered consequences.
-        """
+        info = matchTrackByTitle(track, track_items)
+
+        if info is None:
+
+            track_q = 'track:{}'.format(title)
+
+            # Try searching by just the track name
+            track_items = self.searchTracks(track_q, limit=20)
+
+            # If we still haven't found anything, this is None
+            info = matchTrackByArtist(artist, track_items)
+
+        if info is None:
+            self.cache.record_miss(key)
+        else:
+            self.cache.clear_miss(key)
+
+        return info
+    
+"""
 
-        # If we got results, proceed with this strategy
-        if len(track_items) > 0:
+    Functions for matching search results, shared with AsyncSpotify
 
-            # Create fuzzy set for checking results against our track name
-            tracknames = []
-            artists = []
-            for i in range(len(track_items)):
+"""
 
-                tracknames.append(track_items[i]['name'])
+def cleanArtistName(name):
+    return name.replace('[', '').replace(',', '').replace(']', '').replace('&', ' ').split('Feat.')[0][:100]
 
-                sub_artists = []
-                if track_items[i]['artists'] is not None and len(track_items[i]['artists']) > 0:
-                    for a in track_items[i]['artists']:
-                        sub_artists.append(a['name'])
-                    artists.append(' '.join(sub_artists))
+def matchArtistByName(name, items):
 
-            # Create trackname Fuzz
-            tracks_fuzz = Fuzz(tracknames)
+    """
+        Pick the artist out of search results for this (cleaned) name, None if there isn't a good match.
+    """
 
-            # Check our track name against Fuzz
-            track_ratio, track_match, _ = tracks_fuzz.check(track)
+    # Check for a perfect match on first item, if we find one, just return that
+    if len(items) > 0 and items[0]['name'] == name:
+        result = items[0]
+        return result
+    
+    # Get the names from the results to prepare for fuzzy matching
+    artist_names = [i['name'] for i in items]
+    
+    # Fuzzy match
+    ratios, matches, _ = Fuzz(artist_names).check_many([name])
+    ratio, match = ratios[0], matches[0]
+    
+    # Threshold is 0.9 for correctness
+    if ratio >= 0.9 and match is not None:
+        idx = artist_names.index(match)
+        result = items[idx]
+        return result
+        
+    # Else return None
+    return None
 
-            if track_ratio >= 0.75 and track_match is not None:
+def cleanTitleAndArtist(track, artist):
 
-                idx = tracknames.index(track_match)
-                info = track_items[idx]
-                return info
+    artist = ' '.join(str(artist).replace('[', '').replace(']', '').replace('&', ' ').replace('Feat.', ' ').replace(',', ' ').replace('(', ' ').replace(')', ' ').split(' ~ ')[0].split(' - ')[0].split())[:37]
+    title = ' '.join(str(track).replace('[', '').replace(']', '').replace('&', ' ').replace(',', ' ').replace('(', ' ').replace(')', ' ').split('Feat.')[0].strip().split(' - ')[0].split())[:37]
 
-            """
-            STRATEGY 2:
-            We can do substring matching with the original results,
-            but this can be sketchy, so in order for this to pass it
-            must have a solid substring match in both the track name
-            and artist name.
-            """
+    return title, artist
 
-            # Create a Fuzz for artists as well
-            artists_fuzz = Fuzz(artists)
+def titleAndArtistKey(title, artist):
 
-            # Loop through artist/tracknames
-            for i in range(len(artists)):
+    """
+        Key we remember title / artist searches that found nothing under (see SpotifyCache.known_miss).
+    """
 
-                a = artists[i]
-                t = tracknames[i]
+    return 'title_artist:{}\t{}'.format(' '.join(title.lower().split()), ' '.join(artist.lower().split()))
 
-                artist_ratio, _, _ = artists_fuzz.check(a)
-                track_ratio, _, _ = tracks_fuzz.check(t)
+def isrcKey(isrc):
 
-                if artist_ratio >= 0.8 and track_ratio >= 0.8:
-                    info = track_items[i]
-                    return info
-        """
-        STRATEGY 3:
-        Search for just the track name in the spotify api,
-        aggregate all the artist names of all the tracks returned,
-        then fuzzy match our artist to any of the artists returned in
-        the list of tracks.
-        Again, alphabetize the resulting artist names to prevent unordered consequences.
-        """
+    """
+        Key we remember isrc searches that found nothing under (see SpotifyCache.known_miss).
+    """
 
-        track_q = 'track:{}'.format(title)
+    return 'isrc:{}'.format(isrc.strip().upper())
 
-        # Try searching by just the track name
-        track_items = self.searchTracks(track_q, limit=20)
+def trackArtists(track_items):
 
-        if len(track_items) > 0:
+    # The artist names of each track joined together
+    artists = []
+    for item in track_items:
 
-            # Transform the list of tracks' artists into an array of artists
-            artists = []
-            for item in track_items:
+        sub_artists = []
+        if item['artists'] is not None and len(item['artists']) > 0:
+            for a in item['artists']:
+                sub_artists.append(a['name'])
+            artists.append(' '.join(sub_artists))
 
-                sub_artists = []
-                if item['artists'] is not None and len(item['artists']) > 0:
-                    for a in item['artists']:
-                        sub_artists.append(a['name'])
-                    artists.append(' '.join(sub_artists))
+    return artists
 
-            # Create Fuzz for artists
-            artists_fuzz = Fuzz(artists)
+def matchTrackByTitle(track, track_items):
 
-            # Check our artist against the array
-            fuzz_ratio, fuzz_match, _ = artists_fuzz.check(artist)
+    """
+        Strategies 1 & 2 of searchByTitleAndArtist, on the results of searching by title and artist.
+    """
 
-            # A solid score for an artist name and we can assume we found it
-            if fuzz_ratio >= 0.75:
-                idx = artists.index(fuzz_match)
-                return track_items[idx]
+    """
+    STRATEGY 1:
+    Create a list of all the track names, and fuzzy match our track
+    name to all the returned tracks to see if any of them are a good
+    match.
+    Also alphabetize everything to prevent unordered consequences.
+    """
 
-        # If we still haven't found anything, return None
+    # If we got results, proceed with this strategy
+    if len(track_items) == 0:
         return None
-    
+
+    # Create fuzzy set for checking results against our track name
+    tracknames = [item['name'] for item in track_items]
+    artists = trackArtists(track_items)
+
+    # Create trackname Fuzz
+    tracks_fuzz = Fuzz(tracknames)
+
+    # Check our track name against Fuzz
+    track_ratio, track_match, _ = tracks_fuzz.check(track)
+
+    if track_ratio >= 0.75 and track_match is not None:
+
+        idx = tracknames.index(track_match)
+        info = track_items[idx]
+        return info
+
+    """
+    STRATEGY 2:
+    We can do substring matching with the original results,
+    but this can be sketchy, so in order for this to pass it
+    must have a solid substring match in both the track name
+    and artist name.
+    """
+
+    # Create a Fuzz for artists as well
+    artists_fuzz = Fuzz(artists)
+
+    # Loop through artist/tracknames
+    for i in range(len(artists)):
+
+        a = artists[i]
+        t = tracknames[i]
+
+        artist_ratio, _, _ = artists_fuzz.check(a)
+        track_ratio, _, _ = tracks_fuzz.check(t)
+
+        if artist_ratio >= 0.8 and track_ratio >= 0.8:
+            info = track_items[i]
+            return info
+
+    return None
+
+def matchTrackByArtist(artist, track_items):
+
+    """
+    STRATEGY 3:
+    Search for just the track name in the spotify api,
+    aggregate all the artist names of all the tracks returned,
+    then fuzzy match our artist to any of the artists returned in
+    the list of tracks.
+    Again, alphabetize the resulting artist names to prevent unordered consequences.
+    """
+
+    if len(track_items) == 0:
+        return None
+
+    # Transform the list of tracks' artists into an array of artists
+    artists = trackArtists(track_items)
+
+    # Create Fuzz for artists
+    artists_fuzz = Fuzz(artists)
+
+    # Check our artist against the array
+    fuzz_ratio, fuzz_match, _ = artists_fuzz.check(artist)
+
+    # A solid score for an artist name and we can assume we found it
+    if fuzz_ratio >= 0.75:
+        idx = artists.index(fuzz_match)
+        return track_items[idx]
+
+    return None
+
 """
 
     Functions for transforming the data from the Spotify API
@@ -0,0 +1,242 @@
+import json
+import os
+import sqlite3
+import threading
+from time import time
+
+from .Metrics import count_cache_hit, count_cache_miss
+
+DAY = 24 * 60 * 60
+
+# Seconds a cached response is good for, by the type of thing we asked for. Albums (copyrights, labels)
+# and audio features basically never change, anything with popularity / followers in it does.
+SPOTIFY_CACHE_TTLS = {
+    'album': 30 * DAY,
+    'audio_features': 180 * DAY,
+    'track': DAY,
+    'artist': DAY,
+    'artist_top_tracks': DAY,
+    'search': DAY
+}
+
+# Searches that found nothing are re-checked after MISS_RECHECK_BASE, doubling every time they miss again
+MISS_RECHECK_BASE = DAY
+MISS_RECHECK_MAX = 90 * DAY
+
+
+class SpotifyCache:
+
+    """
+        Local sqlite cache of spotify api responses, shared by the Spotify and AsyncSpotify clients.
+
+        Every response is stored as json under its type and key, which is the entity's id for
+        the batch endpoints (so a batch only fetches the ids we don't have yet) and the query
+        for searches. Lookups older than the type's ttl in SPOTIFY_CACHE_TTLS count as a miss.
+
+        >>> found, missing = cache.lookup('album', album_ids)
+        >>> cache.store('album', { album['id']: album for album in fetch(missing) })
+
+        It also remembers searches that found nothing (e.g. a title / artist that isn't on spotify)
+        so we don't repeat them every day. Those are re-checked on an exponential schedule:
+        1 day after the first miss, then 2, 4, 8... up to MISS_RECHECK_MAX.
+
+        >>> if cache.known_miss(key) == False:
+        >>>     res = search()
+        >>>     cache.record_miss(key) if res is None else cache.clear_miss(key)
+
+        Keeps hits / misses so we can see how much the cache saves us, skipped known misses count as hits.
+    """
+
+    def __init__(self, fullfile, ttls=SPOTIFY_CACHE_TTLS):
+
+        self.fullfile = fullfile
+        self.ttls = ttls
+
+        # Connected on first use, shared by every thread
+        self.con = None
+        self.lock = threading.Lock()
+
+        self.stats = {
+            'hits': 0,
+            'misses': 0
+        }
+
+    def connect(self):
+
+        folder = os.path.dirname(self.fullfile)
+        if folder != '' and os.path.isdir(folder) == False:
+            os.makedirs(folder)
+
+        con = sqlite3.connect(self.fullfile, timeout=30, check_same_thread=False)
+        con.execute('pragma journal_mode=wal')
+        con.execute("""
+            create table if not exists responses (
+                kind text not null,
+                key text not null,
+                body text not null,
+                created real not null,
+                primary key (kind, key)
+            )
+        """)
+        con.execute("""
+            create table if not exists misses (
+                key text primary key,
+                attempts integer not null,
+                checked real not null,
+                next_check real not null
+            )
+        """)
+
+        # Clear out whatever expired since the last run
+        now = time()
+        for kind, ttl in self.ttls.items():
+            con.execute('delete from responses where kind = ? and created < ?', (kind, now - ttl))
+        con.commit()
+
+        self.con = con
+
+    def lookup(self, kind, keys):
+
+        """
+            Returns ({ key: response } for the keys we have fresh responses for, [keys we don't]).
+        """
+
+        keys = list(keys)
+        ttl = self.ttls.get(kind)
+
+        found = {}
+        if ttl is not None and len(keys) > 0:
+
+            with self.lock:
+
+                if self.con is None:
+                    self.connect()
+
+                # Stay well under sqlite's max number of variables
+                for pos in range(0, len(keys), 500):
+                    chunk = keys[pos:pos + 500]
+                    string = 'select key, body from responses where kind = ? and created >= ? and key in ({})'.format(','.join('?' * len(chunk)))
+                    for key, body in self.con.execute(string, (kind, time() - ttl, *chunk)):
+                        found[key] = json.loads(body)
+
+        missing = [key for key in keys if key not in found]
+
+        with self.lock:
+            self.stats['hits'] += len(keys) - len(missing)
+            self.stats['misses'] += len(missing)
+
+        count_cache_hit(len(keys) - len(missing))
+        count_cache_miss(len(missing))
+
+        return found, missing
+
+    def store(self, kind, responses):
+
+        """
+            Save { key: response } for kind.
+        """
+
+        if self.ttls.get(kind) is None or len(responses) == 0:
+            return
+
+        now = time()
+        rows = [(kind, key, json.dumps(response), now) for key, response in responses.items()]
+
+        with self.lock:
+
+            if self.con is None:
+                self.connect()
+
+            self.con.executemany('insert or replace into responses (kind, key, body, created) values (?, ?, ?, ?)', rows)
+            self.con.commit()
+
+    def get(self, kind, key, fetch):
+
+        """
+            Cached response for a single key, calls fetch() and saves the result if we don't have one.
+        """
+
+        found, missing = self.lookup(kind, [key])
+
+        if len(missing) == 0:
+            return found[key]
+
+        res = fetch()
+        self.store(kind, { key: res })
+
+        return res
+
+    def get_many(self, kind, ids, fetch):
+
+        """
+            Cached entities for a list of ids, in the same order (leaving out the ones spotify doesn't have).
+            fetch(missing_ids) is only called for the ids we don't have and must return the entities with their 'id'.
+        """
+
+        found, missing = self.lookup(kind, ids)
+
+        if len(missing) > 0:
+            fetched = { i['id']: i for i in fetch(missing) }
+            self.store(kind, fetched)
+            found.update(fetched)
+
+        return [found[i] for i in ids if i in found]
+
+    def known_miss(self, key):
+
+        """
+            True if key missed before and isn't due to be re-checked yet.
+        """
+
+        with self.lock:
+
+            if self.con is None:
+                self.connect()
+
+            row = self.con.execute('select next_check from misses where key = ?', (key,)).fetchone()
+
+            known = row is not None and row[0] > time()
+            if known:
+                self.stats['hits'] += 1
+
+        if known:
+            count_cache_hit()
+
+        return known
+
+    def record_miss(self, key):
+
+        """
+            Key missed (again), push its next check back twice as far as last time.
+        """
+
+        with self.lock:
+
+            if self.con is None:
+                self.connect()
+
+            row = self.con.execute('select attempts from misses where key = ?', (key,)).fetchone()
+            attempts = 1 if row is None else row[0] + 1
+
+            now = time()
+            next_check = now + min(MISS_RECHECK_MAX, MISS_RECHECK_BASE * 2 ** (attempts - 1))
+
+            self.con.execute('insert or replace into misses (key, attempts, checked, next_check) values (?, ?, ?, ?)', (key, attempts, now, next_check))
+            self.con.commit()
+
+    def clear_miss(self, key):
+
+        with self.lock:
+
+            if self.con is None:
+                self.connect()
+
+            self.con.execute('delete from misses where key = ?', (key,))
+            self.con.commit()
+
+    def summary(self):
+
+        with self.lock:
+            stats = dict(self.stats)
+
+        return '{} hits | {} misses'.format(stats['hits'], stats['misses'])
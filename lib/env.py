@@ -10,10 +10,17 @@ LOCAL_DOWNLOAD_FOLDER                                    = os.getenv('LOCAL_DOWN
 TMP_FOLDER                                               = os.getenv('TMP_FOLDER')                                                  or './tmp'                                      # temporary files
 REPORTS_FOLDER                                           = os.getenv('REPORTS_FOLDER')                                              or './reports'                                  # folder of our pipeline's exports
 MAPPING_TABLE_FOLDER                                     = os.getenv('MAPPING_TABLE_FOLDER')                                        or './mapping_table'                            # folder to store mapping table data
+METRICS_FOLDER                                           = os.getenv('METRICS_FOLDER')                                              or './metrics'                                  # per function metrics (json lines) for each pipeline run
+UNLOAD_CACHE_FOLDER                                      = os.getenv('UNLOAD_CACHE_FOLDER')                                         or './tmp/unload_cache'                         # redshift unload results cached by Db.unload_df
+SIGNED_ARTISTS_INDEX_FOLDER                              = os.getenv('SIGNED_ARTISTS_INDEX_FOLDER')                                 or './tmp/signed_artists_index'                 # saved fuzzy index of misc.signed_artists
+SPOTIFY_CACHE_FILE                                       = os.getenv('SPOTIFY_CACHE_FILE')                                          or './tmp/spotify_cache.sqlite'                 # local cache of spotify api responses (see SpotifyCache)
 ENV_NAME                                                 = os.getenv('ENV_NAME')                                                                                                    # just the name of the environment so we know where we are
 RCA_DB_PROD                                              = os.getenv('RCA_DB_PROD')                                                                                                 # connection string to rca prod postgres db
 RCA_DB_DEV                                               = os.getenv('RCA_DB_DEV')                                                                                                  # connection string to rca dev postgres db
 REPORTING_DB                                             = os.getenv('REPORTING_DB')                                                                                                # connection string to the sony reporting db
+REPORTING_DB_MAX_CONNECTIONS                             = int(os.getenv('REPORTING_DB_MAX_CONNECTIONS')                            or 8)                                           # max connections we hold open to the reporting db at once
+SPOTIFY_REQUESTS_PER_SECOND                              = float(os.getenv('SPOTIFY_REQUESTS_PER_SECOND')                           or 10)                                          # requests per second we let through to the spotify api (shared by all clients)
+SPOTIFY_BURST                                            = float(os.getenv('SPOTIFY_BURST')                                         or 20)                                          # requests we can send at once before SPOTIFY_REQUESTS_PER_SECOND kicks in
 RAPID_API_KEY                                            = os.getenv('RAPID_API_KEY')                                                                                               # Rapid api key
 AWS_ACCESS_KEY                                           = os.getenv('AWS_ACCESS_KEY')                                                                                              # aws public key for things like uploading files to s3 bucket
 AWS_SECRET_KEY                                           = os.getenv('AWS_SECRET_KEY')                                                                                              # aws private key
@@ -2,12 +2,15 @@ from tenacity import retry, stop_after_attempt, wait_fixed
 from IPython.display import clear_output
 import Levenshtein as lev
 from datetime import datetime as dt
-from .Spotify import Spotify
+from .AsyncSpotify import AsyncSpotify
+from .Metrics import count_http_call
+from .Spotify import Spotify, isrcKey
 from urllib.request import urlopen
 from colorthief import ColorThief
 from io import BytesIO
 import pandas as pd
 import psutil
+import re
 import random
 import string
 import shutil
@@ -36,6 +39,7 @@ def getDominantColor(image_url):
     try:
 
         # Load the remote image into memory
+        count_http_call()
         with urlopen(image_url) as response:
             image_data = response.read()
 
@@ -91,6 +95,124 @@ def print_memory_usage():
     current_memory_usage = get_memory_usage()
     print(f"Current memory usage: {current_memory_usage:.2f} MB")
 
+def resolve_spotify_tracks(df, spotify, db=None, reporting_db=None):
+
+    """
+        Find the spotify track for every row of df('isrc', 'title', 'artist'), going through the cheapest sources first:
+            1. nielsen_song.spotify (db) by isrc, in one staged join
+            2. chartmetric_raw.spotify (reporting_db) by isrc for the isrcs we don't have, in one staged join
+            3. The track ids we found are hydrated with tracks() in batches of 50
+            4. isrc: searches for the rows still missing
+            5. title / artist searches for whatever is left
+
+        All the api calls of a step run concurrently. Without db / reporting_db the bulk steps are skipped.
+
+        @param spotify | AsyncSpotify
+        @returns list of spotify track objects (None where nothing matched) in the same order as df's rows
+    """
+
+    isrcs = df['isrc'].tolist()
+    tracks = [None] * len(df)
+    counts = {}
+
+    # Unique isrcs we can look up in bulk
+    unique_isrcs = pd.DataFrame({ 'isrc': df['isrc'] })
+    unique_isrcs = unique_isrcs[(unique_isrcs['isrc'].notnull()) & (unique_isrcs['isrc'] != '')].drop_duplicates().reset_index(drop=True)
+
+    # isrc -> (spotify_track_id, source)
+    track_ids = {}
+
+    if db is not None and len(unique_isrcs) > 0:
+
+        string = """
+            select distinct on (ti.isrc)
+                ti.isrc,
+                sp.spotify_track_id
+            from tmp_resolve_isrcs ti
+            join nielsen_song.spotify sp on ti.isrc = sp.isrc
+            where sp.spotify_track_id is not null and sp.spotify_track_id != ''
+            order by ti.isrc
+        """
+        with db.staging(unique_isrcs, 'tmp_resolve_isrcs', types={ 'isrc': 'text' }, analyze=True):
+            data = db.execute(string)
+
+        if data is not None:
+            track_ids.update({ row.isrc: (row.spotify_track_id, 'nielsen_song.spotify') for row in data.itertuples() })
+
+    unfound_isrcs = unique_isrcs[~unique_isrcs['isrc'].isin(list(track_ids))]
+
+    if reporting_db is not None and len(unfound_isrcs) > 0:
+
+        string = """
+            create temp table tmp_resolve_isrcs (
+                isrc text primary key
+            );
+        """
+        reporting_db.execute(string)
+        reporting_db.big_insert_redshift(unfound_isrcs, 'tmp_resolve_isrcs')
+
+        # Keep the most popular track when chartmetric has a few for the same isrc
+        string = """
+            select isrc, spotify_track_id
+            from (
+                select
+                    t.isrc,
+                    s.spotify_track_id,
+                    row_number() over (partition by t.isrc order by s.popularity_score desc) as rnk
+                from tmp_resolve_isrcs t
+                join chartmetric_raw.spotify s on t.isrc = s.isrc
+                where s.spotify_track_id is not null
+            ) q
+            where rnk = 1
+        """
+        data = reporting_db.execute(string)
+
+        # Drop the temp table to stay clean
+        reporting_db.execute('drop table tmp_resolve_isrcs')
+
+        if data is not None:
+            track_ids.update({ row.isrc: (row.spotify_track_id, 'chartmetric_raw.spotify') for row in data.itertuples() })
+
+    # Hydrate the track ids we matched, the ones spotify doesn't have anymore fall through to searching
+    hydrated = spotify.map(spotify.tracks, list(set(i for i, _ in track_ids.values())), chunksize=50)
+    hydrated = { i['id']: i for i in hydrated }
+
+    for idx, isrc in enumerate(isrcs):
+        if isrc in track_ids and track_ids[isrc][0] in hydrated:
+            spotify_track_id, source = track_ids[isrc]
+            tracks[idx] = hydrated[spotify_track_id]
+            counts[source] = counts.get(source, 0) + 1
+
+    # Search the isrcs we couldn't match, once per isrc, skipping the ones that found nothing recently
+    cache = spotify.spotify.cache
+    missing = [idx for idx in range(len(df)) if tracks[idx] is None and pd.notnull(isrcs[idx]) and isrcs[idx] != '']
+    search_isrcs = [isrc for isrc in dict.fromkeys(isrcs[idx] for idx in missing) if cache.known_miss(isrcKey(isrc)) == False]
+    res = spotify.map(spotify.searchTracks, [f'isrc:{isrc}' for isrc in search_isrcs])
+    found = { isrc: items[0] for isrc, items in zip(search_isrcs, res) if len(items) > 0 }
+
+    for isrc in search_isrcs:
+        cache.clear_miss(isrcKey(isrc)) if isrc in found else cache.record_miss(isrcKey(isrc))
+
+    for idx in missing:
+        if isrcs[idx] in found:
+            tracks[idx] = found[isrcs[idx]]
+            counts['isrc search'] = counts.get('isrc search', 0) + 1
+
+    # If we don't find anything then just resort to searching by title / artist
+    missing = [idx for idx in range(len(df)) if tracks[idx] is None]
+    res = spotify.map(spotify.searchByTitleAndArtist, [(df['title'].iat[idx], df['artist'].iat[idx]) for idx in missing])
+
+    for idx, track in zip(missing, res):
+        if track is not None:
+            tracks[idx] = track
+            counts['title / artist search'] = counts.get('title / artist search', 0) + 1
+
+    counts['unresolved'] = sum(track is None for track in tracks)
+
+    print(f'Resolved spotify tracks for {len(df) - counts["unresolved"]} of {len(df)} rows: ' + ', '.join(f'{key} {value}' for key, value in counts.items()))
+
+    return tracks
+
 def getSpotifyTrackDataFromSpotifyUsingIsrcTitleAndArtist(df):
 
     """
@@ -122,75 +244,53 @@ def getSpotifyTrackDataFromSpotifyUsingIsrcTitleAndArtist(df):
 
     def getSpotifyTrackData(df):
 
-        def attachTrackDataByRow(row):
-
-            def getByTitleAndArtist(isrc, title, artist):
-
-                res = spotify.searchByTitleAndArtist(title, artist)
-
-                if res is not None:
-                    return extractSongInfo(isrc, res)
-
-                return pd.Series(tuple([None for i in range(len(cols))]))
-
-            def extractSongInfo(isrc, song):
-
-                def get_image(arr):
-
-                    if len(arr) == 0:
-                        return ''
-                    else:
-                        arr.sort(key=lambda x: x['height'], reverse=True)
-                        return arr[0]['url']
-
-                def get_isrc(isrc, song):
+        def extractSongInfo(isrc, song):
 
-                    if isrc is not None:
-                        return isrc
+            def get_image(arr):
 
-                    if 'external_ids' in song and 'isrc' in song['external_ids']:
-                        return song['external_ids']['isrc']
-
-                    return None
+                if len(arr) == 0:
+                    return ''
+                else:
+                    arr.sort(key=lambda x: x['height'], reverse=True)
+                    return arr[0]['url']
 
-                disc_number = song['disc_number']
-                duration_ms = song['duration_ms']
-                explicit = song['explicit']
-                url = song['external_urls']['spotify'] if 'external_urls' in song and 'spotify' in song['external_urls'] else ''
-                api_url = song['href']
+            def get_isrc(isrc, song):
 
-                spotify_track_id = song['id']
-                spotify_album_id = song['album']['id']
-                spotify_artist_id = song['artists'][0]['id']
+                if isrc is not None:
+                    return isrc
 
-                is_local = song['is_local']
-                name = song['name']
-                popularity = song['popularity']
-                preview_url = song['preview_url']
-                track_number = song['track_number']
-                uri = song['uri']
-                spotify_image = get_image(song['album']['images'])
-                release_date = song['album']['release_date']
-                total_tracks = song['album']['total_tracks']
-                album_type = song['album']['type']
+                if 'external_ids' in song and 'isrc' in song['external_ids']:
+                    return song['external_ids']['isrc']
 
-                isrc = get_isrc(isrc, song)
+                return None
 
-                return pd.Series((isrc, disc_number, duration_ms, explicit, url,
-                                    api_url, spotify_track_id, spotify_artist_id, spotify_album_id, is_local,
-                                    name, popularity, preview_url, track_number, uri, album_type, spotify_image,
-                                    release_date, total_tracks))
+            disc_number = song['disc_number']
+            duration_ms = song['duration_ms']
+            explicit = song['explicit']
+            url = song['external_urls']['spotify'] if 'external_urls' in song and 'spotify' in song['external_urls'] else ''
+            api_url = song['href']
 
-            isrc = row['isrc']
+            spotify_track_id = song['id']
+            spotify_album_id = song['album']['id']
+            spotify_artist_id = song['artists'][0]['id']
 
-            if pd.notnull(isrc):
+            is_local = song['is_local']
+            name = song['name']
+            popularity = song['popularity']
+            preview_url = song['preview_url']
+            track_number = song['track_number']
+            uri = song['uri']
+            spotify_image = get_image(song['album']['images'])
+            release_date = song['album']['release_date']
+            total_tracks = song['album']['total_tracks']
+            album_type = song['album']['type']
 
-                items = spotify.searchTracks(f'isrc:{isrc}')
-                
-                if len(items) > 0:
-                    return extractSongInfo(isrc, items[0])
+            isrc = get_isrc(isrc, song)
 
-            return getByTitleAndArtist(isrc, row['title'], row['artist'])
+            return (isrc, disc_number, duration_ms, explicit, url,
+                    api_url, spotify_track_id, spotify_artist_id, spotify_album_id, is_local,
+                    name, popularity, preview_url, track_number, uri, album_type, spotify_image,
+                    release_date, total_tracks)
 
         cols = [
             'isrc',
@@ -214,7 +314,11 @@ def getSpotifyTrackDataFromSpotifyUsingIsrcTitleAndArtist(df):
             'total_tracks'
         ]
 
-        df[cols] = df.apply(attachTrackDataByRow, axis=1)
+        # Match every row to its spotify track, by isrc in bulk and then searching for the rest
+        tracks = resolve_spotify_tracks(df, AsyncSpotify(spotify))
+
+        data = [extractSongInfo(isrc, track) if track is not None else tuple([None for i in range(len(cols))]) for isrc, track in zip(df['isrc'], tracks)]
+        df[cols] = pd.DataFrame(data, index=df.index, columns=cols)
 
         return df
 
@@ -415,7 +519,87 @@ def is_array_in_string(substring_array, string):
             return True
     return False
 
-def filter_signed_artists_with_nielsen_label_list(df, db):
+def compile_label_matcher(labels):
+    """Compile a list of labels into a single regex that finds any of them in a string.
+
+    The labels are lowercased and folded into a trie, so the regex walks each string
+    once instead of checking every label one at a time (like `is_array_in_string`).
+    Build it once and use it with `match_labels`.
+
+    Parameters
+    ----------
+    labels : str[]
+        The labels to look for. Null labels are ignored.
+
+    Returns
+    -------
+    re.Pattern
+        Matches (lowercased) strings that contain any of the labels.
+
+    Examples
+    --------
+    >>> from rca.lib.functions import compile_label_matcher
+    >>> matcher = compile_label_matcher(['Columbia', 'RCA Records'])
+    >>> bool(matcher.search('2023 rca records, a division of sony'))
+    True
+    """
+
+    trie = {}
+    for label in labels:
+        if pd.isnull(label):
+            continue
+        node = trie
+        for char in str(label).lower():
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def pattern(node):
+
+        # We only care whether a string contains any label, so once a label ends we have a match
+        if '' in node:
+            return ''
+
+        branches = [re.escape(char) + pattern(child) for char, child in node.items()]
+        if len(branches) == 1:
+            return branches[0]
+
+        return '(?:' + '|'.join(branches) + ')'
+
+    # No labels should never match anything
+    if len(trie) == 0:
+        return re.compile(r'(?!)')
+
+    return re.compile(pattern(trie))
+
+def match_labels(values, matcher):
+    """Check a whole column of strings against a matcher from `compile_label_matcher`.
+
+    Parameters
+    ----------
+    values : pd.Series
+        The strings to check (e.g. nielsen labels or spotify copyrights). Nulls never match.
+    matcher : re.Pattern
+        From `compile_label_matcher`.
+
+    Returns
+    -------
+    np.ndarray[bool]
+        True where the string contains any of the labels (case insensitive).
+
+    Examples
+    --------
+    >>> from rca.lib.functions import compile_label_matcher, match_labels
+    >>> matcher = compile_label_matcher(['Columbia', 'RCA Records'])
+    >>> match_labels(pd.Series(['Columbia', 'The Orchard', None]), matcher)
+    array([ True, False, False])
+    """
+
+    values = pd.Series(values, dtype=object)
+    matches = values.str.lower().str.contains(matcher, regex=True, na=False)
+
+    return matches.to_numpy(dtype=bool)
+
+def filter_signed_artists_with_nielsen_label_list(df, db, matcher=None):
     """Filter a dataframe of artists based on the nielsen labels list in the database: `misc.nielsen_labels`
     
     This function takes in a dataframe with a `label` column which is the label name
@@ -434,6 +618,9 @@ def filter_signed_artists_with_nielsen_label_list(df, db):
         The dataframe to filter. Must have a `label` column.
     db : Db
         Database connection: rca_db_prod
+    matcher : re.Pattern, optional
+        A `compile_label_matcher` of `misc.nielsen_labels`, pass it in if you already have one
+        so we don't load and compile the list again.
     
     Returns
     -------
@@ -468,27 +655,12 @@ def filter_signed_artists_with_nielsen_label_list(df, db):
     # is released on `Columbia`, then it is a signed record.
     # However, this list does not include certain nielsen labels such as `The Orchard`
     # because we still consider that a competivie record that we could potentially go after.
-    nielsen_labels_df = db.execute('select lower(label) as label from misc.nielsen_labels')
-    nielsen_labels = nielsen_labels_df.label.values
-
-    def fn(row):
-
-        # If the `signed` column is already True, return True
-        if row['signed'] is True:
-            return True
-
-        # If the label is null, return False
-        if pd.isnull(row['label']):
-            return False
-        
-        # If the label is in the nielsen labels list, return True
-        if is_array_in_string(nielsen_labels, row['label'].lower()):
-            return True
-        
-        # Otherwise, just assume that the artist is not signed
-        return False
+    if matcher is None:
+        nielsen_labels_df = db.execute('select lower(label) as label from misc.nielsen_labels')
+        matcher = compile_label_matcher(nielsen_labels_df.label.values)
 
-    df['signed'] = df.apply(fn, axis=1)
+    # Already signed, or the label contains one of the nielsen labels (null labels aren't signed)
+    df['signed'] = (df['signed'] == True).to_numpy() | match_labels(df['label'], matcher)
 
     return df
 
@@ -1,7 +1,7 @@
 from .Db import Db
-from .Spotify import Spotify
+from .AsyncSpotify import AsyncSpotify
 from .Time import Time
-from .functions import chunker, print_memory_usage
+from .functions import print_memory_usage
 import pandas as pd
 
 def recacheSpotifyArtists():
@@ -12,7 +12,7 @@ def recacheSpotifyArtists():
     db = Db('rca_db_prod')
     db.connect()
 
-    sp = Spotify()
+    sp = AsyncSpotify()
 
     # Get list of artists to recache
     string = """
@@ -30,17 +30,10 @@ def recacheSpotifyArtists():
 
     # Extract the spotify artist ids
     spotify_artist_ids = df.spotify_artist_id.tolist()
-    chunks = chunker(spotify_artist_ids, 50) # split into chunks of 50
 
-    # Get the artist data from Spotify API
-    data = []
-    for idx, chunk in enumerate(chunks):
-        print(f'\rGetting artist chunk {idx+1} of {len(chunks)}...', end='', flush=True)
-
-        artists = sp.artists(chunk, parse=True)
-        data = [ *data, *artists ]
-
-    print('\n')
+    # Get the artist data from Spotify API, 50 artists per request
+    print(f'Getting {len(spotify_artist_ids)} artists...')
+    data = sp.map(sp.artists, spotify_artist_ids, chunksize=50, parse=True)
 
     # Convert to dataframe
     data = pd.DataFrame(data)
@@ -57,16 +50,9 @@ def recacheSpotifyArtists():
     df['followers'] = df['followers'].astype(int)
 
     # Now we have to use the same spotify artist ids to get the top tracks for each artist
-    top_tracks = []
-    for idx, spotify_artist_id in enumerate(spotify_artist_ids):
-        print(f'\rGetting top track for artist {idx+1} of {len(spotify_artist_ids)}...', end='', flush=True)
-
-        track = sp.artist_top_track(spotify_artist_id, parse=True)
-
-        if track is not None:
-            top_tracks.append(track)
-
-    print('\n')
+    print(f'Getting top track for {len(spotify_artist_ids)} artists...')
+    top_tracks = sp.map(sp.artist_top_track, spotify_artist_ids, parse=True)
+    top_tracks = [track for track in top_tracks if track is not None]
 
     # Convert to dataframe
     top_tracks = pd.DataFrame(top_tracks)
@@ -77,16 +63,9 @@ def recacheSpotifyArtists():
     # Extract the top track ids excluding null values
     top_album_ids = df['spotify_popular_album_id'].dropna().tolist()
 
-    # Split into chunks of 20
-    chunks = chunker(top_album_ids, 20)
-    data = []
-    for idx, chunk in enumerate(chunks):
-        print(f'\rGetting album chunk {idx+1} of {len(chunks)}...', end='', flush=True)
-
-        albums = sp.albums(chunk, parse=True)
-        data = [ *data, *albums ]
-
-    print('\n')
+    # Get the albums, 20 per request
+    print(f'Getting {len(top_album_ids)} albums...')
+    data = sp.map(sp.albums, top_album_ids, chunksize=20, parse=True)
 
     data = pd.DataFrame(data)
 
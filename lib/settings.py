@@ -12,6 +12,8 @@ def get_settings():
     parser = argparse.ArgumentParser()
     parser.add_argument('--date')
     parser.add_argument('--testing')
+    parser.add_argument('--workers')
+    parser.add_argument('--resume')
     args = parser.parse_args()
 
     # Determie the date that we're running for
@@ -41,10 +43,37 @@ def get_settings():
             raise Exception('Invalid argument --testing, only accepts True or False')
         is_testing = True if args.testing == 'True' else False
 
+    # Determine how many pipeline functions we're allowed to run at the same time
+    if args.workers is None:
+
+        # If we don't specify, run everything one after another like we always have
+        workers = 1
+
+    else:
+
+        if args.workers.isdigit() == False or int(args.workers) < 1:
+            raise Exception('Invalid argument --workers, must be a positive integer')
+        workers = int(args.workers)
+
+    # Determine whether we're resuming a previous run of the same date
+    if args.resume is None:
+
+        # If we don't specify, run every function from the start
+        resume = False
+
+    else:
+
+        # We can only pass 'True' or 'False'
+        if args.resume not in ['True', 'False']:
+            raise Exception('Invalid argument --resume, only accepts True or False')
+        resume = True if args.resume == 'True' else False
+
     # Build the runtime settings
     settings = {
         'date': run_date,
-        'is_testing': is_testing
+        'is_testing': is_testing,
+        'workers': workers,
+        'resume': resume
     }
 
     return settings
\ No newline at end of file